@@ -0,0 +1,309 @@
+'''
+Benchmark suite for payload building, sending and sandbox matching.
+
+    PYTHONPATH=. python benchmarks/run.py [--quick] [--output results.json]
+
+Results are printed and written as JSON so runs can be compared across
+releases.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+settings.configure(SENDGRID_API_KEY="benchmark")
+
+from django.core.mail import EmailMessage, EmailMultiAlternatives  # noqa: E402
+# Sends setting_changed, which resets the cached sandbox matcher.
+from django.test.utils import override_settings as override  # noqa: E402
+
+import sgbackend  # noqa: E402
+from sgbackend import SendGridBackend  # noqa: E402
+from sgbackend import pool as sgpool  # noqa: E402
+from sgbackend.metrics import MetricsAdapter  # noqa: E402
+from sgbackend.sandbox_settings import can_enable_sandbox_mode  # noqa: E402
+from tests.stub import StubServer  # noqa: E402
+
+
+def plain_message(i):
+    return EmailMessage(
+        subject="Hello", body="Plain text body.",
+        from_email="Sender <sender@example.com>",
+        to=["user%d@example.com" % i])
+
+
+def html_message(i):
+    msg = EmailMultiAlternatives(
+        subject="Newsletter", body="Plain text body.",
+        from_email="Sender <sender@example.com>",
+        to=["user%d@example.com" % i],
+        reply_to=["Support <support@example.com>"],
+        headers={"X-Campaign": "spring"})
+    msg.attach_alternative("<p>%s</p>" % ("Lorem ipsum " * 500), "text/html")
+    return msg
+
+
+def templated_message(i):
+    msg = EmailMessage(
+        from_email="Shop <shop@example.com>", to=["user%d@example.com" % i])
+    msg.template_id = "d-receipt"
+    msg.categories = ["receipt"]
+    msg.dynamic_data = {"order": i, "items": ["a", "b", "c"], "total": 42}
+    return msg
+
+
+def many_recipients_message(i):
+    return EmailMessage(
+        subject="Announcement", body="Body.",
+        from_email="sender@example.com",
+        to=["user%d-%d@example.com" % (i, n) for n in range(500)])
+
+
+_ATTACHMENT = os.urandom(5 * 1024 * 1024)
+
+
+# Exported report: text compresses well even once base64-encoded.
+_REPORT = b"".join(
+    b"%d,customer-%d,2024-01-%02d,%d.%02d\n" % (n, n % 997, n % 28 + 1, n % 500, n % 100)
+    for n in range(60000))
+
+
+def report_message(i):
+    msg = EmailMessage(
+        subject="Report", body="Attached.",
+        from_email="sender@example.com", to=["user%d@example.com" % i])
+    msg.attach("report.csv", _REPORT, "application/octet-stream")
+    return msg
+
+
+def attachment_message(i):
+    msg = EmailMessage(
+        subject="Report", body="Attached.",
+        from_email="sender@example.com", to=["user%d@example.com" % i])
+    msg.attach("report.pdf", _ATTACHMENT, "application/pdf")
+    return msg
+
+
+# (name, message factory, number of messages)
+MIXES = [
+    ("plain", plain_message, 2000),
+    ("html_alternatives", html_message, 2000),
+    ("templated", templated_message, 2000),
+    ("many_recipients", many_recipients_message, 50),
+    ("large_attachment", attachment_message, 10),
+]
+
+# (name, settings) of the send_messages configurations to compare.
+SEND_MODES = [
+    ("serial", {}),
+    ("pooled", {"SENDGRID_CONNECTION_POOL": True}),
+    ("pooled_8_workers", {
+        "SENDGRID_CONNECTION_POOL": True, "SENDGRID_MAX_WORKERS": 8}),
+    ("batched", {"SENDGRID_BATCH_PERSONALIZATIONS": True}),
+]
+
+
+def timed(function, repeat):
+    '''
+    Return the best wall-clock time of ``repeat`` calls.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(name, operations, seconds, **extra):
+    entry = {
+        "name": name,
+        "operations": operations,
+        "seconds": seconds,
+        "per_op_us": seconds / operations * 1e6,
+        "ops_per_second": operations / seconds,
+    }
+    entry.update(extra)
+    sys.stderr.write("%-40s %12.1f us/op %12.1f ops/s\n" % (
+        name, entry["per_op_us"], entry["ops_per_second"]))
+    return entry
+
+
+def bench_build(scale, repeat):
+    results = []
+    for mix, factory, count in MIXES:
+        count = max(int(count * scale), 1)
+        messages = [factory(i) for i in range(count)]
+        for builder in ("helpers", "direct"):
+            with override(SENDGRID_PAYLOAD_BUILDER=builder):
+                backend = SendGridBackend()
+                seconds = timed(
+                    lambda: [backend._build_sg_mail(m) for m in messages],
+                    repeat)
+            results.append(result(
+                "build/%s/%s" % (mix, builder), count, seconds))
+    return results
+
+
+def bench_send(scale, repeat, latency):
+    results = []
+    count = max(int(200 * scale), 1)
+    messages = [templated_message(i) for i in range(count)]
+    with StubServer(latency=latency) as server:
+        for mode, overrides in SEND_MODES:
+            def send():
+                backend = SendGridBackend()
+                backend.sg.host = backend.sg.client.host = server.url
+                backend.send_messages(messages)
+
+            with override(**overrides):
+                seconds = timed(send, repeat)
+            sgpool.close_pools()
+            results.append(result(
+                "send/%s" % mode, count, seconds, latency=latency))
+    return results
+
+
+# (name, settings) of the compression levels compared by bench_gzip.
+GZIP_MODES = [
+    ("identity", {}),
+    ("gzip_fast", {"SENDGRID_GZIP": True, "SENDGRID_GZIP_LEVEL": "fast"}),
+    ("gzip_balanced", {
+        "SENDGRID_GZIP": True, "SENDGRID_GZIP_LEVEL": "balanced"}),
+    ("gzip_small", {"SENDGRID_GZIP": True, "SENDGRID_GZIP_LEVEL": "small"}),
+]
+
+
+class BodySizes(MetricsAdapter):
+    '''
+    Collect the request body sizes.
+    '''
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def observe(self, name, value):
+        if name == "body_bytes":
+            self.sizes.append(value)
+
+
+def bench_gzip(scale, repeat, bandwidth):
+    '''
+    Pooled sends of attachment-heavy reports over a link limited to
+    ``bandwidth`` bytes per second.
+    '''
+    results = []
+    count = max(int(20 * scale), 1)
+    messages = [report_message(i) for i in range(count)]
+    with StubServer(bandwidth=bandwidth) as server:
+        for mode, overrides in GZIP_MODES:
+            sizes = []
+
+            def send():
+                backend = SendGridBackend(metrics=BodySizes(sizes))
+                backend.sg.host = server.url
+                backend.send_messages(messages)
+
+            with override(SENDGRID_CONNECTION_POOL=True, **overrides):
+                seconds = timed(send, repeat)
+            sgpool.close_pools()
+            results.append(result(
+                "gzip/%s" % mode, count, seconds, bandwidth=bandwidth,
+                body_bytes=sum(sizes) // repeat))
+    return results
+
+
+# (name, statement) of the imports timed by bench_import.
+IMPORTS = [
+    ("package", "import sgbackend"),
+    ("backend", "import sgbackend; sgbackend.SendGridBackend"),
+]
+
+
+def import_time(statement):
+    '''
+    Total ``-X importtime`` time of the top-level imports of ``statement``
+    in a fresh interpreter, in microseconds.
+    '''
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.STDOUT).decode("utf-8")
+    total = 0
+    for line in output.splitlines():
+        fields = line[len("import time:"):].split("|")
+        # Nested imports are indented and included in their parent's time.
+        if len(fields) == 3 and not fields[2].startswith("  ") \
+                and fields[1].strip().isdigit():
+            total += int(fields[1])
+    return total
+
+
+def bench_import(repeat):
+    '''
+    Import time of the package and the backend, best of ``repeat`` fresh
+    interpreters, without the interpreter's own startup imports.
+    '''
+    results = []
+    for name, statement in IMPORTS:
+        best = min(
+            import_time(statement) - import_time("pass")
+            for _ in range(repeat))
+        results.append(result("import/%s" % name, 1, max(best, 1) / 1e6))
+    return results
+
+
+def bench_sandbox(scale, repeat):
+    domains = ["domain%d.example.com" % i for i in range(10000)]
+    regexes = [r"^qa-%d\+.*@example\.org$" % i for i in range(100)]
+    recipients = ["user%d@domain%d.example.com" % (i, i * 97 % 10000)
+                  for i in range(max(int(1000 * scale), 1))]
+    with override(
+        SENDGRID_SANDBOX=True,
+        SENDGRID_SANDBOX_WHITELIST_DOMAINS=domains,
+        SENDGRID_SANDBOX_WHITELIST_REGEX=regexes,
+    ):
+        seconds = timed(lambda: can_enable_sandbox_mode(recipients), repeat)
+    return [result("sandbox/whitelisted_recipients", len(recipients), seconds)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--quick", action="store_true",
+                        help="run a tenth of the iterations")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="keep the best of this many runs")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds of latency injected by the stub server")
+    parser.add_argument("--bandwidth", type=float, default=10e6,
+                        help="upload bytes per second of the gzip benchmark")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+    scale = 0.1 if args.quick else 1
+
+    report = {
+        "sgbackend": sgbackend.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": (
+            bench_build(scale, args.repeat) +
+            bench_send(scale, args.repeat, args.latency) +
+            bench_gzip(scale, args.repeat, args.bandwidth) +
+            bench_import(args.repeat) +
+            bench_sandbox(scale, args.repeat)
+        ),
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
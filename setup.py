@@ -15,6 +15,7 @@ setup(
     description='SendGrid Backend for Django',
     long_description=open('./README.rst').read(),
     install_requires=["sendgrid >= 5, < 6"],
+    extras_require={"async": ["aiohttp"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Web Environment",
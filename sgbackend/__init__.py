@@ -1,2 +1,36 @@
-from .mail import SendGridBackend  # pragma: no cover
+import sys  # pragma: no cover
+
 from .version import __version__  # pragma: no cover
+
+# Backends are imported on first access, so that importing the package (as
+# an installed app, for instance) does not load the SendGrid client.
+_LAZY_ATTRIBUTES = {  # pragma: no cover
+    "SendGridBackend": "mail",
+    "QueuedSendGridBackend": "queued",
+}
+if sys.version_info >= (3, 5):  # pragma: no cover
+    _LAZY_ATTRIBUTES["AsyncSendGridBackend"] = "aio"
+
+__all__ = ["__version__"] + sorted(_LAZY_ATTRIBUTES)  # pragma: no cover
+
+if sys.version_info >= (3, 7):  # pragma: no cover
+    def __getattr__(name):
+        module = _LAZY_ATTRIBUTES.get(name)
+        if module is None:
+            raise AttributeError(
+                "module %r has no attribute %r" % (__name__, name))
+        # A relative import statement equivalent, so that the import shows
+        # up in -X importtime.
+        module = __import__(module, globals(), None, [name], 1)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+else:  # pragma: no cover
+    # Module __getattr__ needs Python 3.7.
+    from .mail import SendGridBackend
+    from .queued import QueuedSendGridBackend
+    if sys.version_info >= (3, 5):
+        from .aio import AsyncSendGridBackend
@@ -0,0 +1,86 @@
+'''
+Address parsing and local recipient validation.
+
+The same sender and reply-to strings come back message after message; their
+parsed form is kept in a bounded LRU cache. Recipients rarely repeat and are
+parsed as they come.
+'''
+import re
+
+try:
+    import rfc822
+except ImportError:
+    import email.utils as rfc822
+
+from sgbackend.cache import LRUCache
+
+# Maximum number of parsed addresses kept.
+ADDRESS_CACHE_SIZE = 4096
+
+# Unquoted local part, and a domain of at least two labels.
+ADDRESS_RE = re.compile(
+    r'^[^\s@"(),:;<>\[\\\]]+@'
+    r'(?:[^\s@"(),:;<>\[\\\].]+\.)+[^\s@"(),:;<>\[\\\].]{2,}$', re.UNICODE)
+
+_parsed = LRUCache(ADDRESS_CACHE_SIZE)
+
+
+class InvalidRecipientsError(ValueError):
+    '''
+    Error of a message with invalid recipient addresses, when
+    SENDGRID_VALIDATE_RECIPIENTS is "reject".
+    '''
+    def __init__(self, addresses):
+        super(InvalidRecipientsError, self).__init__(
+            'Invalid recipient addresses: %s' % ', '.join(addresses))
+        self.addresses = addresses
+
+
+def parse(address):
+    '''
+    Return the ``(name, address, valid)`` triple of ``"Name <address>"``.
+    '''
+    name, email = rfc822.parseaddr(address)
+    return name, email, ADDRESS_RE.match(email) is not None
+
+
+def parseaddr(address):
+    '''
+    Memoized ``email.utils.parseaddr``, for sender and reply-to addresses.
+    '''
+    parsed = _parsed.get(address)
+    if parsed is None:
+        parsed = rfc822.parseaddr(address)
+        _parsed.set(address, parsed)
+    return parsed
+
+
+def clean_recipients(fields, exclude=(), validate=False):
+    '''
+    Filter the address lists of ``fields`` (to, cc and bcc): leave out the
+    addresses in ``exclude`` and, when ``validate`` is True, the invalid
+    addresses and the repeats of an address, which SendGrid rejects.
+    Returns the filtered lists and the invalid addresses.
+    '''
+    if not exclude and not validate:
+        return fields, []
+    seen = set()
+    invalid = []
+    cleaned = []
+    for addresses in fields:
+        kept = []
+        for address in addresses:
+            if address in exclude:
+                continue
+            if validate:
+                name, email, valid = parse(address)
+                if not valid:
+                    invalid.append(address)
+                    continue
+                key = email.lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(address)
+        cleaned.append(kept)
+    return cleaned, invalid
@@ -0,0 +1,181 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from python_http_client.exceptions import HTTPError
+
+from sgbackend import payload, signals
+from sgbackend.deadline import (
+    DeadlineExceededError, deadline, expired, remaining)
+from sgbackend.mail import _DEADLINE_EXCEEDED, SendGridBackend
+from sgbackend.pool import http_error
+from sgbackend.results import SendResult, SendStats, message_id
+from sgbackend.streaming import materialize
+from sgbackend.transports import HTTPTransport
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+class AsyncSendGridBackend(SendGridBackend):
+    '''
+    SendGrid Web API Backend with an asyncio ``asend_messages``.
+
+    Payloads are built exactly like SendGridBackend's; the requests are
+    posted with aiohttp on the running event loop, at most
+    ``SENDGRID_ASYNC_CONCURRENCY`` at a time. The blocking
+    ``send_messages`` is inherited unchanged.
+    '''
+    if aiohttp is not None:
+        circuit_errors = SendGridBackend.circuit_errors + (
+            aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super(AsyncSendGridBackend, self).__init__(
+            fail_silently=fail_silently, **kwargs)
+        if aiohttp is None:
+            raise ImproperlyConfigured('''
+                AsyncSendGridBackend requires aiohttp to be installed''')
+        # Defaults to the API client's host.
+        self.host = kwargs.get('host')
+        self.max_concurrency = kwargs.get(
+            'max_concurrency',
+            getattr(settings, "SENDGRID_ASYNC_CONCURRENCY", 10))
+
+    async def asend_messages(self, emails, timeout=None):
+        '''
+        Send the messages concurrently and return the number of messages
+        sent. Messages are annotated like with ``send_messages``, and
+        ``timeout`` bounds the call the same way.
+        '''
+        self.failed_messages = []
+        self.stats = SendStats()
+        if not emails:
+            return
+
+        started = time.time()
+        if timeout is None:
+            timeout = self.send_timeout
+        until = deadline(timeout)
+        if self.suppression is not None:
+            # Reading the source blocks (and Django's ORM refuses to run
+            # on the event loop).
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.suppression.maybe_refresh)
+        requests = self._requests(emails)
+        semaphore = asyncio.Semaphore(max(int(self.max_concurrency or 1), 1))
+        host = self.host or self.sg.host
+        headers = dict(self.sg.client.request_headers)
+        headers['Content-Type'] = 'application/json'
+        async with aiohttp.ClientSession(
+                headers=headers, timeout=self._aiohttp_timeout()) as session:
+            results = await asyncio.gather(*[
+                self._asend(session, semaphore, host, request, until)
+                for request in requests
+            ])
+        return self._collect(requests, results, time.time() - started)
+
+    def _aiohttp_timeout(self, total=None):
+        return aiohttp.ClientTimeout(
+            total=total, sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout)
+
+    async def _asend(self, session, semaphore, host, request, deadline=None):
+        '''
+        Post a single request and return its SendResult. Exceptions fail
+        the request, like HTTP errors, rather than the whole call.
+        '''
+        messages, mail = request
+        result = SendResult(attempts=1)
+        if expired(deadline):
+            result.attempts = 0
+            result.error = DeadlineExceededError(_DEADLINE_EXCEEDED)
+            return result
+        if mail is None:
+            try:
+                mail, result.build_time = self._build(messages[0])
+            except Exception as e:
+                result.attempts = 0
+                result.error = e
+                return result
+        if self._skip_request(messages, mail, result):
+            return result
+        instrumented = self._instrumented()
+        if instrumented:
+            signals.pre_send.send(
+                sender=self.__class__, backend=self, messages=messages,
+                mail=mail)
+        async with semaphore:
+            # Asked once a slot is free, after the outcomes of the
+            # requests ahead.
+            if expired(deadline):
+                result.attempts = 0
+                result.error = DeadlineExceededError(_DEADLINE_EXCEEDED)
+            elif not self._circuit_allows():
+                result.attempts = 0
+                # The fallback backend blocks.
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._divert, messages, result)
+            else:
+                try:
+                    if not isinstance(self.transport, HTTPTransport):
+                        await self._asend_transport(
+                            mail, result, remaining(deadline))
+                    else:
+                        await self._apost(
+                            session, host, mail, result, remaining(deadline))
+                except Exception as e:
+                    # Connection errors and the like.
+                    self._circuit_record(e, None)
+                    if expired(deadline):
+                        # Cut short by the deadline.
+                        e = DeadlineExceededError(_DEADLINE_EXCEEDED)
+                    result.error = e
+                else:
+                    self._circuit_record(result.error, result.latency)
+        if instrumented:
+            self._record(messages, mail, result)
+        return result
+
+    async def _asend_transport(self, mail, result, timeout=None):
+        '''
+        Send through a non-HTTP transport in the default executor.
+        '''
+        started = time.time()
+        loop = asyncio.get_event_loop()
+        try:
+            response = await loop.run_in_executor(
+                None, self.transport.send, mail, result, timeout)
+        except HTTPError as e:
+            result.status_code = getattr(e, 'status_code', None)
+            result.error = e
+        else:
+            result.status_code = response.status_code
+            result.message_id = message_id(response.headers)
+        result.latency = time.time() - started
+
+    async def _apost(self, session, host, mail, result, timeout=None):
+        started = time.time()
+        headers = {}
+        # Streaming chunks to aiohttp takes an async generator (Python
+        # 3.6+): the body is serialized whole.
+        body = self._compress(payload.dumps(materialize(mail)), headers)
+        result.serialize_time = time.time() - started
+        result.body_size = len(body)
+        started = time.time()
+        async with session.post(
+            host + '/v3/mail/send', data=body, headers=headers,
+            timeout=self._aiohttp_timeout(timeout)
+        ) as response:
+            body = await response.read()
+            result.latency = time.time() - started
+            result.status_code = response.status
+            if response.status >= 400:
+                result.error = http_error(
+                    response.status, response.reason, body,
+                    response.headers)
+            else:
+                result.message_id = message_id(response.headers)
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    '''
+    Error of a request refused because the circuit breaker is open.
+    '''
+
+
+class CircuitBreaker(object):
+    '''
+    Thread-safe circuit breaker around SendGrid requests.
+
+    Closed, it lets requests through and keeps the outcome of the last
+    ``window`` ones; a request failed if it raised a connection error or
+    got a 5xx response, or took more than ``latency`` seconds. Once
+    ``min_requests`` outcomes are known and the share of failures reaches
+    ``error_rate``, the breaker opens and refuses requests for
+    ``recovery_time`` seconds. It then lets one probe request through
+    (half-open): its success closes the breaker, its failure opens it
+    again.
+
+    ``allow()`` and ``record()`` call ``on_change(previous, state)`` when
+    they change the state.
+    '''
+    def __init__(self, error_rate=0.5, latency=None, window=20,
+                 min_requests=10, recovery_time=30):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.window = window
+        self.min_requests = min_requests
+        self.recovery_time = recovery_time
+        self.state = CLOSED
+        self.opened_at = 0
+        self._outcomes = deque()
+        self._failures = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self, on_change=None):
+        '''
+        Return whether a request may be made now.
+        '''
+        with self._lock:
+            previous = self.state
+            if self.state == OPEN and \
+                    time.time() - self.opened_at >= self.recovery_time:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                allowed = True
+            elif self.state == HALF_OPEN and not self._probing:
+                self._probing = allowed = True
+            else:
+                allowed = False
+            state = self.state
+        if on_change is not None and state != previous:
+            on_change(previous, state)
+        return allowed
+
+    def record(self, failed, latency=None, on_change=None):
+        '''
+        Record the outcome of an allowed request.
+        '''
+        if self.latency is not None and latency is not None \
+                and latency > self.latency:
+            failed = True
+        with self._lock:
+            previous = self.state
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._set_state(OPEN if failed else CLOSED)
+            elif self.state == CLOSED:
+                self._outcomes.append(failed)
+                self._failures += failed
+                if len(self._outcomes) > self.window:
+                    self._failures -= self._outcomes.popleft()
+                count = len(self._outcomes)
+                if count >= self.min_requests and \
+                        self._failures >= self.error_rate * count:
+                    self._set_state(OPEN)
+            # Requests let through before the breaker opened are ignored.
+            state = self.state
+        if on_change is not None and state != previous:
+            on_change(previous, state)
+
+    def _set_state(self, state):
+        self.state = state
+        self._outcomes.clear()
+        self._failures = 0
+        if state == OPEN:
+            self.opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(key, **kwargs):
+    '''
+    Return the process-wide CircuitBreaker for ``key``, configured with
+    ``kwargs``.
+    '''
+    config = sorted(kwargs.items())
+    with _breakers_lock:
+        breaker, breaker_config = _breakers.get(key, (None, None))
+        if breaker is None or breaker_config != config:
+            breaker = CircuitBreaker(**kwargs)
+            _breakers[key] = (breaker, config)
+        return breaker
@@ -0,0 +1,202 @@
+'''
+Bulk sending of one template to many recipients, used by
+``manage.py sendgrid_bulk_send``.
+
+Recipients are read lazily from a CSV or JSON lines file and packed into
+requests of up to MAX_PERSONALIZATIONS personalizations. Requests are
+posted by a pool of processes, each with its own pooled SendGridBackend,
+and the index of every sent request is appended to a checkpoint file so an
+interrupted run can resume where it stopped.
+'''
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+
+from sgbackend.mail import MAX_PERSONALIZATIONS, SendGridBackend
+from sgbackend.payload import email_dict
+from sgbackend.sandbox_settings import can_enable_sandbox_mode
+
+
+def read_recipients(path, format=None):
+    '''
+    Yield ``(email, name, data)`` for each recipient of a CSV file (an
+    ``email`` column, an optional ``name`` column, every other column is
+    template data) or a JSON lines file (``{"email": ..., "name": ...,
+    "data": {...}}``).
+    '''
+    if format is None:
+        format = 'csv' if path.endswith('.csv') else 'jsonl'
+    with io.open(path, encoding='utf-8', newline='') as f:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                email = row.pop('email')
+                name = row.pop('name', None) or None
+                yield email, name, row
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                yield row['email'], row.get('name'), row.get('data', {})
+
+
+def batches(recipients, size=MAX_PERSONALIZATIONS):
+    '''
+    Yield ``(index, recipients)`` chunks of up to ``size`` recipients.
+    '''
+    size = min(size, MAX_PERSONALIZATIONS)
+    batch = []
+    index = 0
+    for recipient in recipients:
+        batch.append(recipient)
+        if len(batch) == size:
+            yield index, batch
+            index += 1
+            batch = []
+    if batch:
+        yield index, batch
+
+
+def build_payload(template, recipients):
+    '''
+    Build a request sending ``template`` (a dict with ``from_email`` and
+    ``template_id``, and optional ``subject`` and ``categories``) to every
+    recipient, one personalization each.
+    '''
+    mail = {
+        "from": email_dict(template["from_email"]),
+        "template_id": template["template_id"],
+        "personalizations": [
+            {"to": [email_dict(email, name)], "dynamic_template_data": data}
+            for email, name, data in recipients
+        ],
+    }
+    if template.get("subject"):
+        mail["subject"] = template["subject"]
+    if template.get("categories"):
+        mail["categories"] = list(template["categories"])
+    mail_settings = {}
+    if can_enable_sandbox_mode([email for email, name, data in recipients]):
+        mail_settings["sandbox_mode"] = {"enable": True}
+    mail["mail_settings"] = mail_settings
+    return mail
+
+
+def unsuppressed(recipients, suppression):
+    '''
+    Leave out the recipients in ``suppression`` (a SuppressionList, or
+    None).
+    '''
+    if suppression is None:
+        return recipients
+    suppressed = set(suppression.suppressed(
+        [email for email, name, data in recipients]))
+    if not suppressed:
+        return recipients
+    return [r for r in recipients if r[0] not in suppressed]
+
+
+class Checkpoint(object):
+    '''
+    Append-only record of the sent batches of a run.
+    '''
+    def __init__(self, path, batch_size):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                header = f.readline().strip()
+                if header and header != 'batch_size=%d' % batch_size:
+                    raise ValueError(
+                        'Checkpoint %s was written with %s; resume with the '
+                        'same batch size.' % (path, header))
+                self.done.update(int(line) for line in f if line.strip())
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+            self.file.write('batch_size=%d\n' % batch_size)
+            self.file.flush()
+
+    def __contains__(self, index):
+        return index in self.done
+
+    def add(self, index):
+        self.done.add(index)
+        self.file.write('%d\n' % index)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+_backend = None
+
+
+def _init_worker():
+    global _backend
+    _backend = SendGridBackend(use_pool=True)
+    _backend.open()
+
+
+def _send_batch(args):
+    '''
+    Post one batch from a worker; returns ``(index, count, error)``.
+    '''
+    index, template, recipients = args
+    if _backend is None:
+        _init_worker()
+    recipients = unsuppressed(recipients, _backend.suppression)
+    if not recipients:
+        return index, 0, None
+    try:
+        error = _backend._send(([], build_payload(template, recipients))).error
+    except Exception as e:
+        error = e
+    return index, len(recipients), None if error is None else repr(error)
+
+
+def bulk_send(template, recipients, checkpoint, batch_size=MAX_PERSONALIZATIONS,
+              processes=None, progress=None):
+    '''
+    Send ``template`` to every recipient not yet recorded in
+    ``checkpoint`` and not suppressed (see sgbackend.suppression); sent
+    counts the recipients posted. ``progress`` is called with ``(sent, failed, elapsed)``
+    after every batch. Returns ``(sent, failed, skipped, elapsed)`` counts
+    of recipients.
+    '''
+    sent = failed = 0
+    # Recipients of batches sent by a previous run, counted as they are read.
+    skipped = [0]
+
+    def pending():
+        for index, batch in batches(recipients, batch_size):
+            if index in checkpoint:
+                skipped[0] += len(batch)
+                continue
+            yield index, template, batch
+
+    start = time.time()
+    if processes == 1:
+        results = (_send_batch(job) for job in pending())
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        results = pool.imap_unordered(_send_batch, pending())
+    try:
+        for index, count, error in results:
+            if error is None:
+                checkpoint.add(index)
+                sent += count
+            else:
+                failed += count
+            if progress is not None:
+                progress(sent, failed, time.time() - start)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return sent, failed, skipped[0], time.time() - start
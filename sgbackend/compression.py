@@ -0,0 +1,45 @@
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Named bandwidth-vs-CPU tradeoffs for SENDGRID_GZIP_LEVEL.
+GZIP_LEVELS = {
+    "fast": 1,
+    "balanced": 6,
+    "small": 9,
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def gzip_level(value):
+    '''
+    Return the zlib level of a SENDGRID_GZIP_LEVEL value: a name of
+    GZIP_LEVELS or an integer from 1 to 9.
+    '''
+    level = GZIP_LEVELS.get(value, value)
+    if isinstance(level, bool) or not isinstance(level, int) or \
+            not 1 <= level <= 9:
+        raise ImproperlyConfigured('''
+            SENDGRID_GZIP_LEVEL must be "fast", "balanced", "small" or an
+            integer from 1 to 9''')
+    return level
+
+
+def gzip_body(body, level=GZIP_LEVELS["fast"], chunk_size=CHUNK_SIZE):
+    '''
+    Gzip a request body: bytes, or a file-like object such as a
+    StreamingBody, which is compressed as it is read.
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if hasattr(body, 'read'):
+        parts = []
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                break
+            parts.append(compressor.compress(chunk))
+    else:
+        parts = [compressor.compress(body)]
+    parts.append(compressor.flush())
+    return b''.join(parts)
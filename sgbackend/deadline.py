@@ -0,0 +1,38 @@
+import time
+
+try:
+    # Deadlines are unaffected by changes of the system clock.
+    _clock = time.monotonic
+except AttributeError:  # pragma: no cover
+    _clock = time.time
+
+
+class DeadlineExceededError(Exception):
+    '''
+    Error of a request that was not attempted, or was cut short, because
+    the deadline of its ``send_messages`` call had passed.
+    '''
+
+
+def deadline(seconds):
+    '''
+    Return the time ``seconds`` from now, or None for no deadline. The time
+    is on a monotonic clock: only compare it through ``remaining`` and
+    ``expired``.
+    '''
+    if seconds is None:
+        return None
+    return _clock() + seconds
+
+
+def remaining(deadline):
+    '''
+    Seconds left until ``deadline`` (never negative), or None.
+    '''
+    if deadline is None:
+        return None
+    return max(deadline - _clock(), 0)
+
+
+def expired(deadline):
+    return deadline is not None and _clock() >= deadline
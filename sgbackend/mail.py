@@ -1,20 +1,38 @@
+from sgbackend import addresses, payload, signals
+from sgbackend.breaker import CircuitOpenError, get_circuit_breaker
+from sgbackend.cache import LRUCache
+from sgbackend.compression import gzip_body, gzip_level
+from sgbackend.deadline import (
+    DeadlineExceededError, deadline, expired, remaining)
+from sgbackend.metrics import get_metrics, recipient_count
+from sgbackend.pool import ConnectionPool, _shortest, get_pool
+from sgbackend.ratelimit import backoff, get_token_bucket, retry_after
+from sgbackend.results import SendResult, SendStats, message_id
 from sgbackend.sandbox_settings import can_enable_sandbox_mode
+from sgbackend.streaming import StreamingBody, materialize
+from sgbackend.suppression import get_suppression_list
+from sgbackend.transports import get_transport
 from .version import __version__
 
-import base64
-import sys
+import copy
+import functools
+import json
+import socket
+import time
 from email.mime.base import MIMEBase
+from multiprocessing.pool import ThreadPool
 from python_http_client.exceptions import HTTPError
 
 try:
-    import rfc822
-except ImportError:
-    import email.utils as rfc822
+    import http.client as httplib
+except ImportError:  # pragma: no cover
+    import httplib
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.mail import EmailMultiAlternatives
 from django.core.mail.backends.base import BaseEmailBackend
+from django.utils.module_loading import import_string
 
 import sendgrid
 from sendgrid.helpers.mail import (
@@ -31,11 +49,60 @@ from sendgrid.helpers.mail import (
     BypassListManagement
 )
 
+# Maximum number of personalizations accepted by a single v3 mail/send call.
+MAX_PERSONALIZATIONS = 1000
+# Maximum number of to, cc and bcc recipients of a single call, across its
+# personalizations.
+MAX_RECIPIENTS = 1000
+
+_DEADLINE_EXCEEDED = 'send_messages deadline exceeded'
+
+# Content-Type of the API client's requests. python_http_client serializes
+# request bodies itself unless the Content-Type differs from
+# "application/json", in which case it posts ``request_body.encode()``.
+_JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+_payload_cache = None
+
+
+def _expired():
+    '''
+    SendResult of a request left unsent by its deadline.
+    '''
+    return SendResult(error=DeadlineExceededError(_DEADLINE_EXCEEDED))
+
+
+class _JSONBody(dict):
+    '''
+    A request body already serialized to JSON. The API client posts the
+    serialized bytes; the mapping is kept for whoever inspects the body.
+    '''
+    def __init__(self, mail, data=None):
+        super(_JSONBody, self).__init__(mail)
+        self.data = payload.dumps(mail) if data is None else data
+
+    def encode(self, encoding='utf-8'):
+        return self.data
+
+
+def get_payload_cache(maxsize=128):
+    '''
+    Return the process-wide cache of built payloads.
+    '''
+    global _payload_cache
+    if _payload_cache is None or _payload_cache.maxsize != maxsize:
+        _payload_cache = LRUCache(maxsize)
+    return _payload_cache
+
 
 class SendGridBackend(BaseEmailBackend):
     '''
     SendGrid Web API Backend
     '''
+    # Exceptions of a request that count as failures for the circuit
+    # breaker, besides 5xx responses: connection errors and timeouts.
+    circuit_errors = (socket.error, IOError, httplib.HTTPException)
+
     def __init__(self, fail_silently=False, **kwargs):
         super(SendGridBackend, self).__init__(
             fail_silently=fail_silently, **kwargs)
@@ -48,31 +115,756 @@ class SendGridBackend(BaseEmailBackend):
             raise ImproperlyConfigured('''
                 SENDGRID_API_KEY must be declared in settings.py''')
 
-        self.sg = sendgrid.SendGridAPIClient(apikey=self.api_key)
+        # The API client is created on first use (see the sg property).
+        self._sg = None
         self.version = 'sendgrid/{0};django'.format(__version__)
-        self.sg.client.request_headers['User-agent'] = self.version
 
-    def send_messages(self, emails):
+        # Number of threads used to post a batch concurrently. 1 (the
+        # default) keeps the original serial behaviour.
+        self.max_workers = kwargs.get(
+            'max_workers', getattr(settings, "SENDGRID_MAX_WORKERS", 1))
+        # Merge messages that only differ in their recipients or template
+        # data into one request with several personalizations.
+        self.batch_personalizations = kwargs.get(
+            'batch_personalizations',
+            getattr(settings, "SENDGRID_BATCH_PERSONALIZATIONS", False))
+        # Keep-alive connection pool, shared between backends of the
+        # process unless SENDGRID_POOL_SHARED is False.
+        self.use_pool = kwargs.get(
+            'use_pool', getattr(settings, "SENDGRID_CONNECTION_POOL", False))
+        self.pool_shared = getattr(settings, "SENDGRID_POOL_SHARED", True)
+        self.pool_size = getattr(settings, "SENDGRID_POOL_SIZE", 10)
+        self.pool_idle_timeout = getattr(
+            settings, "SENDGRID_POOL_IDLE_TIMEOUT", 60)
+        self.pool = None
+        # Seconds allowed to connect and per socket operation, and overall
+        # for a send_messages call. None waits forever.
+        self.connect_timeout = getattr(
+            settings, "SENDGRID_CONNECT_TIMEOUT", None)
+        self.read_timeout = getattr(settings, "SENDGRID_READ_TIMEOUT", None)
+        self.send_timeout = getattr(settings, "SENDGRID_SEND_TIMEOUT", None)
+        # "helpers" builds payloads through sendgrid.helpers.mail, "direct"
+        # writes the same dicts without the intermediate helper objects.
+        self.payload_builder = getattr(
+            settings, "SENDGRID_PAYLOAD_BUILDER", "helpers")
+        if self.payload_builder not in ("helpers", "direct"):
+            raise ImproperlyConfigured('''
+                SENDGRID_PAYLOAD_BUILDER must be "helpers" or "direct"''')
+        # Encode attachments chunk by chunk while the request body is sent
+        # instead of holding their whole base64 text in memory.
+        self.stream_attachments = getattr(
+            settings, "SENDGRID_STREAM_ATTACHMENTS", False)
+        # Gzip pooled request bodies of at least SENDGRID_GZIP_THRESHOLD
+        # bytes.
+        self.gzip = getattr(settings, "SENDGRID_GZIP", False)
+        self.gzip_threshold = getattr(
+            settings, "SENDGRID_GZIP_THRESHOLD", 16 * 1024)
+        self.gzip_level = gzip_level(
+            getattr(settings, "SENDGRID_GZIP_LEVEL", "fast"))
+        # Cache of encoded attachment contents, keyed by their hash and
+        # bounded by SENDGRID_ATTACHMENT_CACHE_SIZE bytes.
+        self.attachment_cache = None
+        if getattr(settings, "SENDGRID_ATTACHMENT_CACHE", False):
+            self.attachment_cache = payload.get_attachment_cache(getattr(
+                settings, "SENDGRID_ATTACHMENT_CACHE_SIZE", 64 * 1024 * 1024))
+        # Cache of the recipient-independent part of built payloads.
+        self.payload_cache = None
+        if getattr(settings, "SENDGRID_PAYLOAD_CACHE", False):
+            self.payload_cache = get_payload_cache(
+                getattr(settings, "SENDGRID_PAYLOAD_CACHE_SIZE", 128))
+        # Client-side limit of requests per second, shared by the threads
+        # of the process.
+        self.rate_limit = getattr(settings, "SENDGRID_RATE_LIMIT", None)
+        self.rate_limiter = None
+        if self.rate_limit:
+            self.rate_limiter = get_token_bucket(
+                self.api_key, self.rate_limit,
+                getattr(settings, "SENDGRID_RATE_LIMIT_BURST", None))
+        # Retries of 429 and 5xx responses.
+        self.max_retries = kwargs.get(
+            'max_retries', getattr(settings, "SENDGRID_MAX_RETRIES", 0))
+        self.retry_backoff = getattr(settings, "SENDGRID_RETRY_BACKOFF", 0.5)
+        self.retry_backoff_max = getattr(
+            settings, "SENDGRID_RETRY_BACKOFF_MAX", 30)
+        # Process-wide circuit breaker failing requests fast, or diverting
+        # them to SENDGRID_CIRCUIT_FALLBACK, while SendGrid is degraded.
+        self.circuit_breaker = None
+        if getattr(settings, "SENDGRID_CIRCUIT_BREAKER", False):
+            self.circuit_breaker = get_circuit_breaker(
+                self.api_key,
+                error_rate=getattr(
+                    settings, "SENDGRID_CIRCUIT_ERROR_RATE", 0.5),
+                latency=getattr(settings, "SENDGRID_CIRCUIT_LATENCY", None),
+                window=getattr(settings, "SENDGRID_CIRCUIT_WINDOW", 20),
+                min_requests=getattr(
+                    settings, "SENDGRID_CIRCUIT_MIN_REQUESTS", 10),
+                recovery_time=getattr(
+                    settings, "SENDGRID_CIRCUIT_RECOVERY_TIME", 30))
+        self.circuit_fallback = None
+        fallback = getattr(settings, "SENDGRID_CIRCUIT_FALLBACK", None)
+        if fallback:
+            try:
+                self.circuit_fallback = import_string(fallback)
+            except ImportError as e:
+                raise ImproperlyConfigured(
+                    'SENDGRID_CIRCUIT_FALLBACK %r could not be imported: %s'
+                    % (fallback, e))
+        # Metrics adapter receiving the timings and sizes of each request.
+        if 'metrics' in kwargs:
+            self.metrics = kwargs['metrics']
+        else:
+            self.metrics = get_metrics()
+        # Local index of bounced, unsubscribed and spam-reporting addresses
+        # left out of the personalizations.
+        self.suppression = get_suppression_list()
+        # "drop" leaves invalid recipient addresses out, "reject" fails
+        # their messages without posting them. Both drop duplicates.
+        self.validate_recipients = getattr(
+            settings, "SENDGRID_VALIDATE_RECIPIENTS", None)
+        if self.validate_recipients not in (None, False, "drop", "reject"):
+            raise ImproperlyConfigured('''
+                SENDGRID_VALIDATE_RECIPIENTS must be "drop" or "reject"''')
+        # Where payloads go: the API, a capture file or a fake.
+        self.transport = get_transport(self)
+        # Messages of the last send_messages call that were not sent, and
+        # the statistics of that call.
+        self.failed_messages = []
+        self.stats = SendStats()
+
+    @property
+    def sg(self):
+        '''
+        The SendGridAPIClient, created on first use.
+        '''
+        if self._sg is None:
+            sg = sendgrid.SendGridAPIClient(apikey=self.api_key)
+            sg.client.request_headers['User-agent'] = self.version
+            sg.client.timeout = self._urllib_timeout()
+            self.sg = sg
+        return self._sg
+
+    @sg.setter
+    def sg(self, value):
+        if value is not None:
+            # Bodies are posted as serialized by _post (see _JSONBody).
+            value.client.request_headers['Content-Type'] = _JSON_CONTENT_TYPE
+        self._sg = value
+
+    def _urllib_timeout(self):
         '''
-        Comments
+        Timeout of the API client: urllib has a single timeout, for
+        connecting and reading.
+        '''
+        timeouts = [
+            t for t in (self.connect_timeout, self.read_timeout)
+            if t is not None]
+        return max(timeouts) if timeouts else None
+
+    def open(self):
+        '''
+        Create the API client and attach the connection pool. Returns True
+        if the pool was not attached yet.
+        '''
+        # Created here rather than lazily by the sending threads.
+        self.sg
+        if not self.use_pool or self.pool is not None:
+            return False
+        if self.pool_shared:
+            self.pool = get_pool(
+                self.api_key, self.sg.host, maxsize=self.pool_size,
+                idle_timeout=self.pool_idle_timeout,
+                timeout=self.read_timeout,
+                connect_timeout=self.connect_timeout)
+        else:
+            self.pool = ConnectionPool(
+                self.sg.host, maxsize=self.pool_size,
+                idle_timeout=self.pool_idle_timeout,
+                timeout=self.read_timeout,
+                connect_timeout=self.connect_timeout)
+        return True
+
+    def close(self):
+        '''
+        Detach the connection pool. A shared pool keeps its connections
+        open for the other backends of the process.
+        '''
+        pool, self.pool = self.pool, None
+        if pool is not None and not self.pool_shared:
+            pool.close()
+
+    def create_batch_id(self):
+        '''
+        Create a batch id to group scheduled messages (see ``send_at`` and
+        ``batch_id``) and return it.
+        '''
+        response = self.sg.client.mail.batch.post()
+        return json.loads(response.body)["batch_id"]
+
+    def cancel_batch(self, batch_id):
+        '''
+        Cancel the scheduled messages of a batch that were not sent yet.
+        '''
+        return self._set_batch_status(batch_id, "cancel")
+
+    def pause_batch(self, batch_id):
         '''
+        Hold the scheduled messages of a batch until resume_batch.
+        '''
+        return self._set_batch_status(batch_id, "pause")
+
+    def resume_batch(self, batch_id):
+        '''
+        Undo cancel_batch or pause_batch before the send time.
+        '''
+        return self.sg.client.user.scheduled_sends._(batch_id).delete()
+
+    def _set_batch_status(self, batch_id, status):
+        return self.sg.client.user.scheduled_sends.post(
+            request_body=_JSONBody({"batch_id": batch_id, "status": status}))
+
+    def send_messages(self, emails, timeout=None):
+        '''
+        Send each message through the v3 mail/send endpoint and return the
+        number of messages sent. Each message gets a ``sendgrid_result``
+        SendResult; messages that could not be sent are kept in
+        ``failed_messages`` and the call's statistics in ``stats``.
+        Messages without a valid, unsuppressed "to" recipient are skipped.
+
+        ``timeout`` (SENDGRID_SEND_TIMEOUT by default) bounds the whole
+        call in seconds: once it is spent, the requests in flight are cut
+        short and the remaining ones are not attempted; they fail with a
+        DeadlineExceededError.
+        '''
+        self.failed_messages = []
+        self.stats = SendStats()
         if not emails:
             return
 
+        started = time.time()
+        if timeout is None:
+            timeout = self.send_timeout
+        send = functools.partial(self._try_send, deadline=deadline(timeout))
+        new_conn_created = self.open()
+        try:
+            requests = self._requests(emails)
+            workers = min(int(self.max_workers or 1), len(requests))
+            if workers <= 1:
+                results = []
+                for request in requests:
+                    result = send(request)
+                    results.append(result)
+                    if result.error is not None and not self.fail_silently:
+                        # Stop at the first failure; _collect raises it.
+                        if isinstance(result.error, DeadlineExceededError):
+                            # The rest expire as well: report them.
+                            results.extend(
+                                _expired() for r in requests[len(results):])
+                        else:
+                            requests = requests[:len(results)]
+                        break
+            else:
+                pool = ThreadPool(workers)
+                try:
+                    results = pool.map(send, requests)
+                finally:
+                    pool.close()
+                    pool.join()
+            return self._collect(requests, results, time.time() - started)
+        finally:
+            if new_conn_created:
+                self.close()
+
+    def _requests(self, emails):
+        '''
+        Return the ``(messages, mail)`` pairs to post for ``emails``.
+        '''
+        if self.batch_personalizations:
+            return self._batch_requests(emails)
+        return [([email], None) for email in emails]
+
+    def _collect(self, requests, results, elapsed=0):
+        '''
+        Annotate the messages with their SendResult, count the sent ones
+        and record the failed ones once every request has been attempted.
+        '''
         count = 0
-        for email in emails:
-            mail = self._build_sg_mail(email)
+        for (messages, mail), result in zip(requests, results):
+            for message in messages:
+                message.sendgrid_result = result
+            if result.sent:
+                count += len(messages)
+            elif result.error is not None:
+                self.failed_messages.extend(messages)
+        self.stats = SendStats(requests, results, elapsed)
+        if not self.fail_silently:
+            # In concurrent mode the whole batch has been attempted; report
+            # the first failure once every message has been posted.
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+        return count
+
+    def _try_send(self, request, deadline=None):
+        '''
+        ``_send`` for send_messages: an exception raised while building the
+        request fails it instead of the whole call.
+        '''
+        try:
+            return self._send(request, deadline)
+        except Exception as e:
+            return SendResult(error=e)
+
+    def _send(self, request, deadline=None):
+        '''
+        Post a single request, a ``(messages, mail)`` pair where ``mail`` is
+        either a built payload or None to build it from the only message.
+        Returns its SendResult; ``error`` is the HTTPError raised by the API
+        for the last attempt, the connection error that ended it, or None if
+        it was sent. Nothing is attempted past ``deadline``.
+        '''
+        if expired(deadline):
+            return _expired()
+        messages, mail = request
+        result = SendResult()
+        if mail is None:
+            mail, result.build_time = self._build(messages[0])
+        if self._skip_request(messages, mail, result):
+            return result
+        instrumented = self._instrumented()
+        if instrumented:
+            signals.pre_send.send(
+                sender=self.__class__, backend=self, messages=messages,
+                mail=mail)
+        while True:
+            if (self.rate_limiter is not None and
+                    not self.rate_limiter.acquire(remaining(deadline))) or \
+                    expired(deadline):
+                if not result.attempts:
+                    result.error = DeadlineExceededError(_DEADLINE_EXCEEDED)
+                # Otherwise, no more retries: keep the last error.
+                break
+            if not self._circuit_allows():
+                if not result.attempts:
+                    self._divert(messages, result)
+                break
+            result.attempts += 1
+            started = time.time()
             try:
-                self.sg.client.mail.send.post(request_body=mail)
-                count += 1
+                response = self.transport.send(
+                    mail, result if instrumented else None,
+                    remaining(deadline))
             except HTTPError as e:
-                if not self.fail_silently:
-                    raise
-        return count
+                result.latency = time.time() - started
+                result.status_code = getattr(e, 'status_code', None)
+                result.error = e
+                self._circuit_record(e, result.latency)
+                delay = self._retry_delay(e, result.attempts - 1)
+                if delay is None or expired(
+                        deadline and deadline - delay):
+                    break
+                time.sleep(delay)
+            except Exception as e:
+                # Connection errors and the like, not retried.
+                result.latency = time.time() - started
+                self._circuit_record(e, result.latency)
+                if expired(deadline):
+                    # Cut short by the deadline.
+                    e = DeadlineExceededError(_DEADLINE_EXCEEDED)
+                result.error = e
+                break
+            else:
+                result.latency = time.time() - started
+                result.status_code = getattr(response, 'status_code', None)
+                result.message_id = message_id(
+                    getattr(response, 'headers', None))
+                result.error = None
+                self._circuit_record(None, result.latency)
+                break
+        if instrumented:
+            self._record(messages, mail, result)
+        return result
+
+    def _circuit_allows(self):
+        '''
+        Whether the circuit breaker, if any, lets a request through.
+        '''
+        if self.circuit_breaker is None:
+            return True
+        return self.circuit_breaker.allow(self._circuit_changed)
+
+    def _circuit_record(self, error, latency):
+        '''
+        Report the outcome of a request to the circuit breaker. Only
+        connection errors, timeouts and 5xx responses count as failures;
+        local errors (e.g. a payload that cannot be serialized) do not.
+        '''
+        if self.circuit_breaker is None:
+            return
+        if isinstance(error, HTTPError):
+            failed = (getattr(error, 'status_code', None) or 500) >= 500
+        else:
+            failed = isinstance(error, self.circuit_errors)
+        self.circuit_breaker.record(failed, latency, self._circuit_changed)
+
+    def _circuit_changed(self, previous, state):
+        signals.circuit_state_changed.send(
+            sender=self.__class__, backend=self,
+            breaker=self.circuit_breaker, previous=previous, state=state)
+        if self.metrics is not None:
+            self.metrics.increment('circuit_%s' % state)
+
+    def _divert(self, messages, result):
+        '''
+        Handle a request refused by the open circuit breaker: send its
+        messages through the fallback backend, or fail it. Messages that
+        would be sent in sandbox mode are never diverted, and the fallback
+        only gets the recipients that would have been posted.
+        '''
+        if self.circuit_fallback is None or not messages or any(
+                can_enable_sandbox_mode(message.to) for message in messages):
+            result.error = CircuitOpenError(
+                'SendGrid circuit breaker is open')
+            return
+        try:
+            self.circuit_fallback(fail_silently=False).send_messages(
+                [self._diverted_message(message) for message in messages])
+        except Exception as e:
+            result.error = e
+        else:
+            result.fallback = True
+
+    def _diverted_message(self, message):
+        '''
+        Return ``message``, or a copy of it without the suppressed, invalid
+        and duplicate recipients left out of its payload.
+        '''
+        suppressed = getattr(message, 'suppressed_recipients', ())
+        if not suppressed and not self.validate_recipients:
+            return message
+        fields, invalid = addresses.clean_recipients(
+            (message.to, message.cc, message.bcc), frozenset(suppressed),
+            bool(self.validate_recipients))
+        message = copy.copy(message)
+        message.to, message.cc, message.bcc = fields
+        return message
+
+    def _skip_request(self, messages, mail, result):
+        '''
+        Count the suppressed and invalid recipients of a request on
+        ``result`` and return True if it must not be posted: it was
+        rejected for its invalid recipients (``result.error``) or has no
+        "to" recipient left (``result.skipped``).
+        '''
+        if self.suppression is None and not self.validate_recipients:
+            return False
+        result.suppressed = sum(
+            len(getattr(message, 'suppressed_recipients', ()))
+            for message in messages)
+        invalid = [
+            address for message in messages
+            for address in getattr(message, 'invalid_recipients', ())]
+        result.invalid = len(invalid)
+        if invalid and self.validate_recipients == "reject":
+            result.error = addresses.InvalidRecipientsError(invalid)
+        elif any(p.get("to") for p in mail.get("personalizations", ())):
+            return False
+        else:
+            result.skipped = True
+        if self.metrics is not None:
+            self.metrics.record(result, mail)
+        return True
+
+    def _instrumented(self):
+        '''
+        Whether a metrics adapter or a signal receiver wants measurements.
+        '''
+        if self.metrics is not None:
+            return True
+        return any(
+            signal.has_listeners(self.__class__) for signal in signals.SIGNALS)
+
+    def _build(self, email):
+        '''
+        Build the payload of a message, sending pre_build and post_build.
+        Returns the payload and the time spent building it.
+        '''
+        instrumented = self._instrumented()
+        if instrumented:
+            signals.pre_build.send(
+                sender=self.__class__, backend=self, message=email)
+        started = time.time()
+        mail = self._build_sg_mail(email)
+        duration = time.time() - started
+        if instrumented:
+            signals.post_build.send(
+                sender=self.__class__, backend=self, message=email,
+                mail=mail, duration=duration)
+        return mail, duration
+
+    def _record(self, messages, mail, result):
+        '''
+        Hand the measurements of a posted request to the metrics adapter
+        and the post_send receivers.
+        '''
+        if self.metrics is not None:
+            self.metrics.record(result, mail)
+        signals.post_send.send(
+            sender=self.__class__, backend=self, messages=messages,
+            mail=mail, result=result)
+
+    def _retry_delay(self, error, attempt):
+        '''
+        Seconds to wait before retrying after ``error``, or None if the
+        request should not be retried.
+        '''
+        if attempt >= self.max_retries:
+            return None
+        status = getattr(error, 'status_code', None)
+        if status == 429:
+            delay = retry_after(getattr(error, 'headers', None))
+            if delay is None:
+                delay = backoff(
+                    attempt, self.retry_backoff, self.retry_backoff_max)
+            if self.rate_limiter is not None:
+                # Hold the other threads of the process as well, even if
+                # this request gives up.
+                self.rate_limiter.pause(delay)
+            if delay > self.retry_backoff_max:
+                # Not worth holding a thread for: give up.
+                return None
+            return delay
+        if status is not None and 500 <= status < 600:
+            return backoff(attempt, self.retry_backoff, self.retry_backoff_max)
+        return None
+
+    def _post(self, mail, result=None, timeout=None):
+        '''
+        Post a payload to mail/send, through the connection pool if one is
+        attached. The serialization time and body size are recorded on
+        ``result`` if given. ``timeout`` shortens the configured timeouts.
+        '''
+        if self.pool is None and not self.stream_attachments:
+            mail = materialize(mail)
+            started = time.time()
+            data = payload.dumps(mail)
+            if result is not None:
+                result.serialize_time = time.time() - started
+                result.body_size = len(data)
+            body = _JSONBody(mail, data)
+            # The client's timeout is replaced, not bounded, by the one
+            # given to post().
+            timeout = _shortest(timeout, self._urllib_timeout())
+            if timeout is None:
+                return self.sg.client.mail.send.post(request_body=body)
+            # A timeout of 0 would fall back to the client's.
+            return self.sg.client.mail.send.post(
+                request_body=body, timeout=max(timeout, 0.001))
+        headers = dict(self.sg.client.request_headers)
+        started = time.time()
+        body = self._body(mail, headers)
+        if result is not None:
+            result.serialize_time = time.time() - started
+            result.body_size = len(body)
+        pool = self.pool
+        if pool is None:
+            # python_http_client only sends whole bodies: stream over a
+            # connection of its own, closed after the request.
+            pool = ConnectionPool(
+                self.sg.host, maxsize=0, timeout=self.read_timeout,
+                connect_timeout=self.connect_timeout)
+        return pool.request('POST', '/v3/mail/send', body, headers, timeout)
+
+    def _body(self, mail, headers):
+        '''
+        Serialize a payload into a request body and set its Content-Type,
+        Content-Length and Content-Encoding in ``headers``.
+        '''
+        headers['Content-Type'] = 'application/json'
+        if self.stream_attachments:
+            # Attachments are encoded while the body is sent, within the
+            # HTTP time.
+            body = StreamingBody(mail)
+        else:
+            body = payload.dumps(materialize(mail))
+        headers['Content-Length'] = str(len(body))
+        return self._compress(body, headers)
+
+    def _compress(self, body, headers):
+        '''
+        Gzip ``body`` if compression is enabled and it is large enough,
+        updating ``headers`` to match.
+        '''
+        if not self.gzip or len(body) < self.gzip_threshold:
+            return body
+        body = gzip_body(body, self.gzip_level)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+        return body
+
+    def _batch_requests(self, emails):
+        '''
+        Group messages whose payloads only differ in their personalizations
+        into shared requests of up to MAX_PERSONALIZATIONS personalizations
+        and MAX_RECIPIENTS recipients.
+        '''
+        requests = []
+        open_requests = {}
+        # Recipients of the open requests, by request id().
+        recipients = {}
+        for email in emails:
+            mail = self._build(email)[0]
+            personalizations = mail.pop("personalizations", [])
+            try:
+                key = json.dumps(mail, sort_keys=True)
+            except (TypeError, ValueError):
+                key = None
+            if self._unbatchable(email, personalizations):
+                # Left alone, and skipped or rejected by _send.
+                mail["personalizations"] = personalizations
+                requests.append(([email], mail))
+                continue
+            count = recipient_count({"personalizations": personalizations})
+            request = open_requests.get(key) if key is not None else None
+            if request is None or (
+                len(request[1]["personalizations"]) + len(personalizations)
+                > MAX_PERSONALIZATIONS
+            ) or recipients[id(request)] + count > MAX_RECIPIENTS:
+                mail["personalizations"] = []
+                request = ([], mail)
+                requests.append(request)
+                recipients[id(request)] = 0
+                if key is not None:
+                    open_requests[key] = request
+            request[0].append(email)
+            request[1]["personalizations"].extend(personalizations)
+            recipients[id(request)] += count
+        return requests
+
+    def _unbatchable(self, email, personalizations):
+        '''
+        Whether a message will not be posted (see _skip_request).
+        '''
+        if self.suppression is None and not self.validate_recipients:
+            return False
+        if self.validate_recipients == "reject" and getattr(
+                email, 'invalid_recipients', None):
+            return True
+        return not all(p.get("to") for p in personalizations)
 
     def _build_sg_mail(self, email):
+        if self.payload_builder == "direct":
+            build_base = functools.partial(
+                payload.build_base,
+                stream_attachments=self.stream_attachments,
+                attachment_cache=self.attachment_cache)
+            build_personalization = payload.build_personalization
+        else:
+            build_base = self._build_sg_mail_base
+            build_personalization = self._build_personalization
+
+        recipients = self._recipients(email)
+
+        key = None
+        if self.payload_cache is not None:
+            key = self._payload_cache_key(email)
+        mail = None
+        if key is not None:
+            mail = self.payload_cache.get(key)
+        if mail is None:
+            mail = build_base(email)
+            if key is not None:
+                self.payload_cache.set(key, mail)
+
+        # The cached part is shared between messages; copy the dicts that
+        # are modified per message.
+        mail = dict(mail)
+        mail_settings = dict(mail["mail_settings"])
+        #Check for sandbox mode
+        if can_enable_sandbox_mode(email.to):
+            mail_settings["sandbox_mode"] = SandBoxMode(True).get()
+        mail["mail_settings"] = mail_settings
+        mail["personalizations"] = [build_personalization(email, recipients)]
+        return mail
+
+    def _recipients(self, email):
+        '''
+        Return the ``(to, cc, bcc)`` lists of a message without its
+        suppressed recipients and, when validating, its invalid and
+        duplicate ones. These are listed in the message's
+        ``suppressed_recipients`` and ``invalid_recipients``.
+        '''
+        fields = (email.to, email.cc, email.bcc)
+        exclude = ()
+        if self.suppression is not None:
+            email.suppressed_recipients = self.suppression.suppressed(
+                email.recipients())
+            exclude = frozenset(email.suppressed_recipients)
+        fields, invalid = addresses.clean_recipients(
+            fields, exclude, bool(self.validate_recipients))
+        if self.validate_recipients:
+            email.invalid_recipients = invalid
+        return fields
+
+    def _payload_cache_key(self, email):
+        '''
+        Return the payload cache key of the message, or None if its payload
+        should not be cached.
+        '''
+        if email.attachments:
+            return None
+        alternatives = getattr(email, "alternatives", None) or ()
+        try:
+            key = (
+                email.__class__,
+                email.from_email,
+                email.subject,
+                email.body,
+                email.content_subtype,
+                tuple(tuple(alt) for alt in alternatives),
+                tuple(getattr(email, "categories", None) or ()),
+                tuple(sorted(getattr(email, "custom_args", {}).items())),
+                getattr(email, "bypass_list_management", None),
+                getattr(email, "template_id", None),
+                getattr(email, "send_at", None),
+                getattr(email, "batch_id", None),
+                tuple(sorted(email.extra_headers.items())),
+                tuple(getattr(email, "reply_to", None) or ()),
+            )
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _build_personalization(self, email, recipients=None):
+        if recipients is None:
+            recipients = (email.to, email.cc, email.bcc)
+        to, cc, bcc = recipients
+        personalization = Personalization()
+        for e in to:
+            personalization.add_to(Email(e))
+        for e in cc:
+            personalization.add_cc(Email(e))
+        for e in bcc:
+            personalization.add_bcc(Email(e))
+        personalization.subject = email.subject
+
+        if hasattr(email, 'template_id'):
+            # Version 3 dynamic data  handle bars {{name}}
+            if hasattr(email, 'dynamic_data'):
+                personalization.dynamic_template_data = email.dynamic_data
+            # Version 3 substitutions
+            if hasattr(email, 'substitutions'):
+                for key, value in email.substitutions.items():
+                    personalization.add_substitution(Substitution(key, value))
+        return personalization.get()
+
+    def _build_sg_mail_base(self, email):
+        '''
+        Build the part of the payload that does not depend on the
+        recipients: everything but the personalizations and sandbox mode.
+        '''
         mail = Mail()
-        from_name, from_email = rfc822.parseaddr(email.from_email)
+        from_name, from_email = addresses.parseaddr(email.from_email)
         # Python sendgrid client should improve
         # sendgrid/helpers/mail/mail.py:164
         if not from_name:
@@ -82,14 +874,6 @@ class SendGridBackend(BaseEmailBackend):
 
         mail_settings = MailSettings()
 
-        personalization = Personalization()
-        for e in email.to:
-            personalization.add_to(Email(e))
-        for e in email.cc:
-            personalization.add_cc(Email(e))
-        for e in email.bcc:
-            personalization.add_bcc(Email(e))
-        personalization.subject = email.subject
         if email.content_subtype == "html":
             mail.add_content(Content("text/html", email.body))
         else:
@@ -99,8 +883,10 @@ class SendGridBackend(BaseEmailBackend):
                 if alt[1] == "text/html":
                     mail.add_content(Content(alt[1], alt[0]))
         elif email.content_subtype == "html":
-            mail.contents = []
+            # SendGrid wants a text/plain part before the HTML one.
+            del mail.contents[:]
             mail.add_content(Content("text/plain", ' '))
+            mail.add_content(Content("text/html", email.body))
 
         if hasattr(email, 'categories'):
             for c in email.categories:
@@ -113,20 +899,16 @@ class SendGridBackend(BaseEmailBackend):
         # Used to override the list management (password reset etc)
         if hasattr(email, 'bypass_list_management'):
             mail_settings.bypass_list_management = BypassListManagement(email.bypass_list_management)
-            
-        #Check for sandbox mode
-        if can_enable_sandbox_mode(email.to):
-            mail_settings.sandbox_mode = SandBoxMode(True)
 
         if hasattr(email, 'template_id'):
             mail.template_id = email.template_id
-            # Version 3 dynamic data  handle bars {{name}}
-            if hasattr(email, 'dynamic_data'):
-                personalization.dynamic_template_data = email.dynamic_data
-            # Version 3 substitutions
-            if hasattr(email, 'substitutions'):
-                for key, value in email.substitutions.items():
-                    personalization.add_substitution(Substitution(key, value))
+
+        # Scheduled sending, optionally grouped under a batch id that can
+        # be cancelled until the send time.
+        if getattr(email, 'send_at', None) is not None:
+            mail.send_at = payload.send_at_timestamp(email.send_at)
+        if getattr(email, 'batch_id', None) is not None:
+            mail.batch_id = email.batch_id
 
         # SendGrid does not support adding Reply-To as an extra
         # header, so it needs to be manually removed if it exists.
@@ -137,7 +919,7 @@ class SendGridBackend(BaseEmailBackend):
             else:
                 mail.add_header({key: value})
         # Note that if you set a "Reply-To" header *and* the reply_to
-        # attribute, the header's value will be used.
+        # attribute, the attribute's value will be used.
         if not mail.reply_to and hasattr(email, "reply_to") and email.reply_to:
             # SendGrid only supports setting Reply-To to a single address.
             # See https://github.com/sendgrid/sendgrid-csharp/issues/339.
@@ -145,7 +927,8 @@ class SendGridBackend(BaseEmailBackend):
         # Determine whether reply_to contains a name and email address, or
         # just an email address.
         if reply_to_string:
-            reply_to_name, reply_to_email = rfc822.parseaddr(reply_to_string)
+            reply_to_name, reply_to_email = addresses.parseaddr(
+                reply_to_string)
             if reply_to_name and reply_to_email:
                 mail.reply_to = Email(reply_to_email, reply_to_name)
             elif reply_to_email:
@@ -153,21 +936,23 @@ class SendGridBackend(BaseEmailBackend):
 
         for attachment in email.attachments:
             if isinstance(attachment, MIMEBase):
+                part = payload.mime_attachment(
+                    attachment, self.stream_attachments, self.attachment_cache)
                 attach = Attachment()
-                attach.filename = attachment.get_filename()
-                attach.content = base64.b64encode(attachment.get_payload())
+                attach.content = part["content"]
+                attach.type = part["type"]
+                attach.filename = part.get("filename")
+                attach.disposition = part.get("disposition")
+                attach.content_id = part.get("content_id")
                 mail.add_attachment(attach)
             elif isinstance(attachment, tuple):
                 attach = Attachment()
                 attach.filename = attachment[0]
-                base64_attachment = base64.b64encode(attachment[1])
-                if sys.version_info >= (3,):
-                    attach.content = str(base64_attachment, 'utf-8')
-                else:
-                    attach.content = base64_attachment
+                attach.content = payload.encode_content(
+                    attachment[1], self.stream_attachments,
+                    self.attachment_cache)
                 attach.type = attachment[2]
                 mail.add_attachment(attach)
 
-        mail.add_personalization(personalization)
         mail.mail_settings = mail_settings
         return mail.get()
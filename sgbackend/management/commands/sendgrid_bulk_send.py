@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sgbackend.bulk import Checkpoint, bulk_send, read_recipients
+from sgbackend.mail import MAX_PERSONALIZATIONS
+
+
+class Command(BaseCommand):
+    help = ('Send a dynamic template to every recipient of a CSV or JSON '
+            'lines file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            help='CSV file with an "email" column, or JSON lines file.')
+        parser.add_argument('--template-id', required=True)
+        parser.add_argument('--from-email', required=True)
+        parser.add_argument('--subject', default=None)
+        parser.add_argument(
+            '--category', action='append', dest='categories', default=[])
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'], default=None,
+            help='Input format (defaults to the file extension).')
+        parser.add_argument(
+            '--batch-size', type=int, default=MAX_PERSONALIZATIONS,
+            help='Recipients per request (at most %d).' % MAX_PERSONALIZATIONS)
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Number of sending processes (defaults to the CPU count).')
+        parser.add_argument(
+            '--checkpoint', default=None,
+            help='File recording the sent batches '
+                 '(defaults to INPUT.checkpoint).')
+
+    def handle(self, *args, **options):
+        batch_size = min(options['batch_size'], MAX_PERSONALIZATIONS)
+        template = {
+            'from_email': options['from_email'],
+            'template_id': options['template_id'],
+            'subject': options['subject'],
+            'categories': options['categories'],
+        }
+        try:
+            checkpoint = Checkpoint(
+                options['checkpoint'] or options['input'] + '.checkpoint',
+                batch_size)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        def progress(sent, failed, elapsed):
+            if options['verbosity'] > 1:
+                self.stdout.write('Sent %d, failed %d (%.0f messages/s)' % (
+                    sent, failed, sent / elapsed if elapsed else 0))
+
+        try:
+            sent, failed, skipped, elapsed = bulk_send(
+                template,
+                read_recipients(options['input'], options['format']),
+                checkpoint, batch_size=batch_size,
+                processes=options['processes'], progress=progress)
+        finally:
+            checkpoint.close()
+
+        self.stdout.write(
+            'Sent %d, failed %d, skipped %d already sent in %.1fs '
+            '(%.0f messages/s)' % (
+                sent, failed, skipped, elapsed,
+                sent / elapsed if elapsed else 0))
+        if failed:
+            raise CommandError(
+                '%d messages failed; run the command again to retry them.'
+                % failed)
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sgbackend.queued import QueuedSendGridBackend
+
+
+class Command(BaseCommand):
+    help = 'Send the messages queued by QueuedSendGridBackend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of outbox entries claimed at a time.')
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='Number of requests posted concurrently '
+                 '(defaults to SENDGRID_MAX_WORKERS).')
+        parser.add_argument(
+            '--max-attempts', type=int, default=5,
+            help='Attempts before an entry is given up on.')
+        parser.add_argument(
+            '--lease', type=int, default=300,
+            help='Seconds a claimed entry stays reserved for this worker.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling the outbox instead of exiting once it is empty.')
+        parser.add_argument(
+            '--interval', type=float, default=1,
+            help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        backend = QueuedSendGridBackend()
+        if options['concurrency']:
+            backend.max_workers = options['concurrency']
+        while True:
+            sent, retried, failed = backend.drain(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                lease=options['lease'])
+            if sent or retried or failed:
+                self.stdout.write('Sent %d, retrying %d, failed %d' % (
+                    sent, retried, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
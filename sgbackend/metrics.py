@@ -0,0 +1,180 @@
+'''
+Metrics adapters for SendGridBackend.
+
+An adapter receives the measurements of each request: ``timing`` for
+durations in seconds (``build``, ``serialize`` and ``http``), ``observe``
+for sizes (``body_bytes``, ``attachment_bytes`` and ``recipients``) and
+``increment`` for counters (``sent``, ``failed`` and ``retries``).
+Set ``SENDGRID_METRICS`` to the dotted path of an adapter class, or pass
+``metrics=`` to the backend.
+'''
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class MetricsAdapter(object):
+    '''
+    Base adapter, discarding every measurement.
+    '''
+    def timing(self, name, seconds):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def increment(self, name, count=1):
+        pass
+
+    def record(self, result, mail):
+        '''
+        Record the measurements of a posted request.
+        '''
+        if result.suppressed:
+            self.increment('suppressed', result.suppressed)
+        if result.invalid:
+            self.increment('invalid', result.invalid)
+        if result.skipped:
+            self.increment('skipped')
+            return
+        if result.build_time is not None:
+            self.timing('build', result.build_time)
+        if result.serialize_time is not None:
+            self.timing('serialize', result.serialize_time)
+        if result.latency is not None:
+            self.timing('http', result.latency)
+        if result.body_size is not None:
+            self.observe('body_bytes', result.body_size)
+        self.observe('attachment_bytes', attachment_size(mail))
+        self.observe('recipients', recipient_count(mail))
+        self.increment('sent' if result.sent else 'failed')
+        if result.fallback:
+            self.increment('fallback')
+        if result.attempts > 1:
+            self.increment('retries', result.attempts - 1)
+
+
+class StatsdMetrics(MetricsAdapter):
+    '''
+    Adapter for statsd-style clients (``statsd.StatsClient``,
+    ``datadog.dogstatsd``...). Durations are sent in milliseconds.
+    '''
+    def __init__(self, client=None, prefix='sendgrid'):
+        if client is None:
+            try:
+                import statsd
+            except ImportError:
+                raise ImproperlyConfigured('''
+                    StatsdMetrics requires the statsd package or a client''')
+            client = statsd.StatsClient()
+        self.client = client
+        self.prefix = prefix
+
+    def _name(self, name):
+        return '%s.%s' % (self.prefix, name) if self.prefix else name
+
+    def timing(self, name, seconds):
+        self.client.timing(self._name(name), seconds * 1000)
+
+    def observe(self, name, value):
+        histogram = getattr(self.client, 'histogram', None)
+        if histogram is not None:
+            histogram(self._name(name), value)
+        else:
+            self.client.timing(self._name(name), value)
+
+    def increment(self, name, count=1):
+        incr = getattr(self.client, 'incr', None) or self.client.increment
+        incr(self._name(name), count)
+
+
+# Buckets of the size histograms (bytes, recipients).
+SIZE_BUCKETS = (1, 10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7,
+                float('inf'))
+
+_prometheus_metrics = {}
+_prometheus_lock = threading.Lock()
+
+
+class PrometheusMetrics(MetricsAdapter):
+    '''
+    Adapter exporting histograms and counters with prometheus_client.
+    '''
+    def __init__(self, namespace='sendgrid', registry=None):
+        # Imported here: prometheus_client is slow to import and optional.
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImproperlyConfigured('''
+                PrometheusMetrics requires prometheus_client to be installed''')
+        self.prometheus_client = prometheus_client
+        self.namespace = namespace
+        self.registry = registry or prometheus_client.REGISTRY
+
+    def _metric(self, cls, name, unit, **kwargs):
+        # Collectors can only be registered once per registry.
+        key = (id(self.registry), self.namespace, name)
+        with _prometheus_lock:
+            metric = _prometheus_metrics.get(key)
+            if metric is None:
+                metric = _prometheus_metrics[key] = cls(
+                    name, 'SendGrid %s' % name.replace('_', ' '),
+                    namespace=self.namespace, unit=unit,
+                    registry=self.registry, **kwargs)
+            return metric
+
+    def timing(self, name, seconds):
+        histogram = self._metric(
+            self.prometheus_client.Histogram, name, 'seconds')
+        histogram.observe(seconds)
+
+    def observe(self, name, value):
+        self._metric(
+            self.prometheus_client.Histogram, name, '',
+            buckets=SIZE_BUCKETS).observe(value)
+
+    def increment(self, name, count=1):
+        self._metric(self.prometheus_client.Counter, name, '').inc(count)
+
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+
+def get_metrics():
+    '''
+    Return the process-wide instance of the SENDGRID_METRICS adapter, or
+    None.
+    '''
+    path = getattr(settings, "SENDGRID_METRICS", None)
+    if not path:
+        return None
+    with _adapters_lock:
+        adapter = _adapters.get(path)
+        if adapter is None:
+            try:
+                adapter = _adapters[path] = import_string(path)()
+            except ImportError as e:
+                raise ImproperlyConfigured(
+                    'SENDGRID_METRICS %r could not be imported: %s'
+                    % (path, e))
+        return adapter
+
+
+def recipient_count(mail):
+    count = 0
+    for personalization in mail.get("personalizations", ()):
+        for field in ("to", "cc", "bcc"):
+            count += len(personalization.get(field, ()))
+    return count
+
+
+def attachment_size(mail):
+    '''
+    Length of the base64 contents of the attachments of ``mail``.
+    '''
+    return sum(
+        len(attachment.get("content") or "")
+        for attachment in mail.get("attachments", ()))
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class OutboxMessage(object):
+    '''
+    A claimed outbox entry.
+    '''
+    def __init__(self, id, payload, attempts):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+
+
+class Outbox(object):
+    '''
+    Durable queue of v3 payloads in a SQLite database.
+
+    Entries are claimed with a lease: an entry whose worker died before
+    acknowledging it becomes available again once its lease expires, so
+    every payload is sent at least once.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' payload TEXT NOT NULL,'
+                ' created REAL NOT NULL,'
+                ' available_at REAL NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' dead INTEGER NOT NULL DEFAULT 0,'
+                ' last_error TEXT)')
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS outbox_available'
+                ' ON outbox (dead, available_at)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def put(self, payloads):
+        '''
+        Store payloads (JSON-serializable dicts) and return their ids.
+        '''
+        now = time.time()
+        ids = []
+        with self._transaction() as db:
+            for payload in payloads:
+                cursor = db.execute(
+                    'INSERT INTO outbox (payload, created, available_at)'
+                    ' VALUES (?, ?, ?)', (json.dumps(payload), now, now))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def claim(self, limit, lease=300, available_before=None):
+        '''
+        Claim up to ``limit`` entries available now (or at
+        ``available_before``) for ``lease`` seconds.
+        '''
+        now = time.time()
+        if available_before is None:
+            available_before = now
+        with self._transaction() as db:
+            rows = db.execute(
+                'SELECT id, payload, attempts FROM outbox'
+                ' WHERE dead = 0 AND available_at <= ?'
+                ' ORDER BY id LIMIT ?', (available_before, limit)).fetchall()
+            db.executemany(
+                'UPDATE outbox SET available_at = ? WHERE id = ?',
+                [(now + lease, row[0]) for row in rows])
+        return [
+            OutboxMessage(id, json.loads(payload), attempts)
+            for id, payload, attempts in rows
+        ]
+
+    def ack(self, ids):
+        '''
+        Remove sent entries.
+        '''
+        with self._transaction() as db:
+            db.executemany(
+                'DELETE FROM outbox WHERE id = ?', [(id,) for id in ids])
+
+    def retry(self, id, error, delay):
+        '''
+        Make a failed entry available again in ``delay`` seconds.
+        '''
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE outbox SET attempts = attempts + 1,'
+                ' available_at = ?, last_error = ? WHERE id = ?',
+                (time.time() + delay, error, id))
+
+    def bury(self, id, error):
+        '''
+        Give up on an entry. It is kept, with its last error, for
+        inspection.
+        '''
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE outbox SET attempts = attempts + 1, dead = 1,'
+                ' last_error = ? WHERE id = ?', (error, id))
+
+    def count(self, dead=False):
+        db = self._connection()
+        return db.execute(
+            'SELECT COUNT(*) FROM outbox WHERE dead = ?',
+            (int(dead),)).fetchone()[0]
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class _Transaction(object):
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.execute('COMMIT')
+        else:
+            self.db.execute('ROLLBACK')
+
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_outbox(path):
+    '''
+    Return the process-wide Outbox stored at ``path``.
+    '''
+    with _outboxes_lock:
+        outbox = _outboxes.get(path)
+        if outbox is None:
+            outbox = _outboxes[path] = Outbox(path)
+        return outbox
@@ -0,0 +1,279 @@
+'''
+Direct v3 payload builder.
+
+Builds the same request body as SendGridBackend's sendgrid.helpers.mail
+based builder, writing the dicts directly instead of creating a helper
+object per address, content and attachment.
+'''
+import base64
+import calendar
+import datetime
+import hashlib
+import json
+import re
+import sys
+from email import utils as email_utils
+from email.mime.base import MIMEBase
+
+from django.core.mail import EmailMultiAlternatives
+from django.utils import timezone
+from sendgrid.helpers.mail.exceptions import APIKeyIncludedException
+
+from sgbackend.addresses import parseaddr
+from sgbackend.cache import LRUCache
+from sgbackend.streaming import Base64Content
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Same check as sendgrid.helpers.mail.Content's ValidateAPIKey.
+API_KEY_RE = re.compile(r'SG\.[0-9a-zA-Z]+\.[0-9a-zA-Z]+')
+
+
+def dumps(mail):
+    '''
+    Serialize a payload to JSON bytes, with orjson when it is installed.
+    '''
+    if orjson is not None:
+        return orjson.dumps(mail)
+    return json.dumps(mail).encode('utf-8')
+
+
+def email_dict(address, name=None):
+    '''
+    Return what ``Email(address, name).get()`` returns.
+    '''
+    if address and not name:
+        # Mostly recipients, which seldom repeat: not worth memoizing.
+        name, address = email_utils.parseaddr(address)
+        # more than likely a string was passed here instead of an address
+        if "@" not in address:
+            name = address
+            address = None
+        name = name or None
+        address = address or None
+    email = {}
+    if name is not None:
+        email["name"] = name
+    if address is not None:
+        email["email"] = address
+    return email
+
+
+def content_dict(type_, value):
+    if isinstance(value, str) and API_KEY_RE.match(value):
+        raise APIKeyIncludedException()
+    content = {"type": type_}
+    if value is not None:
+        content["value"] = value
+    return content
+
+
+_attachment_cache = None
+
+
+def get_attachment_cache(maxbytes):
+    '''
+    Return the process-wide cache of encoded attachment contents.
+    '''
+    global _attachment_cache
+    if _attachment_cache is None or _attachment_cache.maxbytes != maxbytes:
+        # Entries are bounded by their total size only.
+        _attachment_cache = LRUCache(sys.maxsize, maxbytes=maxbytes)
+    return _attachment_cache
+
+
+def encode_content(data, stream=False, cache=None):
+    '''
+    Return the base64 content of an attachment: a str, or a Base64Content
+    encoded on demand when ``stream`` is True.
+
+    With a ``cache`` (see get_attachment_cache), contents are looked up by
+    their SHA-256 and identical attachments are encoded once.
+    '''
+    if cache is not None and isinstance(data, bytes):
+        key = hashlib.sha256(data).digest()
+        encoded = cache.get(key)
+        if encoded is None:
+            encoded = base64.b64encode(data)
+            cache.set(key, encoded)
+        if stream:
+            return Base64Content(data, encoded=encoded)
+        if sys.version_info >= (3,):
+            return encoded.decode('ascii')
+        return encoded
+    if stream:
+        return Base64Content(data)
+    base64_attachment = base64.b64encode(data)
+    if sys.version_info >= (3,):
+        return str(base64_attachment, 'utf-8')
+    return base64_attachment
+
+
+def send_at_timestamp(send_at):
+    '''
+    Return the UNIX timestamp of a ``send_at`` attribute: a timestamp, or a
+    datetime (naive datetimes are in the current time zone).
+    '''
+    if isinstance(send_at, datetime.datetime):
+        if timezone.is_naive(send_at):
+            send_at = timezone.make_aware(send_at)
+        return calendar.timegm(send_at.utctimetuple())
+    return int(send_at)
+
+
+def mime_attachment(part, stream=False, cache=None):
+    '''
+    Return the attachment dict of a MIME part. Parts that are already
+    base64 transfer-encoded are passed through without being decoded.
+    Parts with a Content-ID are inline unless their Content-Disposition
+    says otherwise.
+    '''
+    encoding = (part.get('Content-Transfer-Encoding') or '').strip().lower()
+    if encoding == 'base64' and not part.is_multipart():
+        # Only the MIME line breaks need to go.
+        content = ''.join(part.get_payload().split())
+    else:
+        content = encode_content(part.get_payload(decode=True), stream, cache)
+    attach = {"content": content, "type": part.get_content_type()}
+    content_id = (part.get('Content-ID') or '').strip().strip('<>')
+    disposition = (part.get('Content-Disposition') or '').split(';')[0]
+    disposition = disposition.strip().lower()
+    if not disposition and content_id:
+        disposition = 'inline'
+    filename = part.get_filename()
+    if filename is None and content_id:
+        # SendGrid requires a filename.
+        filename = content_id
+    if filename is not None:
+        attach["filename"] = filename
+    if disposition:
+        attach["disposition"] = disposition
+    if content_id:
+        attach["content_id"] = content_id
+    return attach
+
+
+def build_personalization(email, recipients=None):
+    '''
+    Build the personalization of a message, addressed to the ``(to, cc,
+    bcc)`` lists of ``recipients`` if given instead of the message's.
+    '''
+    if recipients is None:
+        recipients = (email.to, email.cc, email.bcc)
+    to, cc, bcc = recipients
+    personalization = {}
+    if to:
+        personalization["to"] = [email_dict(e) for e in to]
+    if cc:
+        personalization["cc"] = [email_dict(e) for e in cc]
+    if bcc:
+        personalization["bcc"] = [email_dict(e) for e in bcc]
+    if email.subject is not None:
+        personalization["subject"] = email.subject
+
+    if hasattr(email, 'template_id'):
+        if hasattr(email, 'substitutions'):
+            substitutions = dict(
+                (key, value) for key, value in email.substitutions.items()
+                if key is not None and value is not None)
+            if email.substitutions:
+                personalization["substitutions"] = substitutions
+        if getattr(email, 'dynamic_data', None) is not None:
+            personalization["dynamic_template_data"] = email.dynamic_data
+    return personalization
+
+
+def build_base(email, stream_attachments=False, attachment_cache=None):
+    '''
+    Build everything but the personalizations and sandbox mode, like
+    SendGridBackend._build_sg_mail_base.
+    '''
+    mail = {}
+    from_name, from_email = parseaddr(email.from_email)
+    mail["from"] = email_dict(from_email, from_name or None)
+    if email.subject is not None:
+        mail["subject"] = email.subject
+
+    if email.content_subtype == "html":
+        contents = [content_dict("text/html", email.body)]
+    else:
+        contents = [content_dict("text/plain", email.body)]
+    if isinstance(email, EmailMultiAlternatives):
+        for alt in email.alternatives:
+            if alt[1] == "text/html":
+                contents.append(content_dict(alt[1], alt[0]))
+    elif email.content_subtype == "html":
+        contents = [
+            content_dict("text/plain", ' '),
+            content_dict("text/html", email.body),
+        ]
+    mail["content"] = contents
+
+    attachments = []
+    for attachment in email.attachments:
+        if isinstance(attachment, MIMEBase):
+            attachments.append(mime_attachment(
+                attachment, stream_attachments, attachment_cache))
+        elif isinstance(attachment, tuple):
+            attach = {
+                "content": encode_content(
+                    attachment[1], stream_attachments, attachment_cache),
+            }
+            if attachment[2] is not None:
+                attach["type"] = attachment[2]
+            if attachment[0] is not None:
+                attach["filename"] = attachment[0]
+            attachments.append(attach)
+    if attachments:
+        mail["attachments"] = attachments
+
+    if hasattr(email, 'template_id'):
+        if email.template_id is not None:
+            mail["template_id"] = email.template_id
+
+    # SendGrid does not support adding Reply-To as an extra header.
+    reply_to_string = ""
+    headers = None
+    for key, value in email.extra_headers.items():
+        if key.lower() == "reply-to":
+            reply_to_string = value
+        else:
+            if headers is None:
+                headers = mail["headers"] = {}
+            if value is not None:
+                headers[key] = value
+
+    if getattr(email, 'categories', None):
+        mail["categories"] = list(email.categories)
+
+    if getattr(email, 'send_at', None) is not None:
+        mail["send_at"] = send_at_timestamp(email.send_at)
+    if getattr(email, 'batch_id', None) is not None:
+        mail["batch_id"] = email.batch_id
+
+    if getattr(email, 'custom_args', None):
+        mail["custom_args"] = dict(
+            (key, value) for key, value in email.custom_args.items()
+            if key is not None and value is not None)
+
+    mail_settings = {}
+    if hasattr(email, 'bypass_list_management'):
+        bypass = {}
+        if email.bypass_list_management is not None:
+            bypass["enable"] = email.bypass_list_management
+        mail_settings["bypass_list_management"] = bypass
+    mail["mail_settings"] = mail_settings
+
+    # As with the helpers builder, reply_to wins over a Reply-To header.
+    if getattr(email, "reply_to", None):
+        reply_to_string = email.reply_to[0]
+    if reply_to_string:
+        reply_to_name, reply_to_email = parseaddr(reply_to_string)
+        if reply_to_name and reply_to_email:
+            mail["reply_to"] = email_dict(reply_to_email, reply_to_name)
+        elif reply_to_email:
+            mail["reply_to"] = email_dict(reply_to_email)
+    return mail
@@ -0,0 +1,196 @@
+import select
+import socket
+import sys
+import threading
+import time
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlparse
+except ImportError:  # pragma: no cover
+    import httplib
+    from urlparse import urlparse
+
+from python_http_client.exceptions import HTTPError, err_dict
+
+
+def http_error(status, reason, body, headers):
+    '''
+    Build the python_http_client exception matching an error response.
+    '''
+    return err_dict.get(status, HTTPError)(status, reason, body, headers)
+
+
+def _shortest(*timeouts):
+    timeouts = [t for t in timeouts if t is not None]
+    return min(timeouts) if timeouts else None
+
+
+def _dropped(connection):
+    '''
+    Whether the server closed an idle connection: its socket is readable
+    (at end of file) while no request is pending.
+    '''
+    if connection.sock is None:
+        return True
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (ValueError, socket.error):
+        return True
+
+
+def _message_body(body):
+    '''
+    What to hand http.client for ``body``: the chunks of a body that has
+    ``chunks()`` (see StreamingBody), which are then written one at a time
+    without being joined.
+    '''
+    if hasattr(body, 'chunks') and sys.version_info >= (3,):
+        return body.chunks()
+    return body
+
+
+class Response(object):
+    '''
+    Response of a pooled request, mirroring python_http_client's Response.
+    '''
+    def __init__(self, status_code, reason, headers, body):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class ConnectionPool(object):
+    '''
+    Keep-alive HTTP(S) connections to a single host.
+
+    Up to ``maxsize`` idle connections are kept for reuse; connections idle
+    for longer than ``idle_timeout`` seconds are closed instead of reused.
+    The pool never blocks: when no idle connection is available a new one
+    is opened. Connecting times out after ``connect_timeout`` seconds and
+    each socket operation after ``timeout`` seconds.
+    '''
+    def __init__(self, host, maxsize=10, idle_timeout=60, timeout=None,
+                 connect_timeout=None):
+        parsed = urlparse(host)
+        if parsed.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.netloc = parsed.netloc
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.connections_created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout and \
+                        not _dropped(connection):
+                    return connection, True
+                connection.close()
+            self.connections_created += 1
+        return self.connection_class(self.netloc), False
+
+    def _release_connection(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        '''
+        Perform a request and return its Response. Raises the matching
+        HTTPError for 4xx/5xx responses. ``timeout`` further bounds the
+        timeouts of this request, e.g. to the time left before a deadline.
+
+        A reused connection failing while the request is written is retried
+        once on a fresh connection. Errors raised once the request has been
+        written are not: it may have been processed.
+        '''
+        connection, reused = self._get_connection()
+        try:
+            if connection.sock is None:
+                connect_timeout = self.connect_timeout
+                if connect_timeout is None:
+                    connect_timeout = self.timeout
+                connection.timeout = _shortest(connect_timeout, timeout)
+                connection.connect()
+            connection.sock.settimeout(_shortest(self.timeout, timeout))
+            connection.request(
+                method, path, body=_message_body(body), headers=headers or {})
+        except socket.timeout:
+            connection.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection before the
+            # request was written; retry on a fresh one.
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            return self.request(method, path, body, headers, timeout)
+        try:
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+
+        if response.status >= 400:
+            raise http_error(
+                response.status, response.reason, data, response.msg)
+        return Response(response.status, response.reason, response.msg, data)
+
+    def close(self):
+        '''
+        Close every idle connection.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_used in idle:
+            connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(api_key, host, maxsize=10, idle_timeout=60, timeout=None,
+             connect_timeout=None):
+    '''
+    Return the process-wide ConnectionPool for ``api_key`` and ``host``.
+    '''
+    key = (api_key, host)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                host, maxsize=maxsize, idle_timeout=idle_timeout,
+                timeout=timeout, connect_timeout=connect_timeout)
+        return pool
+
+
+def close_pools():
+    '''
+    Close and forget every process-wide pool.
+    '''
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
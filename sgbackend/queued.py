@@ -0,0 +1,168 @@
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from sgbackend.mail import SendGridBackend
+from sgbackend.outbox import get_outbox
+from sgbackend.ratelimit import backoff
+from sgbackend.results import SendResult, SendStats
+from sgbackend.streaming import materialize
+
+
+class QueuedSendGridBackend(SendGridBackend):
+    '''
+    SendGrid Web API Backend that stores the built payloads in a local
+    outbox and returns immediately. ``manage.py sendgrid_drain`` (or
+    ``drain()``) posts them.
+    '''
+    def __init__(self, fail_silently=False, **kwargs):
+        super(QueuedSendGridBackend, self).__init__(
+            fail_silently=fail_silently, **kwargs)
+        # The web workers and the drainer must agree on the database: a
+        # relative path would depend on their working directories.
+        self.outbox_path = kwargs.get(
+            'outbox_path', getattr(settings, "SENDGRID_OUTBOX_PATH", None))
+        if self.outbox_path is None:
+            base_dir = getattr(settings, "BASE_DIR", None)
+            if base_dir is None:
+                raise ImproperlyConfigured('''
+                    SENDGRID_OUTBOX_PATH (or BASE_DIR) must be declared in
+                    settings.py''')
+            self.outbox_path = os.path.join(
+                str(base_dir), "sendgrid_outbox.sqlite3")
+        if not os.path.isabs(self.outbox_path):
+            raise ImproperlyConfigured(
+                'SENDGRID_OUTBOX_PATH %r must be an absolute path'
+                % self.outbox_path)
+        self.outbox = None
+
+    def open(self):
+        '''
+        Also attach the process-wide outbox. Returns True if the outbox or
+        the connection pool was not attached yet.
+        '''
+        opened = super(QueuedSendGridBackend, self).open()
+        if self.outbox is None:
+            self.outbox = get_outbox(self.outbox_path)
+            opened = True
+        return opened
+
+    def close(self):
+        '''
+        Also detach the outbox, closing the calling thread's connection to
+        its database.
+        '''
+        super(QueuedSendGridBackend, self).close()
+        outbox, self.outbox = self.outbox, None
+        if outbox is not None:
+            outbox.close()
+
+    def get_outbox(self):
+        if self.outbox is None:
+            return get_outbox(self.outbox_path)
+        return self.outbox
+
+    def send_messages(self, emails, timeout=None):
+        '''
+        Queue the messages and return the number of messages queued.
+        Messages without a valid, unsuppressed "to" recipient are not
+        queued; rejected ones are kept in ``failed_messages``. ``stats``
+        counts the queued messages as sent. Queuing posts nothing, so
+        ``timeout`` is not used.
+        '''
+        self.failed_messages = []
+        self.stats = SendStats()
+        if not emails:
+            return
+
+        started = time.time()
+        count = 0
+        rejected = []
+        new_conn_created = self.open()
+        try:
+            requests = self._requests(emails)
+            results = []
+            payloads = []
+            for messages, mail in requests:
+                if mail is None:
+                    mail = self._build(messages[0])[0]
+                result = SendResult()
+                results.append(result)
+                if self._skip_request(messages, mail, result):
+                    for message in messages:
+                        message.sendgrid_result = result
+                    if result.error is not None:
+                        rejected.append(result.error)
+                        self.failed_messages.extend(messages)
+                    continue
+                payloads.append(materialize(mail))
+                count += len(messages)
+            self.outbox.put(payloads)
+        except Exception:
+            self.failed_messages = list(emails)
+            if not self.fail_silently:
+                raise
+            return 0
+        finally:
+            if new_conn_created:
+                self.close()
+        self.stats = SendStats(requests, results, time.time() - started)
+        if rejected and not self.fail_silently:
+            raise rejected[0]
+        return count
+
+    def drain(self, batch_size=100, max_attempts=5, lease=300):
+        '''
+        Post every available outbox entry, ``max_workers`` at a time.
+        Failed entries are retried with backoff up to ``max_attempts`` times
+        and then kept aside. Returns a ``(sent, retried, failed)`` tuple.
+        '''
+        # Entries retried during this run are left for the next one.
+        started = time.time()
+        sent = retried = failed = 0
+        workers = max(int(self.max_workers or 1), 1)
+        thread_pool = ThreadPool(workers) if workers > 1 else None
+        new_conn_created = self.open()
+        outbox = self.outbox
+        try:
+            while True:
+                entries = outbox.claim(
+                    batch_size, lease, available_before=started)
+                if not entries:
+                    break
+                if thread_pool is None:
+                    results = [self._drain_one(entry) for entry in entries]
+                else:
+                    results = thread_pool.map(self._drain_one, entries)
+
+                sent_ids = []
+                for entry, error in zip(entries, results):
+                    if error is None:
+                        sent_ids.append(entry.id)
+                    elif entry.attempts + 1 >= max_attempts:
+                        outbox.bury(entry.id, repr(error))
+                        failed += 1
+                    else:
+                        outbox.retry(entry.id, repr(error), backoff(
+                            entry.attempts, self.retry_backoff,
+                            self.retry_backoff_max))
+                        retried += 1
+                outbox.ack(sent_ids)
+                sent += len(sent_ids)
+        finally:
+            if thread_pool is not None:
+                thread_pool.close()
+                thread_pool.join()
+            if new_conn_created:
+                self.close()
+        return sent, retried, failed
+
+    def _drain_one(self, entry):
+        try:
+            return self._send(([], entry.payload)).error
+        except Exception as e:
+            # Connection errors and the like: retry the entry later.
+            return e
@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+
+class TokenBucket(object):
+    '''
+    Thread-safe token bucket allowing ``rate`` requests per second, with
+    bursts of up to ``capacity`` requests.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def _wait_time(self):
+        now = time.time()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        '''
+        Block until a request may be made and return True, or return False
+        if that would take more than ``timeout`` seconds.
+        '''
+        if timeout is not None:
+            timeout = time.time() + timeout
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+            if not wait:
+                return True
+            if timeout is not None and time.time() + wait > timeout:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        '''
+        Hold every request for ``seconds``, e.g. after a 429 response.
+        '''
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.tokens = 0
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(key, rate, capacity=None):
+    '''
+    Return the process-wide TokenBucket for ``key``.
+    '''
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            bucket = _buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+
+def retry_after(headers, now=None):
+    '''
+    Seconds to wait before retrying, from the Retry-After or
+    X-RateLimit-Reset headers of a 429 response, or None.
+    '''
+    if not headers:
+        return None
+    now = time.time() if now is None else now
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is not None:
+                return max(mktime_tz(date) - now, 0)
+    value = headers.get('X-RateLimit-Reset')
+    if value:
+        try:
+            return max(float(value) - now, 0)
+        except ValueError:
+            pass
+    return None
+
+
+def backoff(attempt, base, maximum):
+    '''
+    Exponential backoff with full jitter for the given retry attempt.
+    '''
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
@@ -0,0 +1,129 @@
+from sgbackend.deadline import DeadlineExceededError
+
+
+class SendResult(object):
+    '''
+    Outcome of the request that carried a message.
+
+    ``build_time`` is the time spent building the payload, ``latency`` the
+    duration of the last HTTP attempt and ``serialize_time`` the time spent
+    encoding its body, all in seconds. ``body_size`` is the length of the
+    body in bytes. The serialization measurements are only taken when the
+    backend is instrumented (see sgbackend.signals and sgbackend.metrics).
+    ``message_id`` is SendGrid's X-Message-Id, the id reported by the
+    Event Webhook as ``sg_message_id``. ``suppressed`` is the number of
+    recipients removed by the suppression list (see sgbackend.suppression),
+    ``invalid`` the number of invalid recipient addresses and ``skipped``
+    is True when no recipient was left to post to. ``fallback`` is True
+    when the messages went through the fallback backend of an open circuit
+    breaker (see sgbackend.breaker).
+    '''
+    def __init__(self, status_code=None, message_id=None, latency=None,
+                 build_time=None, attempts=0, error=None,
+                 serialize_time=None, body_size=None, suppressed=0,
+                 invalid=0, skipped=False, fallback=False):
+        self.status_code = status_code
+        self.message_id = message_id
+        self.latency = latency
+        self.build_time = build_time
+        self.attempts = attempts
+        self.error = error
+        self.serialize_time = serialize_time
+        self.body_size = body_size
+        self.suppressed = suppressed
+        self.invalid = invalid
+        self.skipped = skipped
+        self.fallback = fallback
+
+    @property
+    def sent(self):
+        return self.error is None and not self.skipped
+
+    @property
+    def error_body(self):
+        '''
+        Body of the error response, or None.
+        '''
+        body = getattr(self.error, 'body', None)
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        return body
+
+    def __repr__(self):
+        return '<SendResult status_code=%r message_id=%r attempts=%d>' % (
+            self.status_code, self.message_id, self.attempts)
+
+
+class SendStats(object):
+    '''
+    Statistics of a ``send_messages`` call. ``expired`` counts the failed
+    messages cut short or left unsent by the call's deadline.
+    '''
+    def __init__(self, requests=(), results=(), elapsed=0):
+        self.requests = 0
+        self.messages = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.suppressed = 0
+        self.invalid = 0
+        self.fallback = 0
+        self.expired = 0
+        self.attempts = 0
+        self.latencies = []
+        self.build_times = []
+        self.elapsed = elapsed
+        for (messages, mail), result in zip(requests, results):
+            self.requests += 1
+            self.messages += len(messages)
+            if result.sent:
+                self.sent += len(messages)
+                if result.fallback:
+                    self.fallback += len(messages)
+            elif result.skipped:
+                self.skipped += len(messages)
+            else:
+                self.failed += len(messages)
+                if isinstance(result.error, DeadlineExceededError):
+                    self.expired += len(messages)
+            self.suppressed += result.suppressed
+            self.invalid += result.invalid
+            self.attempts += result.attempts
+            if result.latency is not None:
+                self.latencies.append(result.latency)
+            if result.build_time is not None:
+                self.build_times.append(result.build_time)
+
+    @property
+    def retries(self):
+        return max(self.attempts - self.requests, 0)
+
+    @property
+    def mean_latency(self):
+        if not self.latencies:
+            return None
+        return sum(self.latencies) / len(self.latencies)
+
+    @property
+    def max_latency(self):
+        return max(self.latencies) if self.latencies else None
+
+    @property
+    def build_time(self):
+        return sum(self.build_times)
+
+    def __repr__(self):
+        return '<SendStats sent=%d failed=%d requests=%d attempts=%d>' % (
+            self.sent, self.failed, self.requests, self.attempts)
+
+
+def message_id(headers):
+    '''
+    Return the X-Message-Id of response headers, or None.
+    '''
+    if not headers:
+        return None
+    try:
+        return headers.get('X-Message-Id')
+    except AttributeError:
+        return None
@@ -1,24 +1,100 @@
 from django.conf import settings
+from django.core.signals import setting_changed
 import re
 
+SANDBOX_SETTINGS = frozenset([
+    "SENDGRID_SANDBOX",
+    "SENDGRID_SANDBOX_WHITELIST_DOMAINS",
+    "SENDGRID_SANDBOX_WHITELIST_REGEX",
+])
 
-def can_enable_sandbox_mode(to_addresses=[]):
-    wants_sandbox_mode = getattr(settings, "SENDGRID_SANDBOX", False)
-    if not wants_sandbox_mode:
-        return False
+# Patterns using numbered backreferences can't be merged into a single
+# alternation, since merging renumbers their groups.
+_BACKREFERENCE_RE = re.compile(r'\\[1-9]')
+
+
+class SandboxMatcher(object):
+    '''
+    Sandbox whitelist compiled from settings.
+
+    Domains are kept in a frozenset and the regexes merged into a single
+    alternation, so checking an address costs one set lookup and one match.
+    '''
+    def __init__(self, enabled=False, domains=(), regexes=()):
+        self.enabled = enabled
+        self.domains = frozenset(domains)
+        self.regexes = self._compile(list(regexes))
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            enabled=getattr(settings, "SENDGRID_SANDBOX", False),
+            domains=getattr(settings, "SENDGRID_SANDBOX_WHITELIST_DOMAINS", []),
+            regexes=getattr(settings, "SENDGRID_SANDBOX_WHITELIST_REGEX", []),
+        )
+
+    @staticmethod
+    def _compile(regexes):
+        if not regexes:
+            return []
+        if not any(_BACKREFERENCE_RE.search(r) for r in regexes):
+            try:
+                return [re.compile('|'.join('(?:%s)' % r for r in regexes))]
+            except re.error:
+                # e.g. inline global flags or duplicate group names
+                pass
+        return [re.compile(r) for r in regexes]
+
+    def is_whitelisted(self, address):
+        domain = address.split("@")[1] if "@" in address else None
+        if domain in self.domains:
+            return True
+        return any(regex.match(address) for regex in self.regexes)
+
+    def classify(self, addresses):
+        '''
+        Split ``addresses`` into whitelisted and other addresses.
+        '''
+        whitelisted = []
+        others = []
+        for address in addresses:
+            if self.is_whitelisted(address):
+                whitelisted.append(address)
+            else:
+                others.append(address)
+        return whitelisted, others
 
-    if not to_addresses:
-        return True
+    def can_enable_sandbox_mode(self, to_addresses):
+        if not self.enabled:
+            return False
+        if not to_addresses:
+            return True
+        # Sandbox mode is enabled unless every address is whitelisted.
+        return not all(self.is_whitelisted(a) for a in to_addresses)
 
-    domain_whitelist = getattr(settings, "SENDGRID_SANDBOX_WHITELIST_DOMAINS", [])
-    regex_whitelist = getattr(settings, "SENDGRID_SANDBOX_WHITELIST_REGEX", [])
-    regex_whitelist_compiled = map(re.compile, regex_whitelist)
 
-    for to_address in to_addresses:
-        to_address_domain = to_address.split("@")[1]
-        if to_address_domain not in domain_whitelist and not any(
-            regex.match(to_address) for regex in regex_whitelist_compiled
-        ):
-            return True  # Return True if any address is not in the whitelist
+_matcher = None
 
-    return False  # Only return False if all addresses are in the whitelist
+
+def get_sandbox_matcher():
+    '''
+    Return the SandboxMatcher built from the current settings.
+    '''
+    global _matcher
+    matcher = _matcher
+    if matcher is None:
+        matcher = _matcher = SandboxMatcher.from_settings()
+    return matcher
+
+
+def _reset_sandbox_matcher(setting, **kwargs):
+    global _matcher
+    if setting in SANDBOX_SETTINGS:
+        _matcher = None
+
+
+setting_changed.connect(_reset_sandbox_matcher)
+
+
+def can_enable_sandbox_mode(to_addresses=[]):
+    return get_sandbox_matcher().can_enable_sandbox_mode(to_addresses)
@@ -0,0 +1,27 @@
+'''
+Signals sent around the hot path of SendGridBackend.
+
+``sender`` is the backend class and every signal has a ``backend``
+argument. They are only sent when a receiver is connected.
+
+pre_build(message)
+    Before the payload of ``message`` is built.
+post_build(message, mail, duration)
+    After it was built, in ``duration`` seconds.
+pre_send(messages, mail)
+    Before the request carrying ``messages`` is posted.
+post_send(messages, mail, result)
+    After it was posted (or failed), with the SendResult of the request.
+circuit_state_changed(breaker, previous, state)
+    When a request or its outcome moved the circuit breaker from the
+    ``previous`` state to ``state`` ("closed", "open" or "half_open").
+'''
+from django.dispatch import Signal
+
+pre_build = Signal()
+post_build = Signal()
+pre_send = Signal()
+post_send = Signal()
+circuit_state_changed = Signal()
+
+SIGNALS = (pre_build, post_build, pre_send, post_send)
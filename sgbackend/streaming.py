@@ -0,0 +1,152 @@
+'''
+Streaming request bodies for payloads with attachments.
+
+Attachment contents are kept as Base64Content: the raw bytes, encoded to
+base64 one chunk at a time while the request body is being sent. Peak
+memory for a message is then the raw attachment bytes (already held by the
+EmailMessage), the JSON of the other fields and one encoded chunk, instead
+of the raw bytes plus their base64 bytes plus a decoded str for every
+attachment.
+'''
+import base64
+import json
+import re
+
+# Raw bytes encoded per chunk; a multiple of 3 so chunks concatenate into
+# valid base64 without padding in the middle.
+CHUNK_SIZE = 3 * 64 * 1024
+
+_PLACEHOLDER = u'\x00sgbackend-attachment:%d\x00'
+_PLACEHOLDER_RE = re.compile(r'\\u0000sgbackend-attachment:(\d+)\\u0000')
+
+
+class Base64Content(object):
+    '''
+    Base64 text of ``data``, produced in chunks on demand.
+
+    ``encoded`` optionally gives the already encoded bytes (e.g. from the
+    attachment cache); chunks are then slices of it instead of copies.
+    '''
+    def __init__(self, data, chunk_size=CHUNK_SIZE, encoded=None):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.data = data
+        self.encoded = encoded
+        self.chunk_size = max(chunk_size - chunk_size % 3, 3)
+
+    def __len__(self):
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def __iter__(self):
+        if self.encoded is not None:
+            view = memoryview(self.encoded)
+            size = self.chunk_size // 3 * 4
+            for start in range(0, len(view), size):
+                yield view[start:start + size]
+            return
+        view = memoryview(self.data)
+        for start in range(0, len(view), self.chunk_size):
+            yield base64.b64encode(view[start:start + self.chunk_size])
+
+    def __str__(self):
+        if self.encoded is not None:
+            return self.encoded.decode('ascii')
+        return b''.join(self).decode('ascii')
+
+    def __eq__(self, other):
+        if isinstance(other, Base64Content):
+            return self.data == other.data
+        return str(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def materialize(mail):
+    '''
+    Replace the Base64Content attachment contents of ``mail`` with str, for
+    transports that need a plain JSON-serializable dict.
+    '''
+    attachments = mail.get("attachments")
+    if not attachments or not any(
+        isinstance(a.get("content"), Base64Content) for a in attachments
+    ):
+        return mail
+    mail = dict(mail)
+    mail["attachments"] = [
+        dict(a, content=str(a["content"]))
+        if isinstance(a.get("content"), Base64Content) else a
+        for a in attachments
+    ]
+    return mail
+
+
+class StreamingBody(object):
+    '''
+    JSON request body that encodes attachment contents while it is sent.
+    ``len()`` is the exact Content-Length.
+
+    ``chunks()`` yields the body as written to the connection: the JSON
+    around the attachments, then each attachment's base64 chunks, which are
+    memoryview slices of cached encodings. ``read()`` makes it file-like.
+    '''
+    def __init__(self, mail):
+        contents = []
+
+        def default(obj):
+            if isinstance(obj, Base64Content):
+                contents.append(obj)
+                return _PLACEHOLDER % (len(contents) - 1)
+            raise TypeError(repr(obj) + ' is not JSON serializable')
+
+        # json.dumps escapes non-ASCII characters, so the text is ASCII.
+        text = json.dumps(mail, default=default)
+        self.parts = []
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(text):
+            self.parts.append(text[position:match.start()].encode('ascii'))
+            self.parts.append(contents[int(match.group(1))])
+            position = match.end()
+        self.parts.append(text[position:].encode('ascii'))
+        self.length = sum(len(part) for part in self.parts)
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self):
+        '''
+        Iterate over the body in chunks, without copying them.
+        '''
+        for part in self.parts:
+            if isinstance(part, Base64Content):
+                for chunk in part:
+                    yield chunk
+            elif part:
+                yield part
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError('StreamingBody can only be rewound')
+        self._iterator = self.chunks()
+        self._chunk = b''
+        self._offset = 0
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk = next(self._iterator)
+                except StopIteration:
+                    break
+                self._offset = 0
+            end = len(self._chunk) if size < 0 else self._offset + size
+            piece = self._chunk[self._offset:end]
+            self._offset += len(piece)
+            data.append(piece)
+            if size > 0:
+                size -= len(piece)
+        return b''.join(data)
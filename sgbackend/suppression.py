@@ -0,0 +1,300 @@
+'''
+Local index of suppressed addresses (bounces, unsubscribes, spam reports)
+consulted before building personalizations, so requests are not spent on
+recipients SendGrid would drop.
+
+Addresses come from a text file, one per line (the first column of a CSV
+export works too), or from a database table, and are kept in a set or, for
+very large lists, in a Bloom filter. The index is refreshed incrementally:
+lines appended to the file and rows with a higher id than the last one
+read are added; a truncated or replaced file is reloaded.
+'''
+import hashlib
+import io
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+try:
+    import rfc822
+except ImportError:
+    import email.utils as rfc822
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from asyncio import get_running_loop as _get_running_loop
+except ImportError:  # Python < 3.7
+    try:
+        from asyncio import _get_running_loop
+    except ImportError:
+        _get_running_loop = None
+
+logger = logging.getLogger(__name__)
+
+
+def _on_event_loop():
+    '''
+    Whether the calling thread is running an asyncio event loop, which
+    must not block on reading the source.
+    '''
+    if _get_running_loop is None:
+        return False
+    try:
+        return _get_running_loop() is not None
+    except RuntimeError:
+        return False
+
+
+def normalize(address):
+    '''
+    Return the lowercased address of ``"Name <user@example.com>"``.
+    '''
+    return rfc822.parseaddr(address)[1].strip().lower()
+
+
+class BloomFilter(object):
+    '''
+    Set of strings answering membership with a false positive rate of
+    ``error_rate`` while it holds at most ``capacity`` items, in about
+    ``1.44 * log2(1 / error_rate)`` bits per item.
+    '''
+    def __init__(self, capacity, error_rate=0.0001):
+        capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(int(round(
+            float(self.size) / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.sha1(item.encode('utf-8')).digest()
+        # Double hashing: positions h1 + i * h2.
+        h1, h2 = struct.unpack('<QQ', digest[:16])
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+class FileSource(object):
+    '''
+    Addresses read from a text file, one per line. Only the lines appended
+    since the last read are read again, unless the file was truncated or
+    replaced.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._inode = None
+        self._offset = 0
+
+    def read(self):
+        '''
+        Return a ``(reset, addresses)`` pair: whether the addresses replace
+        the ones read before, and the new addresses.
+        '''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False, []
+        reset = self._inode != stat.st_ino or stat.st_size < self._offset
+        if reset:
+            self._inode = stat.st_ino
+            self._offset = 0
+        with io.open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A partly written last line is read on the next refresh.
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        addresses = []
+        for line in data[:end].decode('utf-8', 'replace').splitlines():
+            address = line.split(',', 1)[0].strip().strip('"')
+            if '@' in address:
+                addresses.append(address)
+        return reset, addresses
+
+
+class TableSource(object):
+    '''
+    Addresses of the ``email`` column of a database table. Rows are read
+    in ``id`` order and only rows with a higher id than the last one read
+    are read again, except every ``reload_interval`` seconds when the whole
+    table is read again, so that deleted rows are forgotten.
+    '''
+    def __init__(self, table, using='default', column='email', key='id',
+                 reload_interval=3600):
+        self.table = table
+        self.using = using
+        self.column = column
+        self.key = key
+        self.reload_interval = reload_interval
+        self.loaded = 0
+        self._last = None
+
+    def read(self):
+        from django.db import connections
+
+        connection = connections[self.using]
+        if self.reload_interval is not None and \
+                time.time() - self.loaded >= self.reload_interval:
+            self._last = None
+        quote = connection.ops.quote_name
+        sql = 'SELECT %s, %s FROM %s' % (
+            quote(self.key), quote(self.column), quote(self.table))
+        params = []
+        if self._last is not None:
+            sql += ' WHERE %s > %%s' % quote(self.key)
+            params.append(self._last)
+        sql += ' ORDER BY %s' % quote(self.key)
+        reset = self._last is None
+        if reset:
+            self.loaded = time.time()
+        addresses = []
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for key, address in cursor.fetchall():
+                self._last = key
+                if address:
+                    addresses.append(address)
+        return reset, addresses
+
+
+class SuppressionList(object):
+    '''
+    In-memory index of the addresses of ``source``, refreshed at most every
+    ``refresh_interval`` seconds by the thread that looks it up. Lookups
+    made on a running event loop do not refresh it: call
+    ``maybe_refresh()`` in an executor first. A failed refresh keeps the
+    current index.
+
+    With ``bloom_capacity``, addresses are kept in a BloomFilter sized for
+    that many addresses instead of a set: a deliverable address is then
+    suppressed with a probability of ``error_rate``.
+    '''
+    def __init__(self, source, refresh_interval=60, bloom_capacity=None,
+                 error_rate=0.0001):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.refreshed = 0
+        self._index = self._new_index()
+        self._lock = threading.Lock()
+        if not _on_event_loop():
+            self.refresh()
+
+    def _new_index(self):
+        if self.bloom_capacity:
+            return BloomFilter(self.bloom_capacity, self.error_rate)
+        return set()
+
+    def __len__(self):
+        return len(self._index)
+
+    def refresh(self):
+        '''
+        Add the addresses added to the source since the last refresh.
+        '''
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        reset, addresses = self.source.read()
+        index = self._new_index() if reset else self._index
+        for address in addresses:
+            index.add(normalize(address))
+        # Lookups keep using the previous index until the new one is full.
+        self._index = index
+        self.refreshed = time.time()
+
+    def maybe_refresh(self):
+        '''
+        Refresh the index if it is older than ``refresh_interval`` seconds,
+        or was never loaded.
+        '''
+        if self.refreshed and (
+                not self.refresh_interval or
+                time.time() - self.refreshed < self.refresh_interval):
+            return
+        # One thread refreshes; the others use the current index.
+        if self._lock.acquire(False):
+            try:
+                self._refresh()
+            except Exception:
+                logger.exception('Could not refresh the suppression list')
+                # Retried after refresh_interval.
+                self.refreshed = time.time()
+            finally:
+                self._lock.release()
+
+    def _maybe_refresh(self):
+        if not _on_event_loop():
+            self.maybe_refresh()
+
+    def __contains__(self, address):
+        self._maybe_refresh()
+        return normalize(address) in self._index
+
+    def suppressed(self, addresses):
+        '''
+        Return the suppressed addresses among ``addresses``.
+        '''
+        self._maybe_refresh()
+        index = self._index
+        return [a for a in addresses if normalize(a) in index]
+
+
+_suppression_lists = {}
+_suppression_lock = threading.Lock()
+
+
+def get_suppression_list():
+    '''
+    Return the process-wide SuppressionList configured by
+    SENDGRID_SUPPRESSION_FILE or SENDGRID_SUPPRESSION_TABLE, or None.
+    '''
+    path = getattr(settings, "SENDGRID_SUPPRESSION_FILE", None)
+    table = getattr(settings, "SENDGRID_SUPPRESSION_TABLE", None)
+    if not path and not table:
+        return None
+    if path and table:
+        raise ImproperlyConfigured('''
+            SENDGRID_SUPPRESSION_FILE and SENDGRID_SUPPRESSION_TABLE are
+            mutually exclusive''')
+    using = getattr(settings, "SENDGRID_SUPPRESSION_DATABASE", "default")
+    refresh_interval = getattr(settings, "SENDGRID_SUPPRESSION_REFRESH", 60)
+    bloom_capacity = getattr(settings, "SENDGRID_SUPPRESSION_BLOOM", None)
+    error_rate = getattr(
+        settings, "SENDGRID_SUPPRESSION_ERROR_RATE", 0.0001)
+    reload_interval = getattr(settings, "SENDGRID_SUPPRESSION_RELOAD", 3600)
+    key = (path, table, using, refresh_interval, bloom_capacity, error_rate,
+           reload_interval)
+    with _suppression_lock:
+        suppression = _suppression_lists.get(key)
+        if suppression is None:
+            if path:
+                source = FileSource(path)
+            else:
+                source = TableSource(
+                    table, using, reload_interval=reload_interval)
+            suppression = _suppression_lists[key] = SuppressionList(
+                source, refresh_interval, bloom_capacity, error_rate)
+        return suppression
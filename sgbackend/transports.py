@@ -0,0 +1,149 @@
+'''
+Transports posting built payloads for SendGridBackend.
+
+``SENDGRID_TRANSPORT`` selects one: "http" (the default) posts to the v3
+mail/send endpoint, "capture" appends the payloads to a JSON lines file and
+"fake" answers after ``SENDGRID_FAKE_LATENCY`` seconds. Neither of the
+last two touches the network. A dotted path to a Transport subclass, taking
+the backend as only argument, may be given instead.
+'''
+import atexit
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from sgbackend import payload
+from sgbackend.pool import Response
+from sgbackend.streaming import materialize
+
+
+class Transport(object):
+    '''
+    Base transport.
+    '''
+    def send(self, mail, result=None, timeout=None):
+        '''
+        Send a payload and return its response (with ``status_code`` and
+        ``headers``), or raise the python_http_client HTTPError of a
+        failure. The serialization time and body size may be recorded on
+        ``result``. ``timeout`` is the time left before the deadline of the
+        ``send_messages`` call, if any, in seconds.
+        '''
+        raise NotImplementedError
+
+
+class HTTPTransport(Transport):
+    '''
+    Post to the SendGrid API, over the backend's connection pool if it has
+    one.
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+
+    def send(self, mail, result=None, timeout=None):
+        return self.backend._post(mail, result, timeout)
+
+
+def _accepted():
+    return Response(202, 'Accepted', {'X-Message-Id': uuid.uuid4().hex}, b'')
+
+
+class CaptureTransport(Transport):
+    '''
+    Append payloads to a JSON lines file, one line per request.
+
+    Writes go through a ``buffer_size`` buffer shared by the threads of the
+    process, flushed when full, by close_captures() and at exit.
+    '''
+    def __init__(self, path, buffer_size=1024 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.file = open(path, 'ab', buffer_size)
+        self._lock = threading.Lock()
+
+    def send(self, mail, result=None, timeout=None):
+        started = time.time()
+        line = payload.dumps(materialize(mail)) + b'\n'
+        if result is not None:
+            result.serialize_time = time.time() - started
+            result.body_size = len(line) - 1
+        with self._lock:
+            if self.file.closed:
+                # Closed by close_captures(); keep appending.
+                self.file = open(self.path, 'ab', self.buffer_size)
+            self.file.write(line)
+        return _accepted()
+
+    def flush(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.flush()
+
+
+class FakeTransport(Transport):
+    '''
+    Accept every payload after ``latency`` seconds, or time out like a
+    socket if ``timeout`` is shorter.
+    '''
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    def send(self, mail, result=None, timeout=None):
+        if timeout is not None and timeout < self.latency:
+            time.sleep(timeout)
+            raise socket.timeout('timed out')
+        if self.latency:
+            time.sleep(self.latency)
+        return _accepted()
+
+
+_captures = {}
+_captures_lock = threading.Lock()
+
+
+def get_capture_transport(path):
+    '''
+    Return the process-wide CaptureTransport writing to ``path``.
+    '''
+    with _captures_lock:
+        transport = _captures.get(path)
+        if transport is None:
+            transport = _captures[path] = CaptureTransport(path)
+        return transport
+
+
+@atexit.register
+def close_captures():
+    '''
+    Flush and close every capture file.
+    '''
+    with _captures_lock:
+        transports = list(_captures.values())
+    for transport in transports:
+        with transport._lock:
+            transport.file.close()
+
+
+def get_transport(backend):
+    '''
+    Return the transport selected by SENDGRID_TRANSPORT for ``backend``.
+    '''
+    name = getattr(settings, "SENDGRID_TRANSPORT", "http")
+    if name == "http":
+        return HTTPTransport(backend)
+    if name == "capture":
+        return get_capture_transport(getattr(
+            settings, "SENDGRID_CAPTURE_PATH", "sendgrid_capture.jsonl"))
+    if name == "fake":
+        return FakeTransport(getattr(settings, "SENDGRID_FAKE_LATENCY", 0))
+    try:
+        return import_string(name)(backend)
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            'SENDGRID_TRANSPORT must be "http", "capture", "fake" or the '
+            'dotted path of a Transport class: %s' % e)
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def pytest_configure():
+    if not settings.configured:
+        settings.configure()
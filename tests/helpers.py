@@ -0,0 +1,31 @@
+from django.test.utils import override_settings
+
+from sgbackend import SendGridBackend
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def mock_backend(cls=SendGridBackend, kwargs=None, **settings):
+    '''
+    Return a ``cls`` backend created with ``settings`` (and a test API key)
+    whose API client is a mock answering every mail/send with a 202.
+    '''
+    settings.setdefault("SENDGRID_API_KEY", "test_key")
+    with override_settings(**settings):
+        backend = cls(**(kwargs or {}))
+    backend.sg = mock.MagicMock()
+    backend.sg.client.mail.send.post.return_value = mock.MagicMock(
+        status_code=202, headers={"X-Message-Id": "abc"})
+    return backend
+
+
+def posted(backend):
+    '''
+    Return the request bodies a mock_backend posted to mail/send.
+    '''
+    return [
+        call[1]["request_body"]
+        for call in backend.sg.client.mail.send.post.call_args_list]
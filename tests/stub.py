@@ -0,0 +1,102 @@
+import gzip
+import io
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    '''
+    Local keep-alive stand-in for the v3 mail/send endpoint.
+
+    ``responses`` optionally maps a "to" address to a ``(status, headers)``
+    pair; every other request gets a 202 with an X-Message-Id header.
+    ``latency`` seconds are slept before answering. ``bandwidth`` limits
+    the upload speed of request bodies, in bytes per second. Gzipped bodies
+    are decompressed.
+    '''
+    daemon_threads = True
+
+    def __init__(self, latency=0, responses=None, bandwidth=None):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.responses = responses or {}
+        self.bodies = []
+        self.headers = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def __enter__(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _read(self, length):
+        if not self.server.bandwidth:
+            return self.rfile.read(length)
+        parts = []
+        while length > 0:
+            part = self.rfile.read(min(length, 16 * 1024))
+            if not part:
+                break
+            parts.append(part)
+            length -= len(part)
+            time.sleep(float(len(part)) / self.server.bandwidth)
+        return b"".join(parts)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = self._read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        body = json.loads(data.decode("utf-8"))
+        with self.server.lock:
+            self.server.bodies.append(body)
+            self.server.headers.append(self.headers)
+            count = len(self.server.bodies)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            to = body["personalizations"][0]["to"][0]["email"]
+        except (KeyError, IndexError):
+            to = None
+        status, headers = self.server.responses.get(
+            to, (202, {"X-Message-Id": "message-%d" % count}))
+        payload = b"" if status < 400 else b'{"errors": []}'
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
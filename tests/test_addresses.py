@@ -0,0 +1,128 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend.addresses import (
+    InvalidRecipientsError, _parsed, clean_recipients, parse, parseaddr)
+
+from .helpers import mock_backend, posted
+
+
+class ParseTests(TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse("Jane Doe <jane@example.com>"),
+            ("Jane Doe", "jane@example.com", True))
+        self.assertEqual(
+            parseaddr("jane@example.com"), ("", "jane@example.com"))
+
+    def test_memoized(self):
+        _parsed.clear()
+        parseaddr("memo@example.com")
+        parseaddr("memo@example.com")
+        self.assertEqual((_parsed.misses, _parsed.hits), (1, 1))
+        # Only sender addresses are memoized.
+        parse("memo@example.com")
+        self.assertEqual((_parsed.misses, _parsed.hits), (1, 1))
+
+    def test_validation(self):
+        for address in ("user@example.com", "first.last+tag@mail.example.org",
+                        "Name <user@example.co.uk>", "josé@exämple.com"):
+            self.assertTrue(parse(address)[2], address)
+        for address in ("", "user", "user@", "@example.com", "user@example",
+                        "user@example.c", "us er@example.com",
+                        "user@@example.com", "user@example..com"):
+            self.assertFalse(parse(address)[2], address)
+
+    def test_clean_recipients(self):
+        fields = (["a@example.com", "bad", "A <A@Example.com>"],
+                  ["b@example.com", "a@example.com"],
+                  ["c@example.com", "b@example.com"])
+        self.assertEqual(clean_recipients(fields), (fields, []))
+        self.assertEqual(
+            clean_recipients(fields, validate=True),
+            ([["a@example.com"], ["b@example.com"], ["c@example.com"]],
+             ["bad"]))
+        self.assertEqual(
+            clean_recipients(fields, frozenset(["bad", "c@example.com"])),
+            ([["a@example.com", "A <A@Example.com>"],
+              ["b@example.com", "a@example.com"], ["b@example.com"]], []))
+
+
+class RecipientValidationTests(TestCase):
+    def _message(self, to, cc=None):
+        return EmailMessage(
+            subject="Hi", body="Body.", from_email="sender@example.com",
+            to=to, cc=cc)
+
+    def test_disabled_by_default(self):
+        backend = mock_backend()
+        msg = self._message(["a@example.com", "a@example.com", "bad"])
+        backend.send_messages([msg])
+        self.assertEqual(
+            len(posted(backend)[0]["personalizations"][0]["to"]), 3)
+        self.assertFalse(hasattr(msg, "invalid_recipients"))
+
+    def test_invalid_setting(self):
+        with self.assertRaises(ImproperlyConfigured):
+            mock_backend(SENDGRID_VALIDATE_RECIPIENTS="fix")
+
+    def test_drop(self):
+        for builder in ("helpers", "direct"):
+            backend = mock_backend(
+                SENDGRID_VALIDATE_RECIPIENTS="drop",
+                SENDGRID_PAYLOAD_BUILDER=builder)
+            msg = self._message(
+                ["a@example.com", "not an address", "A@EXAMPLE.COM"],
+                cc=["a@example.com", "b@example.com"])
+            self.assertEqual(backend.send_messages([msg]), 1)
+            personalization = posted(backend)[0]["personalizations"][0]
+            self.assertEqual(
+                personalization["to"], [{"email": "a@example.com"}])
+            self.assertEqual(
+                personalization["cc"], [{"email": "b@example.com"}])
+            self.assertEqual(msg.invalid_recipients, ["not an address"])
+            self.assertEqual(msg.sendgrid_result.invalid, 1)
+            self.assertEqual(backend.stats.invalid, 1)
+
+    def test_drop_without_valid_recipient_skips(self):
+        backend = mock_backend(SENDGRID_VALIDATE_RECIPIENTS="drop")
+        msg = self._message(["nobody"])
+        self.assertEqual(backend.send_messages([msg]), 0)
+        self.assertEqual(posted(backend), [])
+        self.assertTrue(msg.sendgrid_result.skipped)
+        self.assertEqual(backend.failed_messages, [])
+
+    def test_reject(self):
+        backend = mock_backend(SENDGRID_VALIDATE_RECIPIENTS="reject")
+        invalid = self._message(["a@example.com", "a@"])
+        valid = self._message(["b@example.com", "b@example.com"])
+        backend.fail_silently = True
+        self.assertEqual(backend.send_messages([invalid, valid]), 1)
+        self.assertEqual(len(posted(backend)), 1)
+        self.assertEqual(
+            posted(backend)[0]["personalizations"][0]["to"],
+            [{"email": "b@example.com"}])
+        self.assertIsInstance(
+            invalid.sendgrid_result.error, InvalidRecipientsError)
+        self.assertEqual(invalid.sendgrid_result.error.addresses, ["a@"])
+        self.assertEqual(backend.failed_messages, [invalid])
+
+    def test_reject_raises(self):
+        backend = mock_backend(SENDGRID_VALIDATE_RECIPIENTS="reject")
+        with self.assertRaises(InvalidRecipientsError):
+            backend.send_messages([self._message(["a@"])])
+        self.assertEqual(posted(backend), [])
+
+    def test_reject_batched(self):
+        backend = mock_backend(
+            SENDGRID_VALIDATE_RECIPIENTS="reject",
+            SENDGRID_BATCH_PERSONALIZATIONS=True)
+        backend.fail_silently = True
+        msgs = [self._message([to]) for to in
+                ("a@example.com", "a@", "b@example.com")]
+        self.assertEqual(backend.send_messages(msgs), 2)
+        bodies = posted(backend)
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(len(bodies[0]["personalizations"]), 2)
+        self.assertEqual(backend.failed_messages, [msgs[1]])
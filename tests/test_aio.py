@@ -0,0 +1,184 @@
+import asyncio
+import threading
+
+import pytest
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from sgbackend import AsyncSendGridBackend  # noqa: E402
+from sgbackend.suppression import SuppressionList  # noqa: E402
+
+from .stub import StubServer  # noqa: E402
+
+
+class StubSendGrid(object):
+    '''Local stand-in for the v3 mail/send endpoint.'''
+
+    def __init__(self, fail_for=None, delay=0):
+        self.fail_for = fail_for
+        self.delay = delay
+        self.bodies = []
+        self.encodings = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        body = await request.json()
+        self.bodies.append(body)
+        self.encodings.append(request.headers.get("Content-Encoding"))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        to = body["personalizations"][0]["to"][0]["email"]
+        if to == self.fail_for:
+            return web.json_response({"errors": []}, status=400)
+        return web.Response(status=202)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v3/mail/send", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return "http://127.0.0.1:%d" % port
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class AsyncSendGridBackendTests(TestCase):
+    def _send(self, stub, msgs, settings=None, **kwargs):
+        async def run():
+            host = await stub.start()
+            try:
+                backend = AsyncSendGridBackend(host=host, **kwargs)
+                count = await backend.asend_messages(msgs)
+                return backend, count
+            finally:
+                await stub.stop()
+
+        with self.settings(SENDGRID_API_KEY="test_key", **(settings or {})):
+            return asyncio.run(run())
+
+    def _messages(self, n):
+        return [EmailMessage(to=["test%d@example.com" % i]) for i in range(n)]
+
+    def test_asend_messages(self):
+        stub = StubSendGrid(delay=0.01)
+        msgs = self._messages(20)
+        backend, count = self._send(stub, msgs, max_concurrency=5)
+        self.assertEqual(count, 20)
+        self.assertEqual(len(stub.bodies), 20)
+        self.assertEqual(stub.max_in_flight, 5)
+        expected = AsyncSendGridBackend(api_key="test_key")._build_sg_mail(msgs[0])
+        self.assertIn(expected, stub.bodies)
+
+    def test_asend_messages_fail_silently(self):
+        stub = StubSendGrid(fail_for="test1@example.com")
+        msgs = self._messages(3)
+        backend, count = self._send(stub, msgs, fail_silently=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(backend.failed_messages, [msgs[1]])
+
+    def test_asend_messages_raises(self):
+        stub = StubSendGrid(fail_for="test1@example.com")
+        with self.assertRaises(HTTPError) as cm:
+            self._send(stub, self._messages(3))
+        self.assertEqual(cm.exception.status_code, 400)
+
+    def test_asend_messages_gzip(self):
+        stub = StubSendGrid()
+        msgs = [
+            EmailMessage(body="short", to=["small@example.com"]),
+            EmailMessage(body="long " * 1000, to=["large@example.com"]),
+        ]
+        backend, count = self._send(stub, msgs, settings={
+            "SENDGRID_GZIP": True, "SENDGRID_GZIP_THRESHOLD": 1000})
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(stub.encodings, key=str), [None, "gzip"])
+        self.assertLess(msgs[1].sendgrid_result.body_size, 1000)
+
+    def test_blocking_send_messages(self):
+        for settings in ({}, {"SENDGRID_READ_TIMEOUT": 5}):
+            with self.settings(SENDGRID_API_KEY="test_key", **settings):
+                backend = AsyncSendGridBackend()
+            with StubServer() as server:
+                backend.sg.client.host = server.url
+                self.assertEqual(
+                    backend.send_messages(self._messages(2), timeout=10), 2)
+            self.assertEqual(len(server.bodies), 2)
+
+    def test_connection_error_fails_request(self):
+        async def run():
+            # Nothing listens on the port of a stopped server.
+            stub = StubSendGrid()
+            host = await stub.start()
+            await stub.stop()
+            backend = AsyncSendGridBackend(host=host, fail_silently=True)
+            msgs = self._messages(2)
+            return backend, msgs, await backend.asend_messages(msgs)
+
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            backend, msgs, count = asyncio.run(run())
+        self.assertEqual(count, 0)
+        self.assertEqual(backend.failed_messages, msgs)
+        self.assertIsInstance(
+            msgs[0].sendgrid_result.error, aiohttp.ClientConnectionError)
+        self.assertEqual(backend.stats.failed, 2)
+
+    def test_build_error_fails_request(self):
+        stub = StubSendGrid()
+        msgs = self._messages(3)
+        with mock.patch.object(
+                AsyncSendGridBackend, "_build_sg_mail",
+                side_effect=[{"personalizations": [
+                    {"to": [{"email": "test0@example.com"}]}]},
+                    ValueError("bad message"),
+                    {"personalizations": [
+                        {"to": [{"email": "test2@example.com"}]}]}]):
+            backend, count = self._send(stub, msgs, fail_silently=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(backend.failed_messages, [msgs[1]])
+        self.assertIsInstance(msgs[1].sendgrid_result.error, ValueError)
+
+    def test_suppression_not_refreshed_on_event_loop(self):
+        source = mock.Mock()
+        threads = []
+
+        def read():
+            # Django's ORM raises SynchronousOnlyOperation on the loop.
+            threads.append(threading.current_thread())
+            return True, ["test1@example.com"]
+        source.read.side_effect = read
+
+        async def run():
+            host = await stub.start()
+            try:
+                backend = AsyncSendGridBackend(host=host)
+                backend.suppression = SuppressionList(
+                    source, refresh_interval=1)
+                return await backend.asend_messages(msgs)
+            finally:
+                await stub.stop()
+
+        stub = StubSendGrid()
+        msgs = self._messages(3)
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            self.assertEqual(asyncio.run(run()), 2)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertEqual(msgs[1].suppressed_recipients, ["test1@example.com"])
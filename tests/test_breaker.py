@@ -0,0 +1,242 @@
+import socket
+
+from django.core import mail as django_mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+from sgbackend import SendGridBackend, signals
+from sgbackend import breaker as sgbreaker
+from sgbackend.breaker import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError,
+    get_circuit_breaker)
+from sgbackend.pool import Response
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class CircuitBreakerTests(TestCase):
+    def _breaker(self, **kwargs):
+        changes = []
+        breaker = CircuitBreaker(**kwargs)
+        return breaker, changes, lambda *change: changes.append(change)
+
+    def test_opens_at_error_rate(self):
+        breaker, changes, on_change = self._breaker(
+            error_rate=0.5, window=10, min_requests=4)
+        for failed in (True, False, True):
+            self.assertTrue(breaker.allow(on_change))
+            breaker.record(failed, on_change=on_change)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record(False, on_change=on_change)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(changes, [(CLOSED, OPEN)])
+        self.assertFalse(breaker.allow(on_change))
+
+    def test_window_forgets_old_outcomes(self):
+        breaker = CircuitBreaker(error_rate=0.5, window=4, min_requests=4)
+        for failed in (True, False, False, False, False, True):
+            breaker.record(failed)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_slow_requests_fail(self):
+        breaker = CircuitBreaker(latency=1, window=2, min_requests=2)
+        breaker.record(False, latency=2)
+        breaker.record(False, latency=0.5)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_probe(self):
+        breaker, changes, on_change = self._breaker(
+            window=1, min_requests=1, recovery_time=30)
+        breaker.record(True, on_change=on_change)
+        breaker.opened_at -= 30
+        self.assertTrue(breaker.allow(on_change))
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # A single probe at a time.
+        self.assertFalse(breaker.allow(on_change))
+        breaker.record(True, on_change=on_change)
+        self.assertEqual(breaker.state, OPEN)
+        breaker.opened_at -= 30
+        self.assertTrue(breaker.allow(on_change))
+        breaker.record(False, on_change=on_change)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(changes, [
+            (CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN),
+            (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_get_circuit_breaker(self):
+        breaker = get_circuit_breaker("shared", window=5)
+        self.assertIs(get_circuit_breaker("shared", window=5), breaker)
+        self.assertIsNot(get_circuit_breaker("shared", window=6), breaker)
+
+
+class BackendCircuitBreakerTests(TestCase):
+    def setUp(self):
+        sgbreaker._breakers.clear()
+        self.changes = []
+        signals.circuit_state_changed.connect(self._changed)
+
+    def tearDown(self):
+        signals.circuit_state_changed.disconnect(self._changed)
+        sgbreaker._breakers.clear()
+
+    def _changed(self, sender, backend, breaker, previous, state, **kwargs):
+        self.changes.append((previous, state))
+
+    def _backend(self, error=None, **settings):
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_CIRCUIT_BREAKER=True,
+                SENDGRID_CIRCUIT_WINDOW=4, SENDGRID_CIRCUIT_MIN_REQUESTS=4,
+                **settings):
+            backend = SendGridBackend(fail_silently=True)
+        backend.transport = mock.Mock()
+        if error is not None:
+            backend.transport.send.side_effect = error
+        else:
+            backend.transport.send.return_value = Response(
+                202, "Accepted", {}, b"")
+        return backend
+
+    def _messages(self, count):
+        return [
+            EmailMessage(from_email="sender@example.com",
+                         to=["user%d@example.com" % i])
+            for i in range(count)]
+
+    def test_fails_fast_when_open(self):
+        backend = self._backend(HTTPError(503, "Unavailable", b"", {}))
+        messages = self._messages(6)
+        self.assertEqual(backend.send_messages(messages), 0)
+        self.assertEqual(backend.transport.send.call_count, 4)
+        self.assertIsInstance(messages[3].sendgrid_result.error, HTTPError)
+        self.assertIsInstance(
+            messages[5].sendgrid_result.error, CircuitOpenError)
+        self.assertEqual(messages[5].sendgrid_result.attempts, 0)
+        self.assertEqual(self.changes, [(CLOSED, OPEN)])
+        self.assertEqual(backend.circuit_breaker.state, OPEN)
+        self.assertIs(
+            self._backend().circuit_breaker, backend.circuit_breaker)
+
+    def test_client_errors_do_not_open(self):
+        backend = self._backend(HTTPError(400, "Bad Request", b"", {}))
+        backend.send_messages(self._messages(6))
+        self.assertEqual(backend.transport.send.call_count, 6)
+        self.assertEqual(backend.circuit_breaker.state, CLOSED)
+
+    def test_connection_errors_open(self):
+        backend = self._backend(socket.error("refused"))
+        for i in range(4):
+            message = self._messages(1)[0]
+            self.assertEqual(backend.send_messages([message]), 0)
+            self.assertIsInstance(message.sendgrid_result.error, socket.error)
+        self.assertEqual(backend.circuit_breaker.state, OPEN)
+
+    def test_retries_stop_when_open(self):
+        backend = self._backend(
+            HTTPError(503, "Unavailable", b"", {}),
+            SENDGRID_MAX_RETRIES=10, SENDGRID_RETRY_BACKOFF=0)
+        message = self._messages(1)[0]
+        backend.send_messages([message])
+        self.assertEqual(message.sendgrid_result.attempts, 4)
+        self.assertIsInstance(message.sendgrid_result.error, HTTPError)
+
+    def test_recovery(self):
+        backend = self._backend(HTTPError(503, "Unavailable", b"", {}))
+        backend.send_messages(self._messages(4))
+        backend.circuit_breaker.opened_at -= 30
+        backend.transport.send.side_effect = None
+        backend.transport.send.return_value = Response(
+            202, "Accepted", {}, b"")
+        self.assertEqual(backend.send_messages(self._messages(2)), 2)
+        self.assertEqual(self.changes, [
+            (CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_metrics(self):
+        backend = self._backend(HTTPError(503, "Unavailable", b"", {}))
+        backend.metrics = mock.Mock()
+        backend.send_messages(self._messages(5))
+        backend.metrics.increment.assert_any_call("circuit_open")
+
+    def test_fallback(self):
+        backend = self._backend(
+            HTTPError(503, "Unavailable", b"", {}),
+            SENDGRID_CIRCUIT_FALLBACK=(
+                "django.core.mail.backends.locmem.EmailBackend"))
+        django_mail.outbox = []
+        messages = self._messages(6)
+        self.assertEqual(backend.send_messages(messages), 2)
+        self.assertEqual(
+            [m.to for m in django_mail.outbox], [m.to for m in messages[4:]])
+        self.assertTrue(messages[5].sendgrid_result.fallback)
+        self.assertEqual(backend.stats.fallback, 2)
+        self.assertEqual(backend.failed_messages, messages[:4])
+
+    def test_local_errors_do_not_open(self):
+        backend = self._backend(ValueError("not serializable"))
+        backend.send_messages(self._messages(4))
+        self.assertEqual(len(backend.failed_messages), 4)
+        self.assertEqual(backend.circuit_breaker.state, CLOSED)
+
+    def _open_fallback_backend(self, **settings):
+        backend = self._backend(
+            HTTPError(503, "Unavailable", b"", {}),
+            SENDGRID_CIRCUIT_FALLBACK=(
+                "django.core.mail.backends.locmem.EmailBackend"),
+            **settings)
+        backend.send_messages(self._messages(4))
+        django_mail.outbox = []
+        return backend
+
+    def test_fallback_leaves_out_suppressed_recipients(self):
+        backend = self._open_fallback_backend(
+            SENDGRID_VALIDATE_RECIPIENTS="drop")
+        backend.suppression = mock.Mock()
+        backend.suppression.suppressed.side_effect = lambda addresses: [
+            a for a in addresses if a.startswith("blocked")]
+        message = EmailMessage(
+            from_email="sender@example.com",
+            to=["user@example.com", "blocked@example.com", "bad"],
+            bcc=["blocked2@example.com", "other@example.com"])
+        self.assertEqual(backend.send_messages([message]), 1)
+        sent = django_mail.outbox[0]
+        self.assertEqual(sent.to, ["user@example.com"])
+        self.assertEqual(sent.bcc, ["other@example.com"])
+        self.assertEqual(message.to, [
+            "user@example.com", "blocked@example.com", "bad"])
+
+    def test_fallback_not_used_in_sandbox(self):
+        backend = self._open_fallback_backend(SENDGRID_SANDBOX=True)
+        message = self._messages(1)[0]
+        with self.settings(SENDGRID_SANDBOX=True):
+            self.assertEqual(backend.send_messages([message]), 0)
+        self.assertEqual(django_mail.outbox, [])
+        self.assertIsInstance(message.sendgrid_result.error, CircuitOpenError)
+
+    def test_invalid_fallback(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self._backend(SENDGRID_CIRCUIT_FALLBACK="no.such.Backend")
+
+    def test_async(self):
+        try:
+            import asyncio
+            import aiohttp  # noqa: F401
+            from sgbackend import AsyncSendGridBackend
+        except (ImportError, SyntaxError):
+            self.skipTest("aiohttp is not installed")
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_CIRCUIT_BREAKER=True,
+                SENDGRID_CIRCUIT_WINDOW=2, SENDGRID_CIRCUIT_MIN_REQUESTS=2):
+            backend = AsyncSendGridBackend(fail_silently=True)
+        backend.transport = mock.Mock()
+        backend.transport.send.side_effect = HTTPError(
+            503, "Unavailable", b"", {})
+        backend.max_concurrency = 1
+        messages = self._messages(3)
+        self.assertEqual(asyncio.run(backend.asend_messages(messages)), 0)
+        self.assertEqual(backend.transport.send.call_count, 2)
+        self.assertIsInstance(
+            messages[2].sendgrid_result.error, CircuitOpenError)
@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+from sgbackend.bulk import (
+    Checkpoint, batches, build_payload, bulk_send, read_recipients)
+from sgbackend.management.commands.sendgrid_bulk_send import Command
+from sgbackend.results import SendResult
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+TEMPLATE = {"from_email": "Sender <from@example.com>", "template_id": "d-1"}
+
+
+class BulkTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.tmpdir, "checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+
+class ReadRecipientsTests(BulkTestCase):
+    def test_csv(self):
+        path = self.write(
+            "to.csv", u"email,name,code\na@example.com,A,1\nb@example.com,,2\n")
+        self.assertEqual(list(read_recipients(path)), [
+            ("a@example.com", "A", {"code": "1"}),
+            ("b@example.com", None, {"code": "2"}),
+        ])
+
+    def test_json_lines(self):
+        path = self.write("to.jsonl", u'{"email": "a@example.com", "data": {"n": 1}}\n\n')
+        self.assertEqual(
+            list(read_recipients(path)), [("a@example.com", None, {"n": 1})])
+
+    def test_batches(self):
+        recipients = [("%d@example.com" % i, None, {}) for i in range(2500)]
+        sizes = [(i, len(b)) for i, b in batches(recipients)]
+        self.assertEqual(sizes, [(0, 1000), (1, 1000), (2, 500)])
+
+
+class BuildPayloadTests(TestCase):
+    def test_build_payload(self):
+        mail = build_payload(dict(TEMPLATE, categories=["news"]), [
+            ("a@example.com", "A", {"n": 1}),
+            ("b@example.com", None, {"n": 2}),
+        ])
+        self.assertEqual(mail, {
+            "from": {"email": "from@example.com", "name": "Sender"},
+            "template_id": "d-1",
+            "categories": ["news"],
+            "personalizations": [
+                {"to": [{"email": "a@example.com", "name": "A"}],
+                 "dynamic_template_data": {"n": 1}},
+                {"to": [{"email": "b@example.com"}],
+                 "dynamic_template_data": {"n": 2}},
+            ],
+            "mail_settings": {},
+        })
+
+
+class BulkSendTests(BulkTestCase):
+    def recipients(self, count):
+        return [("%d@example.com" % i, None, {}) for i in range(count)]
+
+    def test_resume_skips_sent_batches(self):
+        backend = mock.Mock(suppression=None)
+        backend._send.side_effect = [
+            SendResult(), SendResult(error=HTTPError(500, "Error", b"", {})),
+            SendResult()]
+        with mock.patch("sgbackend.bulk._backend", backend):
+            checkpoint = Checkpoint(self.checkpoint_path, 2)
+            result = bulk_send(
+                TEMPLATE, self.recipients(5), checkpoint, batch_size=2,
+                processes=1)
+            checkpoint.close()
+            self.assertEqual(result[:3], (3, 2, 0))
+
+            backend._send.side_effect = None
+            backend._send.return_value = SendResult()
+            backend._send.reset_mock()
+            checkpoint = Checkpoint(self.checkpoint_path, 2)
+            result = bulk_send(
+                TEMPLATE, self.recipients(5), checkpoint, batch_size=2,
+                processes=1)
+            checkpoint.close()
+        self.assertEqual(result[:3], (2, 0, 3))
+        (request,), _ = backend._send.call_args
+        self.assertEqual(
+            [p["to"][0]["email"] for p in request[1]["personalizations"]],
+            ["2@example.com", "3@example.com"])
+
+    def test_suppressed_recipients_are_left_out(self):
+        backend = mock.Mock()
+        backend.suppression.suppressed.side_effect = lambda addresses: [
+            a for a in addresses if a in ("1@example.com", "2@example.com",
+                                          "3@example.com")]
+        backend._send.return_value = SendResult()
+        with mock.patch("sgbackend.bulk._backend", backend):
+            checkpoint = Checkpoint(self.checkpoint_path, 2)
+            result = bulk_send(
+                TEMPLATE, self.recipients(4), checkpoint, batch_size=2,
+                processes=1)
+            checkpoint.close()
+        self.assertEqual(result[:3], (1, 0, 0))
+        (request,), _ = backend._send.call_args
+        self.assertEqual(
+            [p["to"][0]["email"] for p in request[1]["personalizations"]],
+            ["0@example.com"])
+        # The fully suppressed batch is done.
+        self.assertIn(1, Checkpoint(self.checkpoint_path, 2))
+
+    def test_checkpoint_batch_size_mismatch(self):
+        Checkpoint(self.checkpoint_path, 2).close()
+        self.assertRaises(ValueError, Checkpoint, self.checkpoint_path, 3)
+
+
+class BulkSendCommandTests(BulkTestCase):
+    def test_command(self):
+        path = self.write("to.jsonl", u"".join(
+            json.dumps({"email": "%d@example.com" % i}) + "\n"
+            for i in range(3)))
+        backend = mock.Mock(suppression=None)
+        backend._send.return_value = SendResult()
+        out = StringIO()
+        with mock.patch("sgbackend.bulk._backend", backend):
+            call_command(
+                Command(), path, template_id="d-1",
+                from_email="from@example.com", batch_size=2, processes=1,
+                stdout=out)
+        self.assertEqual(backend._send.call_count, 2)
+        self.assertIn("Sent 3, failed 0, skipped 0", out.getvalue())
+        self.assertTrue(os.path.exists(path + ".checkpoint"))
+
+    def test_command_reports_failures(self):
+        path = self.write("to.jsonl", u'{"email": "a@example.com"}\n')
+        backend = mock.Mock(suppression=None)
+        backend._send.return_value = SendResult(
+            error=HTTPError(400, "Bad", b"", {}))
+        with mock.patch("sgbackend.bulk._backend", backend):
+            self.assertRaises(
+                CommandError, call_command, Command(), path,
+                template_id="d-1", from_email="from@example.com",
+                processes=1, stdout=StringIO())
+        self.assertEqual(backend._send.call_count, 1)
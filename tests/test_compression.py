@@ -0,0 +1,76 @@
+import base64
+import gzip
+import io
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import SendGridBackend
+from sgbackend.compression import gzip_body, gzip_level
+from sgbackend.streaming import StreamingBody, materialize
+
+from .stub import StubServer
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+class GzipTests(TestCase):
+    def test_gzip_body(self):
+        data = b'{"content": "%s"}' % (b"a" * 10000)
+        compressed = gzip_body(data)
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(gunzip(compressed), data)
+
+    def test_gzip_streaming_body(self):
+        mail = {"attachments": [{"content": "x" * 300000}]}
+        compressed = gzip_body(StreamingBody(mail), chunk_size=1000)
+        self.assertEqual(gunzip(compressed), StreamingBody(mail).read())
+
+    def test_gzip_level(self):
+        self.assertEqual(gzip_level("fast"), 1)
+        self.assertEqual(gzip_level("small"), 9)
+        self.assertEqual(gzip_level(4), 4)
+        for value in ("fastest", 0, 10, True):
+            self.assertRaises(ImproperlyConfigured, gzip_level, value)
+
+
+class SendGridBackendGzipTests(TestCase):
+    def _send(self, server, msgs, **settings):
+        with self.settings(
+            SENDGRID_API_KEY="test_key",
+            SENDGRID_CONNECTION_POOL=True,
+            SENDGRID_POOL_SHARED=False,
+            SENDGRID_GZIP=True,
+            SENDGRID_GZIP_THRESHOLD=1000,
+            **settings
+        ):
+            backend = SendGridBackend()
+        backend.sg.host = server.url
+        self.assertEqual(backend.send_messages(msgs), len(msgs))
+        return backend
+
+    def test_large_bodies_are_compressed(self):
+        small = EmailMessage(body="short", to=["small@example.com"])
+        large = EmailMessage(body="long " * 1000, to=["large@example.com"])
+        with StubServer() as server:
+            backend = self._send(server, [small, large])
+        self.assertEqual(
+            [h.get("Content-Encoding") for h in server.headers],
+            [None, "gzip"])
+        self.assertEqual(server.bodies[1], materialize(backend._build_sg_mail(large)))
+
+    def test_streamed_attachments_are_compressed(self):
+        msg = EmailMessage(to=["a@example.com"])
+        msg.attach("report.pdf", b"0123456789" * 10000, "application/pdf")
+        with StubServer() as server:
+            self._send(
+                server, [msg], SENDGRID_STREAM_ATTACHMENTS=True,
+                SENDGRID_GZIP_LEVEL="small")
+        self.assertEqual(server.headers[0].get("Content-Encoding"), "gzip")
+        self.assertLess(int(server.headers[0]["Content-Length"]), 10000)
+        self.assertEqual(
+            base64.b64decode(server.bodies[0]["attachments"][0]["content"]),
+            b"0123456789" * 10000)
@@ -0,0 +1,161 @@
+import socket
+import time
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import SendGridBackend
+from sgbackend.deadline import (
+    DeadlineExceededError, deadline, expired, remaining)
+from sgbackend.pool import ConnectionPool
+from sgbackend.ratelimit import TokenBucket
+
+from .stub import StubServer
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _messages(count):
+    return [
+        EmailMessage(from_email="sender@example.com",
+                     to=["user%d@example.com" % i])
+        for i in range(count)]
+
+
+class DeadlineTests(TestCase):
+    def test_no_deadline(self):
+        self.assertIsNone(deadline(None))
+        self.assertIsNone(remaining(None))
+
+    def test_remaining_is_never_negative(self):
+        self.assertEqual(remaining(deadline(-1)), 0)
+
+    def test_system_clock_changes_ignored(self):
+        until = deadline(10)
+        with mock.patch("time.time", return_value=time.time() + 3600):
+            self.assertFalse(expired(until))
+            self.assertGreater(remaining(until), 9)
+
+    def test_acquire_timeout(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+        self.assertTrue(bucket.acquire(0))
+        self.assertFalse(bucket.acquire(0.1))
+
+
+class ConnectionPoolTimeoutTests(TestCase):
+    def test_read_timeout(self):
+        with StubServer(latency=0.5) as server:
+            pool = ConnectionPool(server.url, timeout=0.1)
+            with self.assertRaises(socket.timeout):
+                pool.request("POST", "/v3/mail/send", b"{}")
+            pool.close()
+
+    def test_request_timeout_shortens_read_timeout(self):
+        with StubServer(latency=0.5) as server:
+            pool = ConnectionPool(server.url, timeout=10)
+            started = time.time()
+            with self.assertRaises(socket.timeout):
+                pool.request("POST", "/v3/mail/send", b"{}", timeout=0.1)
+            self.assertLess(time.time() - started, 0.5)
+            pool.close()
+
+
+class SendTimeoutTests(TestCase):
+    def _backend(self, **settings):
+        settings.setdefault("SENDGRID_FAKE_LATENCY", 0.2)
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_TRANSPORT="fake",
+                **settings):
+            backend = SendGridBackend(fail_silently=True)
+        return backend
+
+    def test_no_timeout_by_default(self):
+        backend = self._backend()
+        self.assertEqual(backend.send_messages(_messages(2)), 2)
+
+    def test_send_timeout_setting(self):
+        backend = self._backend(SENDGRID_SEND_TIMEOUT=0.3)
+        messages = _messages(4)
+        self.assertEqual(backend.send_messages(messages), 1)
+        self.assertTrue(messages[0].sendgrid_result.sent)
+        # Cut short while in flight.
+        self.assertIsInstance(
+            messages[1].sendgrid_result.error, DeadlineExceededError)
+        self.assertEqual(messages[1].sendgrid_result.attempts, 1)
+        # Never attempted.
+        self.assertEqual(messages[3].sendgrid_result.attempts, 0)
+        self.assertEqual(backend.failed_messages, messages[1:])
+        self.assertEqual(backend.stats.expired, 3)
+
+    def test_per_call_timeout(self):
+        backend = self._backend(SENDGRID_SEND_TIMEOUT=10)
+        messages = _messages(3)
+        started = time.time()
+        self.assertEqual(backend.send_messages(messages, timeout=0.1), 0)
+        self.assertLess(time.time() - started, 0.2)
+        self.assertEqual(backend.stats.expired, 3)
+
+    def test_raises(self):
+        backend = self._backend()
+        backend.fail_silently = False
+        with self.assertRaises(DeadlineExceededError):
+            backend.send_messages(_messages(2), timeout=0.1)
+
+    def test_raises_after_reporting(self):
+        backend = self._backend()
+        backend.fail_silently = False
+        messages = _messages(4)
+        with self.assertRaises(DeadlineExceededError):
+            backend.send_messages(messages, timeout=0.3)
+        self.assertTrue(messages[0].sendgrid_result.sent)
+        self.assertEqual(backend.failed_messages, messages[1:])
+        for message in messages[1:]:
+            self.assertIsInstance(
+                message.sendgrid_result.error, DeadlineExceededError)
+        self.assertEqual(backend.stats.expired, 3)
+        self.assertEqual(backend.stats.messages, 4)
+
+    def test_rate_limit_wait_past_deadline(self):
+        backend = self._backend(SENDGRID_FAKE_LATENCY=0)
+        backend.rate_limiter = TokenBucket(rate=1, capacity=1)
+        messages = _messages(2)
+        self.assertEqual(backend.send_messages(messages, timeout=0.5), 1)
+        self.assertEqual(messages[1].sendgrid_result.attempts, 0)
+        self.assertIsInstance(
+            messages[1].sendgrid_result.error, DeadlineExceededError)
+
+    def test_client_timeout(self):
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_CONNECT_TIMEOUT=2,
+                SENDGRID_READ_TIMEOUT=5):
+            backend = SendGridBackend()
+        self.assertEqual(backend.sg.client.timeout, 5)
+
+    def test_client_path_keeps_read_timeout(self):
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_CONNECT_TIMEOUT=0.1,
+                SENDGRID_READ_TIMEOUT=0.2, SENDGRID_SEND_TIMEOUT=60):
+            backend = SendGridBackend()
+        with StubServer(latency=1) as server:
+            backend.sg.client.host = server.url
+            started = time.time()
+            with self.assertRaises(Exception):
+                backend.send_messages(_messages(1))
+            self.assertLess(time.time() - started, 1)
+            self.assertEqual(len(server.bodies), 1)
+
+    def test_client_path_bounded_by_deadline(self):
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_READ_TIMEOUT=10):
+            backend = SendGridBackend(fail_silently=True)
+        with StubServer(latency=1) as server:
+            backend.sg.client.host = server.url
+            messages = _messages(1)
+            started = time.time()
+            self.assertEqual(backend.send_messages(messages, timeout=0.2), 0)
+            self.assertLess(time.time() - started, 1)
+        self.assertIsInstance(
+            messages[0].sendgrid_result.error, DeadlineExceededError)
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import SendGridBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(statement):
+    '''
+    Run ``statement`` in a fresh interpreter with ``-X importtime`` and
+    return the cumulative import time of each module, in microseconds.
+    '''
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("DJANGO_SETTINGS_MODULE", None)
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+    times = {}
+    for line in stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class ImportTimeTests(TestCase):
+    def test_package_import_is_lazy(self):
+        times = import_times("import sgbackend")
+        self.assertIn("sgbackend", times)
+        self.assertNotIn("sgbackend.mail", times)
+        self.assertNotIn("sendgrid", times)
+        self.assertNotIn("django.core.mail", times)
+
+    def test_backend_is_imported_on_access(self):
+        times = import_times("import sgbackend; sgbackend.SendGridBackend")
+        self.assertIn("sgbackend.mail", times)
+        self.assertIn("sendgrid", times)
+
+    def test_unknown_attribute(self):
+        import sgbackend
+        self.assertRaises(AttributeError, getattr, sgbackend, "Missing")
+
+
+class LazyClientTests(TestCase):
+    def test_client_created_on_open(self):
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            backend = SendGridBackend()
+        self.assertIsNone(backend._sg)
+        backend.open()
+        self.assertIsNotNone(backend._sg)
+        self.assertEqual(
+            backend.sg.client.request_headers["User-agent"], backend.version)
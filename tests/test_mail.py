@@ -1,12 +1,29 @@
+import base64
+import datetime
+import socket
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.text import MIMEText
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.mail import EmailMessage
 from django.core.mail import EmailMultiAlternatives
 from django.test import SimpleTestCase as TestCase
+from django.test import override_settings
+from python_http_client.exceptions import HTTPError
+
+from sendgrid.helpers.mail.exceptions import APIKeyIncludedException
 
 from sgbackend import SendGridBackend
 
-settings.configure()
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+if not settings.configured:
+    settings.configure()
 
 
 class SendGridBackendTests(TestCase):
@@ -180,6 +197,65 @@ class SendGridBackendTests(TestCase):
                 },
             )
 
+    def test_build_sg_email_w_inline_image(self):
+        data = b"\x89PNG" + b"\x00" * 200
+        image = MIMEImage(data, "png")
+        image.add_header("Content-ID", "<logo>")
+        msg = EmailMultiAlternatives()
+        msg.attach_alternative('<img src="cid:logo">', "text/html")
+        msg.attach(image)
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            mail = SendGridBackend()._build_sg_mail(msg)
+        self.assertEqual(mail["attachments"], [{
+            "content": base64.b64encode(data).decode("ascii"),
+            "type": "image/png",
+            "filename": "logo",
+            "disposition": "inline",
+            "content_id": "logo",
+        }])
+
+    def test_build_sg_email_w_mime_attachments(self):
+        pdf = MIMEApplication(b"%PDF-1.4" * 100, "pdf")
+        pdf.add_header("Content-Disposition", "attachment", filename="a.pdf")
+        text = MIMEText(u"caf\xe9", "plain", "utf-8")
+        text.replace_header("Content-Transfer-Encoding", "8bit")
+        text.set_payload(u"caf\xe9".encode("utf-8"))
+        text.add_header("Content-Disposition", "attachment", filename="b.txt")
+        msg = EmailMessage()
+        msg.attach(pdf)
+        msg.attach(text)
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            mail = SendGridBackend()._build_sg_mail(msg)
+        self.assertEqual(mail["attachments"], [
+            {
+                "content": base64.b64encode(b"%PDF-1.4" * 100).decode("ascii"),
+                "type": "application/pdf",
+                "filename": "a.pdf",
+                "disposition": "attachment",
+            },
+            {
+                "content": base64.b64encode(u"caf\xe9".encode("utf-8")).decode("ascii"),
+                "type": "text/plain",
+                "filename": "b.txt",
+                "disposition": "attachment",
+            },
+        ])
+
+    def test_build_sg_email_w_send_at_and_batch_id(self):
+        msg = EmailMessage()
+        msg.send_at = datetime.datetime(
+            2030, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        msg.batch_id = "batch-1"
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            mail = SendGridBackend()._build_sg_mail(msg)
+        self.assertEqual(mail["send_at"], 1893553445)
+        self.assertEqual(mail["batch_id"], "batch-1")
+
+        msg.send_at = 1893553445
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            mail = SendGridBackend()._build_sg_mail(msg)
+        self.assertEqual(mail["send_at"], 1893553445)
+
     def test_build_sg_email_w_template_id(self):
         msg = EmailMessage()
         msg.template_id = "template_id_123456"
@@ -569,3 +645,322 @@ class SendGridBackendTests(TestCase):
                     "subject": "",
                 },
             )
+
+
+@override_settings(SENDGRID_PAYLOAD_BUILDER="direct")
+class DirectPayloadBuilderTests(SendGridBackendTests):
+    """Runs every payload expectation above against the direct builder."""
+
+    def _build_both(self, msg):
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            direct = SendGridBackend()._build_sg_mail(msg)
+            with self.settings(SENDGRID_PAYLOAD_BUILDER="helpers"):
+                helpers = SendGridBackend()._build_sg_mail(msg)
+        return direct, helpers
+
+    def test_matches_helpers_builder(self):
+        msg = EmailMultiAlternatives(
+            subject="Subject",
+            body="Body",
+            from_email="Sender Name <sender@example.com>",
+            to=["Recipient <to@example.com>", "plain@example.com"],
+            cc=["cc@example.com"],
+            bcc=["not an address"],
+            reply_to=["Reply <reply@example.com>"],
+            headers={"X-Extra": "1"},
+        )
+        msg.attach_alternative("<p>Body</p>", "text/html")
+        msg.attach("report.pdf", b"%PDF-1.4", "application/pdf")
+        msg.categories = ["a", "b"]
+        msg.custom_args = {"k": "v"}
+        msg.bypass_list_management = True
+        msg.template_id = "template_id_123456"
+        msg.substitutions = {"%name%": "Name"}
+        msg.dynamic_data = {"name": "Name"}
+        direct, helpers = self._build_both(msg)
+        self.assertEqual(direct, helpers)
+
+    def test_matches_helpers_builder_reply_to_header(self):
+        msg = EmailMessage(
+            from_email="sender@example.com", to=["to@example.com"],
+            reply_to=["Attribute <attribute@example.com>"],
+            headers={"Reply-To": "header@example.com"})
+        direct, helpers = self._build_both(msg)
+        self.assertEqual(direct, helpers)
+        self.assertEqual(
+            direct["reply_to"],
+            {"email": "attribute@example.com", "name": "Attribute"})
+
+    def test_matches_helpers_builder_html(self):
+        msg = EmailMessage(body="<p>Body</p>", from_email="sender@example.com")
+        msg.content_subtype = "html"
+        direct, helpers = self._build_both(msg)
+        self.assertEqual(direct, helpers)
+        self.assertEqual(
+            direct["content"],
+            [
+                {"type": "text/plain", "value": " "},
+                {"type": "text/html", "value": "<p>Body</p>"},
+            ],
+        )
+
+    def test_rejects_api_key_in_content(self):
+        msg = EmailMessage(body="SG.abc.def")
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            with self.assertRaises(APIKeyIncludedException):
+                SendGridBackend()._build_sg_mail(msg)
+
+    def test_raises_on_unknown_builder(self):
+        with self.settings(
+            SENDGRID_API_KEY="test_key", SENDGRID_PAYLOAD_BUILDER="unknown"
+        ):
+            with self.assertRaises(ImproperlyConfigured):
+                SendGridBackend()
+
+
+class SendGridBackendSendTests(TestCase):
+    def _backend(self, **kwargs):
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            backend = SendGridBackend(**kwargs)
+        backend.sg = mock.MagicMock()
+        return backend
+
+    def _fail_for(self, address, error=None):
+        def post(request_body):
+            to = request_body["personalizations"][0]["to"][0]["email"]
+            if to == address:
+                raise error or HTTPError(400, "Bad Request", b"{}", {})
+        return post
+
+    def test_send_serial(self):
+        backend = self._backend()
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(3)]
+        self.assertEqual(backend.send_messages(msgs), 3)
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 3)
+        self.assertEqual(backend.failed_messages, [])
+
+    def test_send_concurrent(self):
+        backend = self._backend(max_workers=4)
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(10)]
+        self.assertEqual(backend.send_messages(msgs), 10)
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 10)
+
+    def test_max_workers_from_settings(self):
+        with self.settings(SENDGRID_API_KEY="test_key", SENDGRID_MAX_WORKERS=8):
+            self.assertEqual(SendGridBackend().max_workers, 8)
+
+    def test_send_concurrent_fail_silently(self):
+        backend = self._backend(fail_silently=True, max_workers=4)
+        backend.sg.client.mail.send.post.side_effect = self._fail_for(
+            "test3@example.com")
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(6)]
+        self.assertEqual(backend.send_messages(msgs), 5)
+        self.assertEqual(backend.failed_messages, [msgs[3]])
+
+    def test_send_concurrent_raises(self):
+        backend = self._backend(max_workers=4)
+        backend.sg.client.mail.send.post.side_effect = self._fail_for(
+            "test3@example.com")
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(6)]
+        with self.assertRaises(HTTPError):
+            backend.send_messages(msgs)
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 6)
+        self.assertEqual(backend.failed_messages, [msgs[3]])
+
+    def test_send_concurrent_connection_error(self):
+        for fail_silently in (True, False):
+            backend = self._backend(
+                fail_silently=fail_silently, max_workers=4)
+            backend.sg.client.mail.send.post.side_effect = self._fail_for(
+                "test3@example.com", socket.timeout("timed out"))
+            msgs = [
+                EmailMessage(to=["test%d@example.com" % i]) for i in range(6)]
+            if fail_silently:
+                self.assertEqual(backend.send_messages(msgs), 5)
+            else:
+                with self.assertRaises(socket.timeout):
+                    backend.send_messages(msgs)
+            self.assertEqual(backend.sg.client.mail.send.post.call_count, 6)
+            self.assertEqual(backend.failed_messages, [msgs[3]])
+            self.assertIsInstance(
+                msgs[3].sendgrid_result.error, socket.timeout)
+            self.assertTrue(msgs[5].sendgrid_result.sent)
+            self.assertEqual(backend.stats.failed, 1)
+
+    def test_send_serial_raises_on_first_failure(self):
+        backend = self._backend()
+        backend.sg.client.mail.send.post.side_effect = self._fail_for(
+            "test1@example.com")
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(3)]
+        with self.assertRaises(HTTPError):
+            backend.send_messages(msgs)
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 2)
+
+    def test_send_results(self):
+        backend = self._backend(fail_silently=True)
+        response = mock.Mock(status_code=202, headers={"X-Message-Id": "abc"})
+
+        def post(request_body):
+            if request_body["personalizations"][0]["to"][0]["email"] == "bad@example.com":
+                raise HTTPError(400, "Bad Request", b'{"errors": []}', {})
+            return response
+        backend.sg.client.mail.send.post.side_effect = post
+        good = EmailMessage(to=["good@example.com"])
+        bad = EmailMessage(to=["bad@example.com"])
+        self.assertEqual(backend.send_messages([good, bad]), 1)
+
+        self.assertTrue(good.sendgrid_result.sent)
+        self.assertEqual(good.sendgrid_result.status_code, 202)
+        self.assertEqual(good.sendgrid_result.message_id, "abc")
+        self.assertEqual(good.sendgrid_result.attempts, 1)
+        self.assertIsNotNone(good.sendgrid_result.latency)
+        self.assertIsNotNone(good.sendgrid_result.build_time)
+        self.assertFalse(bad.sendgrid_result.sent)
+        self.assertEqual(bad.sendgrid_result.status_code, 400)
+        self.assertEqual(bad.sendgrid_result.error_body, '{"errors": []}')
+
+        stats = backend.stats
+        self.assertEqual((stats.requests, stats.sent, stats.failed), (2, 1, 1))
+        self.assertEqual(stats.retries, 0)
+        self.assertEqual(len(stats.latencies), 2)
+
+    def test_send_results_serial_failure(self):
+        backend = self._backend()
+        backend.sg.client.mail.send.post.side_effect = self._fail_for(
+            "test1@example.com")
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(3)]
+        with self.assertRaises(HTTPError):
+            backend.send_messages(msgs)
+        self.assertTrue(msgs[0].sendgrid_result.sent)
+        self.assertFalse(msgs[1].sendgrid_result.sent)
+        self.assertFalse(hasattr(msgs[2], "sendgrid_result"))
+        self.assertEqual(backend.stats.requests, 2)
+
+    def test_batch_ids(self):
+        backend = self._backend()
+        backend.sg.client.mail.batch.post.return_value = mock.Mock(
+            body=b'{"batch_id": "YOUR_BATCH_ID"}')
+        self.assertEqual(backend.create_batch_id(), "YOUR_BATCH_ID")
+        backend.cancel_batch("YOUR_BATCH_ID")
+        backend.sg.client.user.scheduled_sends.post.assert_called_once_with(
+            request_body={"batch_id": "YOUR_BATCH_ID", "status": "cancel"})
+        backend.resume_batch("YOUR_BATCH_ID")
+        backend.sg.client.user.scheduled_sends._.assert_called_once_with(
+            "YOUR_BATCH_ID")
+
+    def test_batch_personalizations(self):
+        backend = self._backend(batch_personalizations=True)
+        msgs = []
+        for i in range(3):
+            msg = EmailMessage(to=["test%d@example.com" % i])
+            msg.template_id = "template_id_123456"
+            msg.dynamic_data = {"i": i}
+            msgs.append(msg)
+        msgs.append(EmailMessage(subject="other", to=["other@example.com"]))
+        self.assertEqual(backend.send_messages(msgs), 4)
+        calls = backend.sg.client.mail.send.post.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(
+            calls[0][1]["request_body"]["personalizations"],
+            [
+                {
+                    "subject": "",
+                    "to": [{"email": "test%d@example.com" % i}],
+                    "dynamic_template_data": {"i": i},
+                }
+                for i in range(3)
+            ],
+        )
+        self.assertEqual(calls[1][1]["request_body"]["subject"], "other")
+
+    def test_batch_personalizations_limit(self):
+        backend = self._backend(batch_personalizations=True)
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(1001)]
+        self.assertEqual(backend.send_messages(msgs), 1001)
+        calls = backend.sg.client.mail.send.post.call_args_list
+        self.assertEqual(
+            [len(c[1]["request_body"]["personalizations"]) for c in calls],
+            [1000, 1],
+        )
+
+    def test_batch_personalizations_recipient_limit(self):
+        backend = self._backend(batch_personalizations=True)
+        msgs = [
+            EmailMessage(
+                to=["to%d@example.com" % m],
+                bcc=["bcc%d-%d@example.com" % (m, i) for i in range(599)])
+            for m in range(3)]
+        self.assertEqual(backend.send_messages(msgs), 3)
+        calls = backend.sg.client.mail.send.post.call_args_list
+        self.assertEqual(
+            [len(c[1]["request_body"]["personalizations"]) for c in calls],
+            [1, 1, 1],
+        )
+
+    def test_batch_personalizations_failure_marks_group(self):
+        backend = self._backend(fail_silently=True, batch_personalizations=True)
+        backend.sg.client.mail.send.post.side_effect = self._fail_for(
+            "test0@example.com")
+        msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(3)]
+        self.assertEqual(backend.send_messages(msgs), 0)
+        self.assertEqual(backend.failed_messages, msgs)
+
+
+class PayloadCacheTests(TestCase):
+    def _backend(self):
+        with self.settings(
+            SENDGRID_API_KEY="test_key",
+            SENDGRID_PAYLOAD_CACHE=True,
+            SENDGRID_PAYLOAD_CACHE_SIZE=2,
+        ):
+            backend = SendGridBackend()
+        backend.payload_cache.clear()
+        return backend
+
+    def _message(self, to, template_id="template_id_123456"):
+        msg = EmailMessage(from_email="Sender <sender@example.com>", to=[to])
+        msg.template_id = template_id
+        msg.dynamic_data = {"to": to}
+        return msg
+
+    def test_cache_disabled_by_default(self):
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            self.assertIsNone(SendGridBackend().payload_cache)
+
+    def test_cached_payload_matches_uncached(self):
+        backend = self._backend()
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            uncached = SendGridBackend()
+        for to in ["a@example.com", "b@example.com"]:
+            msg = self._message(to)
+            self.assertEqual(
+                backend._build_sg_mail(msg), uncached._build_sg_mail(msg))
+        self.assertEqual(backend.payload_cache.hits, 1)
+        self.assertEqual(backend.payload_cache.misses, 1)
+
+    def test_cached_payload_sandbox_per_message(self):
+        backend = self._backend()
+        with self.settings(
+            SENDGRID_SANDBOX=True,
+            SENDGRID_SANDBOX_WHITELIST_DOMAINS=["example.com"],
+        ):
+            first = backend._build_sg_mail(self._message("a@example.com"))
+            second = backend._build_sg_mail(self._message("a@example.org"))
+        self.assertEqual(first["mail_settings"], {})
+        self.assertEqual(
+            second["mail_settings"], {"sandbox_mode": {"enable": True}})
+
+    def test_cache_is_bounded(self):
+        backend = self._backend()
+        for template_id in ["t1", "t2", "t3", "t1"]:
+            backend._build_sg_mail(self._message("a@example.com", template_id))
+        self.assertEqual(len(backend.payload_cache), 2)
+        self.assertEqual(backend.payload_cache.hits, 0)
+        self.assertEqual(backend.payload_cache.misses, 4)
+
+    def test_attachments_are_not_cached(self):
+        backend = self._backend()
+        msg = self._message("a@example.com")
+        msg.attach("file.pdf", b"content", "application/pdf")
+        backend._build_sg_mail(msg)
+        self.assertEqual(len(backend.payload_cache), 0)
@@ -0,0 +1,160 @@
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import SendGridBackend, signals
+from sgbackend.metrics import (
+    MetricsAdapter, PrometheusMetrics, StatsdMetrics, attachment_size,
+    get_metrics, recipient_count)
+from sgbackend.results import SendResult
+
+from .helpers import mock_backend
+from .stub import StubServer
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class RecordingMetrics(MetricsAdapter):
+    def __init__(self):
+        self.calls = []
+
+    def timing(self, name, seconds):
+        self.calls.append(("timing", name))
+
+    def observe(self, name, value):
+        self.calls.append(("observe", name, value))
+
+    def increment(self, name, count=1):
+        self.calls.append(("increment", name, count))
+
+
+class InstrumentationTests(TestCase):
+    def test_signals(self):
+        backend = mock_backend()
+        events = []
+
+        def receiver(signal, **kwargs):
+            events.append((signal, kwargs))
+        for signal in signals.SIGNALS:
+            signal.connect(receiver, sender=SendGridBackend)
+        try:
+            msg = EmailMessage(to=["a@example.com"])
+            backend.send_messages([msg])
+        finally:
+            for signal in signals.SIGNALS:
+                signal.disconnect(receiver, sender=SendGridBackend)
+
+        self.assertEqual(
+            [signal for signal, kwargs in events],
+            [signals.pre_build, signals.post_build, signals.pre_send,
+             signals.post_send])
+        self.assertIs(events[0][1]["message"], msg)
+        self.assertGreaterEqual(events[1][1]["duration"], 0)
+        result = events[3][1]["result"]
+        self.assertIs(result, msg.sendgrid_result)
+        self.assertIsNotNone(result.serialize_time)
+        self.assertGreater(result.body_size, 0)
+
+    def test_not_instrumented(self):
+        backend = mock_backend()
+        self.assertFalse(backend._instrumented())
+        msg = EmailMessage(to=["a@example.com"])
+        backend.send_messages([msg])
+        self.assertIsNone(msg.sendgrid_result.serialize_time)
+
+    def test_metrics_adapter(self):
+        metrics = RecordingMetrics()
+        backend = mock_backend(kwargs={"metrics": metrics})
+        msg = EmailMessage(to=["a@example.com"], cc=["b@example.com"])
+        msg.attach("file.pdf", b"12345", "application/pdf")
+        backend.send_messages([msg])
+        self.assertEqual(metrics.calls[:3], [
+            ("timing", "build"), ("timing", "serialize"), ("timing", "http")])
+        self.assertIn(("observe", "attachment_bytes", 8), metrics.calls)
+        self.assertIn(("observe", "recipients", 2), metrics.calls)
+        self.assertEqual(metrics.calls[-1], ("increment", "sent", 1))
+
+    def test_default_transport_body_metrics(self):
+        metrics = RecordingMetrics()
+        with self.settings(SENDGRID_API_KEY="test_key"):
+            backend = SendGridBackend(metrics=metrics)
+        msg = EmailMessage(subject="Hi", to=["a@example.com"])
+        with StubServer() as server:
+            backend.sg.client.host = server.url
+            self.assertEqual(backend.send_messages([msg]), 1)
+        result = msg.sendgrid_result
+        # Posted as serialized.
+        self.assertEqual(
+            int(server.headers[0]["Content-Length"]), result.body_size)
+        self.assertEqual(server.bodies[0]["subject"], "Hi")
+        self.assertIn(("timing", "serialize"), metrics.calls)
+        self.assertIn(
+            ("observe", "body_bytes", result.body_size), metrics.calls)
+
+    def test_metrics_from_settings(self):
+        with self.settings(
+            SENDGRID_API_KEY="test_key",
+            SENDGRID_METRICS="sgbackend.metrics.MetricsAdapter",
+        ):
+            metrics = SendGridBackend().metrics
+            self.assertIsInstance(metrics, MetricsAdapter)
+            # One adapter, and client, per process.
+            self.assertIs(SendGridBackend().metrics, metrics)
+        with self.settings(SENDGRID_METRICS="sgbackend.metrics.Missing"):
+            self.assertRaises(ImproperlyConfigured, get_metrics)
+
+
+class StatsdMetricsTests(TestCase):
+    def test_record(self):
+        client = mock.Mock(spec=["timing", "incr"])
+        metrics = StatsdMetrics(client, prefix="sg")
+        metrics.record(
+            SendResult(latency=0.25, attempts=2), {"personalizations": []})
+        client.timing.assert_any_call("sg.http", 250)
+        client.incr.assert_any_call("sg.sent", 1)
+        client.incr.assert_any_call("sg.retries", 1)
+
+    def test_record_skipped(self):
+        client = mock.Mock(spec=["timing", "incr"])
+        metrics = StatsdMetrics(client, prefix="sg")
+        metrics.record(
+            SendResult(suppressed=2, skipped=True), {"personalizations": []})
+        self.assertEqual(client.incr.call_args_list, [
+            mock.call("sg.suppressed", 2), mock.call("sg.skipped", 1)])
+        client.timing.assert_not_called()
+
+
+@unittest.skipIf(prometheus_client is None, "prometheus_client not installed")
+class PrometheusMetricsTests(TestCase):
+    def test_record(self):
+        registry = prometheus_client.CollectorRegistry()
+        metrics = PrometheusMetrics(registry=registry)
+        for i in range(2):
+            metrics.record(SendResult(latency=0.1), {"personalizations": []})
+        self.assertEqual(
+            registry.get_sample_value("sendgrid_http_seconds_count"), 2)
+        self.assertEqual(registry.get_sample_value("sendgrid_sent_total"), 2)
+
+
+class SizeTests(TestCase):
+    def test_sizes(self):
+        mail = {
+            "personalizations": [
+                {"to": [{"email": "a@example.com"}],
+                 "bcc": [{"email": "b@example.com"}]},
+                {"to": [{"email": "c@example.com"}]},
+            ],
+            "attachments": [{"content": "YWJj"}, {"content": "ZA=="}],
+        }
+        self.assertEqual(recipient_count(mail), 3)
+        self.assertEqual(attachment_size(mail), 8)
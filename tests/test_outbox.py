@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+from sgbackend import QueuedSendGridBackend
+from sgbackend.management.commands.sendgrid_drain import Command
+from sgbackend.outbox import Outbox
+
+from .helpers import mock_backend
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "outbox.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class OutboxTests(OutboxTestCase):
+    def test_put_claim_ack(self):
+        outbox = Outbox(self.path)
+        outbox.put([{"n": 1}, {"n": 2}])
+        entries = outbox.claim(10)
+        self.assertEqual([e.payload for e in entries], [{"n": 1}, {"n": 2}])
+        self.assertEqual(outbox.claim(10), [])
+        outbox.ack([entries[0].id])
+        self.assertEqual(outbox.count(), 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        outbox = Outbox(self.path)
+        outbox.put([{"n": 1}])
+        self.assertEqual(len(outbox.claim(10, lease=-1)), 1)
+        self.assertEqual(len(Outbox(self.path).claim(10)), 1)
+
+    def test_retry_and_bury(self):
+        outbox = Outbox(self.path)
+        outbox.put([{"n": 1}, {"n": 2}])
+        first, second = outbox.claim(10)
+        outbox.retry(first.id, "error", delay=0)
+        outbox.bury(second.id, "error")
+        entries = outbox.claim(10)
+        self.assertEqual([(e.id, e.attempts) for e in entries], [(first.id, 1)])
+        self.assertEqual(outbox.count(dead=True), 1)
+
+
+class QueuedSendGridBackendTests(OutboxTestCase):
+    def _backend(self, **kwargs):
+        return mock_backend(
+            QueuedSendGridBackend, kwargs, SENDGRID_OUTBOX_PATH=self.path)
+
+    def _messages(self, n):
+        return [EmailMessage(to=["test%d@example.com" % i]) for i in range(n)]
+
+    def test_send_messages_queues(self):
+        backend = self._backend()
+        msgs = self._messages(3)
+        self.assertEqual(backend.send_messages(msgs), 3)
+        backend.sg.client.mail.send.post.assert_not_called()
+        self.assertEqual(
+            [e.payload for e in backend.get_outbox().claim(10)],
+            [backend._build_sg_mail(m) for m in msgs],
+        )
+
+    def test_drain(self):
+        backend = self._backend(max_workers=2)
+        backend.send_messages(self._messages(5))
+        self.assertEqual(backend.drain(batch_size=2), (5, 0, 0))
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 5)
+        self.assertEqual(backend.get_outbox().count(), 0)
+
+    def test_drain_retries_then_buries(self):
+        backend = self._backend()
+        backend.retry_backoff = 0
+        backend.sg.client.mail.send.post.side_effect = HTTPError(
+            500, "Error", b"{}", {})
+        backend.send_messages(self._messages(1))
+        self.assertEqual(backend.drain(max_attempts=2), (0, 1, 0))
+        self.assertEqual(backend.drain(max_attempts=2), (0, 0, 1))
+        self.assertEqual(backend.get_outbox().count(dead=True), 1)
+
+    def test_drain_command(self):
+        self._backend().send_messages(self._messages(2))
+        stdout = StringIO()
+        with self.settings(SENDGRID_API_KEY="test_key", SENDGRID_OUTBOX_PATH=self.path):
+            with mock.patch("sgbackend.mail.SendGridBackend._post") as post:
+                call_command(Command(), stdout=stdout)
+        self.assertEqual(post.call_count, 2)
+        self.assertIn("Sent 2, retrying 0, failed 0", stdout.getvalue())
+
+    def test_outbox_path_must_be_absolute(self):
+        with self.settings(
+                SENDGRID_API_KEY="test_key",
+                SENDGRID_OUTBOX_PATH="sendgrid_outbox.sqlite3"):
+            with self.assertRaises(ImproperlyConfigured):
+                QueuedSendGridBackend()
+
+    def test_outbox_path_defaults_under_base_dir(self):
+        with self.settings(SENDGRID_API_KEY="test_key", BASE_DIR=self.tmpdir):
+            backend = QueuedSendGridBackend()
+        self.assertEqual(
+            backend.outbox_path,
+            os.path.join(self.tmpdir, "sendgrid_outbox.sqlite3"))
+
+    def test_outbox_is_shared_and_closed(self):
+        first, second = self._backend(), self._backend()
+        self.assertIs(first.get_outbox(), second.get_outbox())
+        outbox = first.get_outbox()
+        first.send_messages(self._messages(1))
+        self.assertIsNone(outbox._local.db)
+        self.assertIsNone(first.outbox)
+        self.assertEqual(second.get_outbox().count(), 1)
+
+    def test_send_messages_stats(self):
+        backend = self._backend()
+        backend.send_messages(self._messages(2), timeout=1)
+        self.assertEqual(backend.stats.sent, 2)
+        backend.send_messages([])
+        self.assertEqual(backend.stats.sent, 0)
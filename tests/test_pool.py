@@ -0,0 +1,151 @@
+import socket
+import time
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import BadRequestsError
+
+from sgbackend import SendGridBackend
+from sgbackend import pool as sgpool
+from sgbackend.pool import ConnectionPool
+
+from .stub import StubServer
+
+try:
+    import http.client as httplib
+except ImportError:  # pragma: no cover
+    import httplib
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class ConnectionPoolTests(TestCase):
+    def test_reuses_connections(self):
+        with StubServer() as server:
+            pool = ConnectionPool(server.url)
+            for i in range(5):
+                response = pool.request("POST", "/v3/mail/send", b"{}")
+                self.assertEqual(response.status_code, 202)
+            pool.close()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(pool.connections_created, 1)
+
+    def test_idle_timeout(self):
+        with StubServer() as server:
+            pool = ConnectionPool(server.url, idle_timeout=-1)
+            pool.request("POST", "/v3/mail/send", b"{}")
+            pool.request("POST", "/v3/mail/send", b"{}")
+            pool.close()
+        self.assertEqual(pool.connections_created, 2)
+
+    def test_raises_http_error(self):
+        responses = {"bad@example.com": (400, {})}
+        with StubServer(responses=responses) as server:
+            pool = ConnectionPool(server.url)
+            with self.assertRaises(BadRequestsError):
+                pool.request(
+                    "POST", "/v3/mail/send",
+                    b'{"personalizations": [{"to": [{"email": "bad@example.com"}]}]}')
+            pool.close()
+
+    def _stale_pool(self, url):
+        pool = ConnectionPool(url)
+        connection = mock.Mock()
+        pool._idle.append((connection, time.time()))
+        return pool, connection
+
+    def test_retries_stale_connection_before_writing(self):
+        with StubServer() as server:
+            pool, connection = self._stale_pool(server.url)
+            connection.request.side_effect = socket.error("Broken pipe")
+            with mock.patch.object(sgpool, "_dropped", return_value=False):
+                response = pool.request("POST", "/v3/mail/send", b"{}")
+            pool.close()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(server.bodies), 1)
+
+    def test_does_not_resend_written_request(self):
+        with StubServer() as server:
+            pool, connection = self._stale_pool(server.url)
+            connection.getresponse.side_effect = httplib.BadStatusLine("")
+            with mock.patch.object(sgpool, "_dropped", return_value=False):
+                with self.assertRaises(httplib.BadStatusLine):
+                    pool.request("POST", "/v3/mail/send", b"{}")
+            pool.close()
+        self.assertEqual(connection.request.call_count, 1)
+        self.assertEqual(server.bodies, [])
+        self.assertEqual(pool.connections_created, 0)
+
+    def test_skips_connections_closed_by_the_server(self):
+        with StubServer() as server:
+            pool = ConnectionPool(server.url)
+            pool.request("POST", "/v3/mail/send", b"{}")
+            connection = pool._idle[0][0]
+            self.assertFalse(sgpool._dropped(connection))
+            # The server side of the connection goes away.
+            connection.sock.shutdown(socket.SHUT_RD)
+            pool.request("POST", "/v3/mail/send", b"{}")
+            pool.close()
+        self.assertEqual(pool.connections_created, 2)
+
+    def test_get_pool_is_shared_per_api_key(self):
+        try:
+            first = sgpool.get_pool("key", "https://api.sendgrid.com")
+            self.assertIs(first, sgpool.get_pool("key", "https://api.sendgrid.com"))
+            self.assertIsNot(first, sgpool.get_pool("other", "https://api.sendgrid.com"))
+        finally:
+            sgpool.close_pools()
+
+
+class SendGridBackendPoolTests(TestCase):
+    def _backend(self, server, **kwargs):
+        with self.settings(SENDGRID_API_KEY="test_key", **kwargs):
+            backend = SendGridBackend(use_pool=True)
+        backend.sg.host = server.url
+        return backend
+
+    def test_backends_share_connections(self):
+        try:
+            with StubServer() as server:
+                for i in range(3):
+                    backend = self._backend(server)
+                    msgs = [EmailMessage(to=["test%d@example.com" % i])]
+                    self.assertEqual(backend.send_messages(msgs), 1)
+                    self.assertIsNone(backend.pool)
+            self.assertEqual(len(server.bodies), 3)
+            self.assertEqual(server.connections, 1)
+        finally:
+            sgpool.close_pools()
+
+    def test_send_results(self):
+        responses = {"bad@example.com": (400, {})}
+        with StubServer(responses=responses) as server:
+            backend = self._backend(server, SENDGRID_POOL_SHARED=False)
+            backend.fail_silently = True
+            good = EmailMessage(to=["good@example.com"])
+            bad = EmailMessage(to=["bad@example.com"])
+            self.assertEqual(backend.send_messages([good, bad]), 1)
+        self.assertEqual(good.sendgrid_result.status_code, 202)
+        self.assertEqual(good.sendgrid_result.message_id, "message-1")
+        self.assertEqual(bad.sendgrid_result.status_code, 400)
+        self.assertIsNone(bad.sendgrid_result.message_id)
+        self.assertEqual(bad.sendgrid_result.error_body, '{"errors": []}')
+        self.assertEqual(backend.stats.sent, 1)
+        self.assertEqual(backend.stats.failed, 1)
+
+    def test_open_close_unshared_pool(self):
+        with StubServer() as server:
+            backend = self._backend(server, SENDGRID_POOL_SHARED=False)
+            self.assertTrue(backend.open())
+            self.assertFalse(backend.open())
+            pool = backend.pool
+            msgs = [EmailMessage(to=["test%d@example.com" % i]) for i in range(4)]
+            self.assertEqual(backend.send_messages(msgs), 4)
+            self.assertIs(backend.pool, pool)
+            backend.close()
+            self.assertIsNone(backend.pool)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(pool._idle, [])
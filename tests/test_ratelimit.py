@@ -0,0 +1,128 @@
+import threading
+import time
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+from sgbackend.ratelimit import TokenBucket, backoff, get_token_bucket, retry_after
+
+from .helpers import mock_backend
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TokenBucketTests(TestCase):
+    def test_limits_rate_across_threads(self):
+        bucket = TokenBucket(rate=200, capacity=1)
+        start = time.time()
+        threads = [
+            threading.Thread(target=lambda: [bucket.acquire() for _ in range(10)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 40 requests at 200/s with a burst of 1 take at least 39 / 200 s.
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.pause(0.05)
+        start = time.time()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_shared_per_key(self):
+        self.assertIs(get_token_bucket("key", 10), get_token_bucket("key", 10))
+        self.assertIsNot(get_token_bucket("key", 10), get_token_bucket("other", 10))
+
+
+class RetryAfterTests(TestCase):
+    def test_retry_after_seconds(self):
+        self.assertEqual(retry_after({"Retry-After": "3"}), 3)
+
+    def test_retry_after_date(self):
+        self.assertEqual(
+            retry_after({"Retry-After": "Thu, 01 Jan 1970 00:00:10 GMT"}, now=4), 6)
+
+    def test_rate_limit_reset(self):
+        self.assertEqual(retry_after({"X-RateLimit-Reset": "105"}, now=100), 5)
+
+    def test_no_header(self):
+        self.assertIsNone(retry_after({}))
+
+    def test_backoff_is_capped(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff(attempt, 0.5, 4), 4)
+
+
+class SendGridBackendRetryTests(TestCase):
+    def _error(self, status, headers=None):
+        return HTTPError(status, "Error", b"{}", headers or {})
+
+    @mock.patch("sgbackend.mail.time.sleep")
+    def test_retries_429_and_5xx(self, sleep):
+        backend = mock_backend(SENDGRID_MAX_RETRIES=3, SENDGRID_RETRY_BACKOFF=1)
+        backend.sg.client.mail.send.post.side_effect = [
+            self._error(429, {"Retry-After": "7"}),
+            self._error(503),
+            None,
+        ]
+        msg = EmailMessage(to=["a@example.com"])
+        self.assertEqual(backend.send_messages([msg]), 1)
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 3)
+        self.assertEqual(msg.sendgrid_result.attempts, 3)
+        self.assertEqual(backend.stats.retries, 2)
+        self.assertEqual(sleep.call_args_list[0], mock.call(7))
+        self.assertLessEqual(sleep.call_args_list[1][0][0], 2)
+
+    @mock.patch("sgbackend.mail.time.sleep")
+    def test_gives_up_after_max_retries(self, sleep):
+        backend = mock_backend(SENDGRID_MAX_RETRIES=2)
+        backend.sg.client.mail.send.post.side_effect = self._error(500)
+        with self.assertRaises(HTTPError):
+            backend.send_messages([EmailMessage(to=["a@example.com"])])
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 3)
+
+    @mock.patch("sgbackend.mail.time.sleep")
+    def test_long_retry_after_pauses_without_retrying(self, sleep):
+        backend = mock_backend(
+            SENDGRID_MAX_RETRIES=3, SENDGRID_RETRY_BACKOFF_MAX=30)
+        backend.rate_limiter = mock.MagicMock()
+        backend.sg.client.mail.send.post.side_effect = self._error(
+            429, {"Retry-After": "600"})
+        with self.assertRaises(HTTPError):
+            backend.send_messages([EmailMessage(to=["a@example.com"])])
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 1)
+        sleep.assert_not_called()
+        # The other requests still hold off for the whole delay.
+        backend.rate_limiter.pause.assert_called_once_with(600)
+
+    @mock.patch("sgbackend.mail.time.sleep")
+    def test_client_errors_not_retried(self, sleep):
+        backend = mock_backend(SENDGRID_MAX_RETRIES=2)
+        backend.sg.client.mail.send.post.side_effect = self._error(400)
+        with self.assertRaises(HTTPError):
+            backend.send_messages([EmailMessage(to=["a@example.com"])])
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 1)
+        sleep.assert_not_called()
+
+    @mock.patch("sgbackend.mail.time.sleep")
+    def test_no_retries_by_default(self, sleep):
+        backend = mock_backend()
+        backend.sg.client.mail.send.post.side_effect = self._error(429)
+        with self.assertRaises(HTTPError):
+            backend.send_messages([EmailMessage(to=["a@example.com"])])
+        self.assertEqual(backend.sg.client.mail.send.post.call_count, 1)
+
+    def test_rate_limiter_used(self):
+        backend = mock_backend(SENDGRID_RATE_LIMIT=50)
+        self.assertEqual(backend.rate_limiter.rate, 50)
+        backend.rate_limiter = mock.MagicMock()
+        backend.send_messages([EmailMessage(to=["a@example.com"])] * 3)
+        self.assertEqual(backend.rate_limiter.acquire.call_count, 3)
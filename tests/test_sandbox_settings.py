@@ -0,0 +1,50 @@
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend.sandbox_settings import (
+    SandboxMatcher,
+    can_enable_sandbox_mode,
+    get_sandbox_matcher,
+)
+
+
+class SandboxMatcherTests(TestCase):
+    def test_regexes_checked_for_every_address(self):
+        matcher = SandboxMatcher(
+            enabled=True, regexes=["^first@example.com$", "^second@example.com$"])
+        self.assertFalse(matcher.can_enable_sandbox_mode(
+            ["first@example.com", "second@example.com"]))
+        self.assertTrue(matcher.can_enable_sandbox_mode(
+            ["first@example.com", "third@example.com"]))
+
+    def test_regexes_merged(self):
+        matcher = SandboxMatcher(regexes=["^a@", "^b@"])
+        self.assertEqual(len(matcher.regexes), 1)
+
+    def test_regexes_not_merged_with_backreferences(self):
+        matcher = SandboxMatcher(regexes=[r"^(a)\1@", "^b@"])
+        self.assertEqual(len(matcher.regexes), 2)
+        self.assertTrue(matcher.is_whitelisted("aa@example.com"))
+        self.assertTrue(matcher.is_whitelisted("b@example.com"))
+
+    def test_regexes_not_merged_with_global_flags(self):
+        matcher = SandboxMatcher(regexes=["(?i)^A@", "^b@"])
+        self.assertTrue(matcher.is_whitelisted("a@example.com"))
+        self.assertFalse(matcher.is_whitelisted("B@example.com"))
+
+    def test_classify(self):
+        matcher = SandboxMatcher(domains=["example.com"], regexes=["^qa@"])
+        self.assertEqual(
+            matcher.classify(
+                ["a@example.com", "b@example.org", "qa@example.org", "invalid"]),
+            (["a@example.com", "qa@example.org"], ["b@example.org", "invalid"]),
+        )
+
+    def test_rebuilt_on_setting_changed(self):
+        with self.settings(SENDGRID_SANDBOX=True):
+            matcher = get_sandbox_matcher()
+            self.assertIs(get_sandbox_matcher(), matcher)
+            self.assertTrue(can_enable_sandbox_mode(["a@example.com"]))
+            with self.settings(SENDGRID_SANDBOX_WHITELIST_DOMAINS=["example.com"]):
+                self.assertIsNot(get_sandbox_matcher(), matcher)
+                self.assertFalse(can_enable_sandbox_mode(["a@example.com"]))
+        self.assertFalse(can_enable_sandbox_mode(["a@example.com"]))
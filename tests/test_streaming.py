@@ -0,0 +1,195 @@
+import base64
+import json
+import os
+import tracemalloc
+from email.mime.application import MIMEApplication
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import SendGridBackend
+from sgbackend import pool as sgpool
+from sgbackend.cache import LRUCache
+from sgbackend.payload import encode_content
+from sgbackend.streaming import Base64Content, StreamingBody, materialize
+
+from .stub import StubServer
+
+
+class Base64ContentTests(TestCase):
+    def test_chunks_concatenate_to_base64(self):
+        data = os.urandom(1000)
+        content = Base64Content(data, chunk_size=100)
+        self.assertEqual(b"".join(content), base64.b64encode(data))
+        self.assertEqual(len(content), len(base64.b64encode(data)))
+        self.assertEqual(content, base64.b64encode(data).decode("ascii"))
+
+    def test_text_is_utf8_encoded(self):
+        self.assertEqual(str(Base64Content(u"caf\xe9")), "Y2Fmw6k=")
+
+    def test_encoded_chunks_are_slices(self):
+        data = os.urandom(1000)
+        encoded = base64.b64encode(data)
+        content = Base64Content(data, chunk_size=300, encoded=encoded)
+        chunks = list(content)
+        self.assertEqual(len(chunks[0]), 400)
+        self.assertEqual(b"".join(chunks), encoded)
+        self.assertEqual(str(content), encoded.decode("ascii"))
+
+
+class AttachmentCacheTests(TestCase):
+    def test_identical_contents_are_encoded_once(self):
+        cache = LRUCache(100, maxbytes=10000)
+        data = os.urandom(300)
+        first = encode_content(data, cache=cache)
+        second = encode_content(bytes(bytearray(data)), cache=cache)
+        self.assertEqual(first, base64.b64encode(data).decode("ascii"))
+        self.assertEqual(second, first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        streamed = encode_content(data, stream=True, cache=cache)
+        self.assertEqual(streamed, first)
+        self.assertEqual(cache.hits, 2)
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        cache = LRUCache(100, maxbytes=1000)
+        contents = [os.urandom(300) for i in range(3)]
+        for data in contents:
+            encode_content(data, cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 800)
+        encode_content(contents[0], cache=cache)
+        self.assertEqual(cache.hits, 0)
+        encode_content(os.urandom(3000), cache=cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_backend_shares_cache(self):
+        data = os.urandom(1000)
+        with self.settings(
+            SENDGRID_API_KEY="test_key", SENDGRID_ATTACHMENT_CACHE=True,
+        ):
+            backend = SendGridBackend()
+            backend.attachment_cache.clear()
+            self.assertIs(
+                SendGridBackend().attachment_cache, backend.attachment_cache)
+            for i in range(3):
+                msg = EmailMessage(to=["test%d@example.com" % i])
+                msg.attach("terms.pdf", data, "application/pdf")
+                mail = backend._build_sg_mail(msg)
+        self.assertEqual(
+            mail["attachments"][0]["content"],
+            base64.b64encode(data).decode("ascii"))
+        self.assertEqual(backend.attachment_cache.hits, 2)
+
+
+class StreamingBodyTests(TestCase):
+    def _mail(self, data):
+        return {
+            "subject": u"Caf\xe9 report",
+            "attachments": [
+                {"content": Base64Content(data, chunk_size=30), "filename": "a"},
+                {"content": "YQ==", "filename": "b"},
+            ],
+        }
+
+    def test_body_matches_json(self):
+        mail = self._mail(os.urandom(100))
+        expected = json.dumps(materialize(mail)).encode("utf-8")
+        body = StreamingBody(mail)
+        self.assertEqual(len(body), len(expected))
+        chunks = []
+        while True:
+            chunk = body.read(7)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), expected)
+        body.seek(0)
+        self.assertEqual(body.read(), expected)
+
+    def test_chunks_are_not_copied(self):
+        data = os.urandom(3000)
+        encoded = base64.b64encode(data)
+        body = StreamingBody({"attachments": [
+            {"content": Base64Content(data, chunk_size=300, encoded=encoded)},
+        ]})
+        chunks = list(body.chunks())
+        self.assertEqual(chunks[0], b'{"attachments": [{"content": "')
+        self.assertTrue(all(isinstance(c, memoryview) for c in chunks[1:-1]))
+        self.assertEqual(b"".join(chunks), body.read())
+        self.assertEqual(sum(len(c) for c in chunks), len(body))
+        self.assertEqual(next(sgpool._message_body(body)), chunks[0])
+
+    def test_peak_memory_is_bounded(self):
+        data = os.urandom(6 * 1024 * 1024)
+        body = StreamingBody({"attachments": [{"content": Base64Content(data)}]})
+        tracemalloc.start()
+        try:
+            while body.read(8192):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1024 * 1024)
+
+
+class SendGridBackendStreamingTests(TestCase):
+    def _message(self):
+        msg = EmailMessage(to=["test@example.com"])
+        msg.attach("report.pdf", os.urandom(1000), "application/pdf")
+        return msg
+
+    def _build(self, msg, **settings):
+        with self.settings(SENDGRID_API_KEY="test_key", **settings):
+            return SendGridBackend()._build_sg_mail(msg)
+
+    def test_streamed_payload_matches(self):
+        msg = self._message()
+        expected = self._build(msg)
+        mail = self._build(msg, SENDGRID_STREAM_ATTACHMENTS=True)
+        direct = self._build(
+            msg, SENDGRID_STREAM_ATTACHMENTS=True, SENDGRID_PAYLOAD_BUILDER="direct")
+        self.assertIsInstance(mail["attachments"][0]["content"], Base64Content)
+        self.assertEqual(mail, expected)
+        self.assertEqual(direct, expected)
+
+    def test_streamed_mime_attachment_is_decoded(self):
+        msg = EmailMessage(to=["test@example.com"])
+        msg.attach(MIMEApplication(b"\x00\x01binary", Name="part.bin"))
+        mail = self._build(msg, SENDGRID_STREAM_ATTACHMENTS=True)
+        self.assertEqual(
+            str(mail["attachments"][0]["content"]),
+            base64.b64encode(b"\x00\x01binary").decode("ascii"),
+        )
+
+    def test_streams_without_pool(self):
+        msg = self._message()
+        with StubServer() as server:
+            with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_STREAM_ATTACHMENTS=True
+            ):
+                backend = SendGridBackend()
+                backend.sg.host = server.url
+                self.assertEqual(backend.send_messages([msg]), 1)
+                self.assertEqual(backend.send_messages([msg]), 1)
+                expected = materialize(backend._build_sg_mail(msg))
+        self.assertEqual(server.bodies, [expected, expected])
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(
+            server.headers[0]["Content-Length"],
+            str(len(json.dumps(expected))))
+        self.assertEqual(msg.sendgrid_result.message_id, "message-2")
+
+    def test_streams_through_pool(self):
+        msg = self._message()
+        try:
+            with StubServer() as server:
+                with self.settings(
+                    SENDGRID_API_KEY="test_key", SENDGRID_STREAM_ATTACHMENTS=True
+                ):
+                    backend = SendGridBackend(use_pool=True)
+                    backend.sg.host = server.url
+                    self.assertEqual(backend.send_messages([msg]), 1)
+                    expected = materialize(backend._build_sg_mail(msg))
+            self.assertEqual(server.bodies, [expected])
+        finally:
+            sgpool.close_pools()
@@ -0,0 +1,231 @@
+import os
+import shutil
+import tempfile
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+
+from sgbackend import QueuedSendGridBackend, SendGridBackend
+from sgbackend.suppression import (
+    BloomFilter, FileSource, SuppressionList, TableSource,
+    get_suppression_list, normalize)
+
+from .helpers import mock_backend, posted
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class SuppressionTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "suppressed.txt")
+        self._write("w", "bounced@example.com\n", "Unsub@Example.com\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, mode, *lines):
+        with open(self.path, mode) as f:
+            f.writelines(lines)
+
+
+class SuppressionListTests(SuppressionTestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("User <User@Example.COM> "), "user@example.com")
+
+    def test_file(self):
+        suppression = SuppressionList(FileSource(self.path))
+        self.assertEqual(len(suppression), 2)
+        self.assertIn("Bounced <BOUNCED@example.com>", suppression)
+        self.assertIn("unsub@example.com", suppression)
+        self.assertNotIn("user@example.com", suppression)
+        self.assertEqual(
+            suppression.suppressed(["a@example.com", "bounced@example.com"]),
+            ["bounced@example.com"])
+
+    def test_csv_export(self):
+        self._write("w", "email,created\n", '"spam@example.com",1700000000\n')
+        suppression = SuppressionList(FileSource(self.path))
+        self.assertEqual(len(suppression), 1)
+        self.assertIn("spam@example.com", suppression)
+
+    def test_incremental_refresh(self):
+        suppression = SuppressionList(FileSource(self.path))
+        self._write("a", "new@example.com\n", "partial@exa")
+        suppression.refresh()
+        self.assertEqual(len(suppression), 3)
+        self.assertIn("new@example.com", suppression)
+        self._write("a", "mple.com\n")
+        suppression.refresh()
+        self.assertIn("partial@example.com", suppression)
+        self.assertIn("bounced@example.com", suppression)
+
+    def test_replaced_file_is_reloaded(self):
+        suppression = SuppressionList(FileSource(self.path))
+        self._write("w", "other@example.com\n")
+        suppression.refresh()
+        self.assertEqual(len(suppression), 1)
+        self.assertNotIn("bounced@example.com", suppression)
+
+    def test_refresh_interval(self):
+        suppression = SuppressionList(
+            FileSource(self.path), refresh_interval=60)
+        self._write("a", "new@example.com\n")
+        self.assertNotIn("new@example.com", suppression)
+        suppression.refreshed -= 60
+        self.assertIn("new@example.com", suppression)
+
+    def test_missing_file(self):
+        suppression = SuppressionList(FileSource(self.path + ".missing"))
+        self.assertEqual(len(suppression), 0)
+
+    def test_bloom_filter(self):
+        suppression = SuppressionList(
+            FileSource(self.path), bloom_capacity=1000)
+        self.assertIsInstance(suppression._index, BloomFilter)
+        self.assertIn("bounced@example.com", suppression)
+        self.assertNotIn("user@example.com", suppression)
+
+    def test_bloom_filter_error_rate(self):
+        bloom = BloomFilter(10000, 0.001)
+        for i in range(10000):
+            bloom.add("user%d@example.com" % i)
+        self.assertTrue(all(
+            "user%d@example.com" % i in bloom for i in range(10000)))
+        false_positives = sum(
+            "other%d@example.com" % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 30)
+
+    def test_table(self):
+        cursor = mock.MagicMock()
+        cursor.fetchall.side_effect = [
+            [(1, "bounced@example.com"), (2, None)],
+            [(3, "new@example.com")],
+        ]
+        connection = mock.MagicMock()
+        connection.ops.quote_name = lambda name: '"%s"' % name
+        connection.cursor.return_value.__enter__.return_value = cursor
+        with mock.patch("django.db.connections", {"default": connection}):
+            suppression = SuppressionList(TableSource("suppressions"))
+            suppression.refresh()
+        self.assertEqual(len(suppression), 2)
+        self.assertEqual(cursor.execute.call_args_list, [
+            mock.call('SELECT "id", "email" FROM "suppressions"'
+                      ' ORDER BY "id"', []),
+            mock.call('SELECT "id", "email" FROM "suppressions"'
+                      ' WHERE "id" > %s ORDER BY "id"', [2]),
+        ])
+
+    def test_table_reload_forgets_deleted_rows(self):
+        cursor = mock.MagicMock()
+        cursor.fetchall.side_effect = [
+            [(1, "bounced@example.com"), (2, "unsub@example.com")],
+            [],
+            # Row 1 was deleted.
+            [(2, "unsub@example.com")],
+        ]
+        connection = mock.MagicMock()
+        connection.ops.quote_name = lambda name: '"%s"' % name
+        connection.cursor.return_value.__enter__.return_value = cursor
+        with mock.patch("django.db.connections", {"default": connection}):
+            source = TableSource("suppressions", reload_interval=3600)
+            suppression = SuppressionList(source, refresh_interval=0)
+            suppression.refresh()
+            self.assertIn("bounced@example.com", suppression)
+            source.loaded -= 3600
+            suppression.refresh()
+        self.assertNotIn("bounced@example.com", suppression)
+        self.assertEqual(
+            suppression.suppressed(
+                ["bounced@example.com", "unsub@example.com"]),
+            ["unsub@example.com"])
+        self.assertEqual(cursor.execute.call_args_list[2], mock.call(
+            'SELECT "id", "email" FROM "suppressions" ORDER BY "id"', []))
+
+    def test_failed_refresh_keeps_index(self):
+        source = mock.Mock()
+        source.read.return_value = (True, ["bounced@example.com"])
+        suppression = SuppressionList(source, refresh_interval=1)
+        source.read.side_effect = RuntimeError("database is down")
+        suppression.refreshed -= 1
+        self.assertIn("bounced@example.com", suppression)
+        self.assertEqual(source.read.call_count, 2)
+        with self.assertRaises(RuntimeError):
+            suppression.refresh()
+
+    def test_get_suppression_list(self):
+        self.assertIsNone(get_suppression_list())
+        with self.settings(SENDGRID_SUPPRESSION_FILE=self.path):
+            suppression = get_suppression_list()
+            self.assertIs(get_suppression_list(), suppression)
+        self.assertIn("bounced@example.com", suppression)
+
+
+class SuppressedSendTests(SuppressionTestCase):
+    def _backend(self, cls=SendGridBackend, **settings):
+        return mock_backend(
+            cls, SENDGRID_SUPPRESSION_FILE=self.path, **settings)
+
+    def test_recipients_are_filtered(self):
+        for builder in ("helpers", "direct"):
+            backend = self._backend(SENDGRID_PAYLOAD_BUILDER=builder)
+            msg = EmailMessage(
+                from_email="sender@example.com",
+                to=["user@example.com", "Bounced <bounced@example.com>"],
+                cc=["unsub@example.com"], bcc=["other@example.com"])
+            self.assertEqual(backend.send_messages([msg]), 1)
+            personalization = posted(backend)[0]["personalizations"][0]
+            self.assertEqual(
+                personalization["to"], [{"email": "user@example.com"}])
+            self.assertNotIn("cc", personalization)
+            self.assertEqual(
+                personalization["bcc"], [{"email": "other@example.com"}])
+            self.assertEqual(msg.suppressed_recipients, [
+                "Bounced <bounced@example.com>", "unsub@example.com"])
+            self.assertEqual(msg.sendgrid_result.suppressed, 2)
+
+    def test_fully_suppressed_messages_are_skipped(self):
+        backend = self._backend()
+        suppressed = EmailMessage(
+            from_email="sender@example.com",
+            to=["bounced@example.com"], cc=["user@example.com"])
+        delivered = EmailMessage(
+            from_email="sender@example.com", to=["user@example.com"])
+        self.assertEqual(backend.send_messages([suppressed, delivered]), 1)
+        self.assertEqual(len(posted(backend)), 1)
+        self.assertTrue(suppressed.sendgrid_result.skipped)
+        self.assertFalse(suppressed.sendgrid_result.sent)
+        self.assertEqual(backend.failed_messages, [])
+        self.assertEqual(backend.stats.sent, 1)
+        self.assertEqual(backend.stats.skipped, 1)
+        self.assertEqual(backend.stats.suppressed, 1)
+
+    def test_batched(self):
+        backend = self._backend(SENDGRID_BATCH_PERSONALIZATIONS=True)
+        msgs = [
+            EmailMessage(subject="Hi", body="Body.",
+                         from_email="sender@example.com", to=[to])
+            for to in ("a@example.com", "bounced@example.com",
+                       "b@example.com")]
+        self.assertEqual(backend.send_messages(msgs), 2)
+        bodies = posted(backend)
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(
+            [p["to"] for p in bodies[0]["personalizations"]],
+            [[{"email": "a@example.com"}], [{"email": "b@example.com"}]])
+        self.assertTrue(msgs[1].sendgrid_result.skipped)
+
+    def test_queued(self):
+        outbox = os.path.join(self.tmpdir, "outbox.sqlite3")
+        backend = self._backend(
+            QueuedSendGridBackend, SENDGRID_OUTBOX_PATH=outbox)
+        msgs = [
+            EmailMessage(from_email="sender@example.com", to=[to])
+            for to in ("a@example.com", "unsub@example.com")]
+        self.assertEqual(backend.send_messages(msgs), 1)
+        self.assertEqual(backend.get_outbox().count(), 1)
+        self.assertTrue(msgs[1].sendgrid_result.skipped)
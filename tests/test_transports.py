@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase as TestCase
+from python_http_client.exceptions import HTTPError
+
+from sgbackend import SendGridBackend
+from sgbackend.transports import (
+    CaptureTransport, FakeTransport, HTTPTransport, Transport,
+    close_captures, get_transport)
+
+
+class RejectingTransport(Transport):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def send(self, mail, result=None, timeout=None):
+        raise HTTPError(400, "Bad Request", b'{"errors": []}', {})
+
+
+def _message(i=0):
+    return EmailMessage(
+        subject="Hello", body="Body.", from_email="sender@example.com",
+        to=["user%d@example.com" % i])
+
+
+class TransportTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "capture.jsonl")
+
+    def tearDown(self):
+        close_captures()
+        shutil.rmtree(self.tmpdir)
+
+    def _backend(self, **settings):
+        with self.settings(SENDGRID_API_KEY="test_key", **settings):
+            return SendGridBackend()
+
+    def test_http_by_default(self):
+        backend = self._backend()
+        self.assertIsInstance(backend.transport, HTTPTransport)
+
+    def test_capture(self):
+        backend = self._backend(
+            SENDGRID_TRANSPORT="capture", SENDGRID_CAPTURE_PATH=self.path)
+        self.assertIsInstance(backend.transport, CaptureTransport)
+        messages = [_message(i) for i in range(3)]
+        self.assertEqual(backend.send_messages(messages), 3)
+        close_captures()
+        with open(self.path) as f:
+            bodies = [json.loads(line) for line in f]
+        self.assertEqual(
+            [b["personalizations"][0]["to"][0]["email"] for b in bodies],
+            ["user0@example.com", "user1@example.com", "user2@example.com"])
+        self.assertEqual(messages[0].sendgrid_result.status_code, 202)
+        self.assertTrue(messages[0].sendgrid_result.message_id)
+
+    def test_capture_is_shared_and_reopened(self):
+        first = self._backend(
+            SENDGRID_TRANSPORT="capture", SENDGRID_CAPTURE_PATH=self.path)
+        second = self._backend(
+            SENDGRID_TRANSPORT="capture", SENDGRID_CAPTURE_PATH=self.path)
+        self.assertIs(first.transport, second.transport)
+        first.send_messages([_message(1)])
+        close_captures()
+        first.send_messages([_message(2)])
+        close_captures()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_fake(self):
+        backend = self._backend(
+            SENDGRID_TRANSPORT="fake", SENDGRID_FAKE_LATENCY=0.01)
+        self.assertIsInstance(backend.transport, FakeTransport)
+        message = _message()
+        self.assertEqual(backend.send_messages([message]), 1)
+        self.assertEqual(message.sendgrid_result.status_code, 202)
+        self.assertGreaterEqual(message.sendgrid_result.latency, 0.01)
+
+    def test_dotted_path(self):
+        backend = self._backend(
+            SENDGRID_TRANSPORT="tests.test_transports.RejectingTransport")
+        backend.fail_silently = True
+        self.assertIsInstance(backend.transport, RejectingTransport)
+        self.assertIs(backend.transport.backend, backend)
+        message = _message()
+        self.assertEqual(backend.send_messages([message]), 0)
+        self.assertEqual(message.sendgrid_result.status_code, 400)
+        self.assertEqual(backend.failed_messages, [message])
+
+    def test_invalid(self):
+        with self.settings(SENDGRID_TRANSPORT="carrier.pigeon"):
+            with self.assertRaises(ImproperlyConfigured):
+                get_transport(None)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "requires async/await")
+class AsyncTransportTests(TestCase):
+    def test_fake(self):
+        import asyncio
+        try:
+            from sgbackend import AsyncSendGridBackend
+            import aiohttp  # noqa: F401
+        except ImportError:
+            self.skipTest("aiohttp is not installed")
+        with self.settings(
+                SENDGRID_API_KEY="test_key", SENDGRID_TRANSPORT="fake"):
+            backend = AsyncSendGridBackend()
+        messages = [_message(i) for i in range(5)]
+        count = asyncio.run(backend.asend_messages(messages))
+        self.assertEqual(count, 5)
+        self.assertTrue(all(m.sendgrid_result.message_id for m in messages))